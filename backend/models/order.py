@@ -26,6 +26,8 @@ class OrderItem(BaseModel):
     options: List[Dict] = Field(default_factory=list)
     total_price: float
     notes: Optional[str] = None
+    vat_rate: Optional[float] = None  # Renseignés par la tarification serveur
+    category_id: Optional[str] = None
 
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -40,7 +42,10 @@ class Order(BaseModel):
     total: float
     cashback_used: float = 0.0  # Montant de cashback utilisé pour payer
     cashback_earned: float = 0.0  # Montant de cashback gagné avec cette commande
+    promo_discount: float = 0.0  # Remise des promotions appliquées (tarification serveur)
+    applied_promotions: List[Dict] = Field(default_factory=list)
     status: str = OrderStatus.NEW
+    status_history: List[Dict] = Field(default_factory=list)  # {status, at, reason?} par transition
     payment_method: str = PaymentMethod.CARD
     payment_status: Optional[str] = None  # 'paid' (payé en ligne), 'pending' (à payer au restaurant), None (legacy)
     consumption_mode: str  # takeaway, on_site, delivery
@@ -55,9 +60,11 @@ class OrderCreate(BaseModel):
     customer_name: Optional[str] = None
     customer_phone: Optional[str] = None
     items: List[OrderItem]
-    subtotal: float
-    vat_amount: float
-    total: float
+    # Montants client : ignorés, recalculés par la tarification serveur
+    subtotal: Optional[float] = None
+    vat_amount: Optional[float] = None
+    total: Optional[float] = None
+    promo_code: Optional[str] = None
     use_cashback: bool = False  # Le client veut utiliser son cashback
     cashback_used: float = 0.0  # Sera calculé côté backend
     payment_method: str = PaymentMethod.CARD
@@ -69,3 +76,9 @@ class OrderCreate(BaseModel):
 class OrderStatusUpdate(BaseModel):
     status: str
     cancellation_reason: Optional[str] = None
+
+class OrderBulkStatusItem(OrderStatusUpdate):
+    order_id: str
+
+class OrderBulkStatusUpdate(BaseModel):
+    updates: List[OrderBulkStatusItem] = Field(..., min_length=1, max_length=200)
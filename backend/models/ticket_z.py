@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from datetime import datetime, timezone
 import uuid
 
@@ -11,6 +11,13 @@ class PaymentBreakdown(BaseModel):
     ticket_restaurant: float = 0.0
     online: float = 0.0
 
+class VatRateBreakdown(BaseModel):
+    """TVA collectée pour un taux (montants TTC, TVA incluse)."""
+    rate: float
+    base_ht: float = 0.0
+    vat_amount: float = 0.0
+    total_ttc: float = 0.0
+
 class TicketZ(BaseModel):
     """Modèle pour le Ticket Z (clôture de journée)."""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -29,6 +36,7 @@ class TicketZ(BaseModel):
     
     # TVA
     tva_collected: float = 0.0  # TVA collectée
+    tva_breakdown: List[VatRateBreakdown] = Field(default_factory=list)  # Détail par taux
     
     # Nombre de couverts
     covers_count: int = 0
@@ -4,7 +4,8 @@ from services.ai_service import generate_marketing_text, analyze_sales_data, ai_
 from pydantic import BaseModel
 from typing import Optional, Dict
 from database import db
-from datetime import datetime, timezone, timedelta
+from datetime import timedelta
+from utils.time_utils import day_range_query, local_today, since_query
 
 router = APIRouter(prefix="/ai", tags=["admin-ai"])
 
@@ -48,10 +49,9 @@ async def analyze_sales(current_user: dict = Security(require_manager_or_admin))
     restaurant_id = current_user.get("restaurant_id")
     
     # Get last 7 days data
-    seven_days_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
     orders = await db.orders.find({
         "restaurant_id": restaurant_id,
-        "created_at": {"$gte": seven_days_ago}
+        **since_query(timedelta(days=7))
     }).to_list(length=None)
     
     if not orders:
@@ -97,10 +97,9 @@ async def ai_chat_endpoint(request: ChatRequest):  # current_user: dict = Securi
     
     # Simple context gathering based on question
     if any(word in request.question.lower() for word in ["ca", "chiffre", "vente", "revenu"]):
-        today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
         today_orders = await db.orders.find({
             "restaurant_id": restaurant_id,
-            "created_at": {"$gte": today_start.isoformat()}
+            **day_range_query(local_today())
         }).to_list(length=None)
         context["today_revenue"] = sum(o.get("total", 0) for o in today_orders)
         context["today_orders"] = len(today_orders)
@@ -115,10 +114,9 @@ async def suggest_promo(current_user: dict = Security(require_manager_or_admin))
     restaurant_id = current_user.get("restaurant_id")
     
     # Get recent sales data
-    seven_days_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
     orders = await db.orders.find({
         "restaurant_id": restaurant_id,
-        "created_at": {"$gte": seven_days_ago}
+        **since_query(timedelta(days=7))
     }).to_list(length=None)
     
     sales_summary = f"Commandes 7 derniers jours: {len(orders)}, CA: {sum(o.get('total', 0) for o in orders):.2f}€"
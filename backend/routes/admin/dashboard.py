@@ -1,71 +1,36 @@
 from fastapi import APIRouter, Security
-from datetime import datetime, timedelta, timezone
 from middleware.auth import require_manager_or_admin
 from typing import Dict, List
 import os
 
 from database import db
+from services.daily_sales import get_daily_sales
+from services.order_events import order_events
+from services.product_sales import get_product_sales
+from services.response_cache import ResponseCache
+from utils.time_utils import local_today
 
 router = APIRouter(prefix="/dashboard", tags=["admin-dashboard"])
 
-# Get DB dependency
+# Compteurs du jour : quelques secondes, invalidés par les événements commandes
+DASHBOARD_TODAY_TTL_SECONDS = float(os.environ.get("DASHBOARD_TODAY_TTL_SECONDS", "5"))
+# Top produits sur 7 jours : évolue lentement
+DASHBOARD_TOP_PRODUCTS_TTL_SECONDS = float(os.environ.get("DASHBOARD_TOP_PRODUCTS_TTL_SECONDS", "300"))
 
-@router.get("/stats")
-async def get_dashboard_stats(current_user: dict = Security(require_manager_or_admin)):
-    """Get dashboard statistics."""
-    restaurant_id = current_user.get("restaurant_id")
-    
-    # Get today's date range
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
-    
-    # Get today's orders
-    today_orders = await db.orders.find({
-        "restaurant_id": restaurant_id,
-        "created_at": {"$gte": today_start.isoformat(), "$lt": today_end.isoformat()}
-    }).to_list(length=None)
-    
-    # Calculate CA today
-    ca_today = sum(order.get("total", 0) for order in today_orders)
-    
-    # Breakdown by payment method
-    payment_breakdown = {}
-    for order in today_orders:
-        payment_method = order.get("payment_method", "card")
-        payment_breakdown[payment_method] = payment_breakdown.get(payment_method, 0) + order.get("total", 0)
-    
-    # Count by status
-    status_count = {}
-    for order in today_orders:
-        status = order.get("status", "new")
-        status_count[status] = status_count.get(status, 0) + 1
-    
-    # Get last 7 days for top products
-    seven_days_ago = today_start - timedelta(days=7)
-    recent_orders = await db.orders.find({
-        "restaurant_id": restaurant_id,
-        "created_at": {"$gte": seven_days_ago.isoformat()}
-    }).to_list(length=None)
-    
-    # Calculate top 5 products
-    product_sales = {}
-    for order in recent_orders:
-        for item in order.get("items", []):
-            product_id = item.get("product_id")
-            product_name = item.get("name")
-            quantity = item.get("quantity", 0)
-            
-            if product_id not in product_sales:
-                product_sales[product_id] = {"name": product_name, "quantity": 0, "revenue": 0}
-            
-            product_sales[product_id]["quantity"] += quantity
-            product_sales[product_id]["revenue"] += item.get("total_price", 0)
-    
-    top_products = sorted(
-        product_sales.values(),
-        key=lambda x: x["quantity"],
-        reverse=True
-    )[:5]
+today_stats_cache = ResponseCache(DASHBOARD_TODAY_TTL_SECONDS)
+top_products_cache = ResponseCache(DASHBOARD_TOP_PRODUCTS_TTL_SECONDS)
+
+
+def _on_order_event(event_type: str, order: Dict):
+    today_stats_cache.invalidate(order.get("restaurant_id"))
+
+
+order_events.add_listener(_on_order_event)
+
+
+async def _today_stats(restaurant_id: str) -> Dict:
+    # Today's figures from the daily sales accumulator (no order scan)
+    sales = await get_daily_sales(db, local_today().isoformat(), restaurant_id)
     
     # Get out of stock products
     out_of_stock = await db.products.count_documents({
@@ -74,12 +39,42 @@ async def get_dashboard_stats(current_user: dict = Security(require_manager_or_a
     })
     
     return {
-        "ca_today": round(ca_today, 2),
-        "orders_today": len(today_orders),
-        "payment_breakdown": payment_breakdown,
-        "status_count": status_count,
+        # Calculate CA today
+        "ca_today": round(sum(sales["status_totals"].values()), 2),
+        "orders_today": sales["order_count"],
+        # Breakdown by payment method
+        "payment_breakdown": {method: round(amount, 2) for method, amount in sales["payment_totals"].items() if amount},
+        # Count by status
+        "status_count": {status: count for status, count in sales["status_counts"].items() if count},
+        "out_of_stock_count": out_of_stock
+    }
+
+
+async def _top_products(restaurant_id: str) -> List[Dict]:
+    # Top 5 products over the last 7 days (product_daily_sales rollup)
+    products = await get_product_sales(db, restaurant_id, days=7, sort_by="quantity", limit=5)
+    return [{"name": p["name"], "quantity": p["quantity"], "revenue": p["revenue"]} for p in products]
+
+
+@router.get("/stats")
+async def get_dashboard_stats(current_user: dict = Security(require_manager_or_admin)):
+    """
+    Get dashboard statistics.
+    Réponses en cache par restaurant : les onglets qui interrogent en même temps
+    partagent un seul calcul (services/response_cache.py).
+    """
+    restaurant_id = current_user.get("restaurant_id")
+    
+    today = await today_stats_cache.get(restaurant_id, lambda: _today_stats(restaurant_id))
+    top_products = await top_products_cache.get(restaurant_id, lambda: _top_products(restaurant_id))
+    
+    return {
+        "ca_today": today["ca_today"],
+        "orders_today": today["orders_today"],
+        "payment_breakdown": today["payment_breakdown"],
+        "status_count": today["status_count"],
         "top_products": top_products,
         "alerts": {
-            "out_of_stock_count": out_of_stock
+            "out_of_stock_count": today["out_of_stock_count"]
         }
     }
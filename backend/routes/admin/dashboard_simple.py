@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
-from datetime import datetime, timezone
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from services.daily_sales import get_daily_sales
+from utils.time_utils import local_today
 
 router = APIRouter()
 
@@ -18,37 +19,26 @@ async def get_simple_dashboard():
     - CA du jour
     """
     try:
-        # Date du jour (début et fin)
-        today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = datetime.now(timezone.utc).replace(hour=23, minute=59, second=59, microsecond=999999)
+        # Journée en cours dans le fuseau du restaurant
+        today = local_today()
         
-        today_start_str = today_start.isoformat()
-        today_end_str = today_end.isoformat()
+        # Accumulateur des ventes du jour (tous restaurants) : pas de relecture des commandes
+        sales = await get_daily_sales(db, today.isoformat())
+        status_counts = sales["status_counts"]
         
-        # Récupérer toutes les commandes du jour
-        orders = await db.orders.find({
-            "created_at": {
-                "$gte": today_start_str,
-                "$lte": today_end_str
-            }
-        }).to_list(length=None)
-        
-        # Compter les commandes traitées (completed)
-        completed_orders = [o for o in orders if o.get("status") == "completed"]
-        total_completed = len(completed_orders)
-        
-        # Calculer le CA du jour (commandes completed uniquement)
-        total_revenue = sum(o.get("total", 0) for o in completed_orders)
+        # Commandes traitées (completed) et CA du jour (commandes completed uniquement)
+        total_completed = status_counts.get("completed", 0)
+        total_revenue = sales["status_totals"].get("completed", 0)
         
         # Stats supplémentaires
-        pending_orders = len([o for o in orders if o.get("status") in ["new", "in_preparation"]])
+        pending_orders = status_counts.get("new", 0) + status_counts.get("in_preparation", 0)
         
         return {
-            "date": datetime.now(timezone.utc).date().isoformat(),
+            "date": today.isoformat(),
             "orders_completed_today": total_completed,
             "revenue_today": round(total_revenue, 2),
             "pending_orders": pending_orders,
-            "total_orders_today": len(orders)
+            "total_orders_today": sales["order_count"]
         }
         
     except Exception as e:
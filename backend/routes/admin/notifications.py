@@ -2,7 +2,7 @@ from fastapi import APIRouter, HTTPException, Security, status
 from typing import List
 from models.notification import Notification, NotificationCreate, NotificationUpdate
 from middleware.auth import require_manager_or_admin
-from datetime import datetime, timezone
+from utils.time_utils import utc_now
 from database import db
 
 router = APIRouter(prefix="/notifications", tags=["admin-notifications"])
@@ -23,9 +23,6 @@ async def create_notification(notif_create: NotificationCreate):  # current_user
     restaurant_id = "default"  # current_user.get("restaurant_id")
     notif = Notification(restaurant_id=restaurant_id, **notif_create.model_dump())
     notif_dict = notif.model_dump()
-    # Convert datetime to ISO string
-    if isinstance(notif_dict.get('created_at'), datetime):
-        notif_dict['created_at'] = notif_dict['created_at'].isoformat()
     await db.notifications.insert_one(notif_dict)
     notif_dict.pop("_id", None)
     return {"success": True, "notification": notif_dict}
@@ -42,7 +39,7 @@ async def send_notification(notif_id: str):  # current_user: dict = Security(req
         {"id": notif_id},
         {"$set": {
             "status": "sent",
-            "sent_at": datetime.now(timezone.utc).isoformat(),
+            "sent_at": utc_now(),
             "sent_count": 1  # Mock
         }}
     )
@@ -63,7 +60,7 @@ async def update_notification(notif_id: str, notif_update: NotificationUpdate):
         raise HTTPException(status_code=404, detail="Notification not found")
     
     update_data = notif_update.model_dump(exclude_unset=True)
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = utc_now()
     
     await db.notifications.update_one(
         {"id": notif_id},
@@ -1,11 +1,39 @@
-from fastapi import APIRouter, HTTPException, Security, status, Query
+from fastapi import APIRouter, HTTPException, Security, status, Query, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
-from models.order import Order, OrderStatusUpdate, OrderStatus
+import asyncio
+import json
+from models.order import Order, OrderStatusUpdate, OrderStatus, OrderBulkStatusUpdate
 from middleware.auth import require_manager_or_admin
-from datetime import datetime, timezone
-
+from pymongo import ReturnDocument
 from database import db
-from services.notification_service import send_order_notification
+from utils.time_utils import day_range_query, utc_now
+from services.notification_service import build_order_notification
+from services.notification_dispatcher import notification_dispatcher
+from services.promotion_usage import release_order_reservations
+from services.order_status import (
+    transition_order_status,
+    bulk_transition_order_status,
+    StatusTransitionError,
+    NOTIFICATION_MAP
+)
+from services.order_archive import find_order
+from services.daily_sales import record_status_changes, record_payment_change
+from services.product_sales import record_completed_orders
+from services.order_listing import (
+    list_orders_page,
+    encode_cursor,
+    InvalidCursor,
+    ORDER_LIST_PROJECTION,
+    ORDER_LIST_SORT
+)
+from services.order_events import (
+    order_events,
+    ACTIVE_STATUSES,
+    ORDER_EVENT_PROJECTION,
+    ORDER_STATUS_CHANGED,
+    ORDER_PAYMENT_CHANGED
+)
 
 router = APIRouter(prefix="/orders", tags=["admin-orders"])
 
@@ -24,11 +52,21 @@ async def get_orders(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     payment_method: Optional[str] = None,
-    limit: int = Query(100, le=500),
-    skip: int = 0
+    limit: int = Query(100, ge=1, le=500),
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    view: str = Query("full", pattern="^(compact|full)$"),
+    include_archive: bool = False
     # current_user: dict = Security(require_manager_or_admin)  # TEMPORAIREMENT DESACTIVE
 ):
-    """Get orders with filters."""
+    """
+    Get orders with filters.
+    Pagination : passer le next_cursor de la réponse pour la page suivante
+    (coût constant quelle que soit la profondeur). skip reste accepté pour
+    les anciens écrans. view=compact limite les champs aux écrans liste
+    (ORDER_LIST_PROJECTION) ; documents complets par défaut.
+    include_archive : inclut les commandes archivées (journées clôturées anciennes).
+    """
     restaurant_id = "default"  # current_user.get("restaurant_id")
     
     query = {"restaurant_id": restaurant_id}
@@ -40,14 +78,77 @@ async def get_orders(
         query["payment_method"] = payment_method
     
     if date_from and date_to:
-        query["created_at"] = {
-            "$gte": date_from,
-            "$lte": date_to
-        }
+        # Journées YYYY-MM-DD incluses, bornes dans le fuseau du restaurant
+        query.update(day_range_query(date_from, date_to))
+    
+    projection = {"_id": 0} if view == "full" else ORDER_LIST_PROJECTION
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(length=None)
+    if skip and not cursor:
+        # Ancienne pagination par offset (coût proportionnel à la profondeur)
+        orders = await db.orders.find(query, projection).sort(ORDER_LIST_SORT).skip(skip).limit(limit).to_list(length=None)
+        return {"orders": orders, "next_cursor": encode_cursor(orders[-1]) if len(orders) == limit else None}
     
-    return {"orders": orders}
+    try:
+        return await list_orders_page(db, query, limit, cursor, projection, include_archive)
+    except InvalidCursor as e:
+        # Le paramètre status masque fastapi.status ici
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Commentaire SSE envoyé sans événement pour garder la connexion ouverte (proxys)
+STREAM_HEARTBEAT_SECONDS = 15
+
+
+def _sse(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+@router.get("/stream")
+async def stream_orders(
+    request: Request
+    # current_user: dict = Security(require_manager_or_admin)  # TEMPORAIREMENT DESACTIVE
+):
+    """
+    Flux SSE pour les écrans cuisine / comptoir : un événement snapshot
+    (commandes en cours), puis order_created / order_status_changed / order_payment_changed.
+    Le flux se ferme si le client ne suit pas ; il doit alors se reconnecter.
+    """
+    restaurant_id = "default"  # current_user.get("restaurant_id")
+    
+    # Abonnement avant le snapshot : aucun événement perdu entre les deux
+    queue = order_events.subscribe()
+    
+    async def events():
+        try:
+            snapshot = await db.orders.find(
+                {"restaurant_id": restaurant_id, "status": {"$in": ACTIVE_STATUSES}},
+                ORDER_EVENT_PROJECTION
+            ).sort("created_at", 1).to_list(length=None)
+            yield _sse("snapshot", {"orders": snapshot, "source": order_events.source})
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    yield _sse("resync", {"reason": "overflow"})
+                    return
+                if event["order"].get("restaurant_id") != restaurant_id:
+                    continue
+                yield _sse(event["type"], event, event["seq"])
+        finally:
+            order_events.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/{order_id}", response_model=Order)
 async def get_order(
@@ -57,7 +158,7 @@ async def get_order(
     """Get single order."""
     restaurant_id = current_user.get("restaurant_id")
     
-    order = await db.orders.find_one({
+    order = await find_order(db, {
         "id": order_id,
         "restaurant_id": restaurant_id
     })
@@ -76,95 +177,87 @@ async def update_order_status(
     status_update: OrderStatusUpdate
     # current_user: dict = Security(require_manager_or_admin)  # TEMPORAIREMENT DESACTIVE
 ):
-    """Update order status with validation rules."""
+    """
+    Update order status with validation rules.
+    Compare-and-set en un aller-retour (services/order_status.py) : deux validations
+    simultanées ne peuvent pas réussir toutes les deux.
+    """
     restaurant_id = "default"  # current_user.get("restaurant_id")
-    
-    # Check if order exists
-    existing = await db.orders.find_one({
-        "id": order_id,
-        "restaurant_id": restaurant_id
-    })
-    
-    if not existing:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Order not found"
-        )
-    
-    current_status = existing.get("status")
     new_status = status_update.status
-    order_type = existing.get("order_type", "takeaway")
-    payment_status = existing.get("payment_status", "pending")
-    
-    # ===== VALIDATION DES TRANSITIONS DE STATUTS =====
-    
-    # Définir les transitions valides
-    valid_transitions = {
-        "new": ["in_preparation", "canceled"],
-        "in_preparation": ["ready", "canceled"],
-        "ready": ["out_for_delivery", "completed", "canceled"] if order_type == "delivery" else ["completed", "canceled"],
-        "out_for_delivery": ["completed", "canceled"],
-        "completed": [],  # État final
-        "canceled": []    # État final
-    }
     
-    # Vérifier que le statut est valide
-    valid_statuses = ["new", "in_preparation", "ready", "out_for_delivery", "completed", "canceled"]
-    if new_status not in valid_statuses:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Statut invalide: {new_status}. Statuts valides: {', '.join(valid_statuses)}"
+    try:
+        updated_order, previous_status = await transition_order_status(
+            db,
+            order_id,
+            restaurant_id,
+            new_status,
+            cancellation_reason=status_update.cancellation_reason
         )
+    except StatusTransitionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     
-    # Vérifier que la transition est autorisée
-    if new_status not in valid_transitions.get(current_status, []):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Transition non autorisée: {current_status} → {new_status}. Transitions possibles depuis {current_status}: {', '.join(valid_transitions.get(current_status, []))}"
-        )
+    await record_status_changes(db, [(updated_order, previous_status)])
+    await record_completed_orders(db, [updated_order])
     
-    # ===== VALIDATION DU PAIEMENT POUR COMPLÉTION =====
+    # Libérer les utilisations de promotions réservées par la commande
+    if new_status == "canceled":
+        await release_order_reservations(db, order_id)
     
-    # Bloquer la complétion si la commande n'est pas payée
-    if new_status == "completed" and payment_status != "paid":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="❌ PAIEMENT REQUIS: Cette commande ne peut pas être terminée car elle n'est pas encore payée. Veuillez d'abord enregistrer le paiement."
-        )
-    
-    # Update status
-    update_data = {
-        "status": new_status,
-        "updated_at": datetime.now(timezone.utc).isoformat()
-    }
+    # Notification client en arrière-plan (fusionnée si un autre statut suit de près)
+    if new_status in NOTIFICATION_MAP:
+        notification = build_order_notification(updated_order, NOTIFICATION_MAP[new_status], restaurant_id)
+        notification_dispatcher.enqueue(db, notification, coalesce_key=f"order_status:{order_id}")
     
-    # Add cancellation reason if provided
-    if status_update.cancellation_reason:
-        update_data["cancellation_reason"] = status_update.cancellation_reason
+    order_events.publish(ORDER_STATUS_CHANGED, updated_order)
+    return {"success": True, "order": updated_order}
+
+@router.post("/bulk/status")
+async def bulk_update_order_status(
+    bulk_update: OrderBulkStatusUpdate
+    # current_user: dict = Security(require_manager_or_admin)  # TEMPORAIREMENT DESACTIVE
+):
+    """
+    Changer le statut de plusieurs commandes en une requête (rush cuisine).
+    Mêmes règles que PATCH /{order_id}/status, appliquées en un bulk_write ;
+    résultat par commande, les refus n'empêchent pas les autres transitions.
+    """
+    restaurant_id = "default"  # current_user.get("restaurant_id")
     
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": update_data}
+    results = await bulk_transition_order_status(
+        db,
+        restaurant_id,
+        [item.model_dump() for item in bulk_update.updates]
     )
     
-    # Envoyer notification selon le statut
-    notification_map = {
-        "in_preparation": "order_preparing",
-        "ready": "order_ready",
-        "out_for_delivery": "order_delivering",
-        "completed": "order_completed"
-    }
+    # Accumulateurs des ventes : un bulk_write pour tout le lot
+    transitioned = [result for result in results if result["success"]]
+    await record_status_changes(db, [(result["order"], result["previous_status"]) for result in transitioned])
+    await record_completed_orders(db, [result["order"] for result in transitioned])
     
-    if status_update.status in notification_map:
-        await send_order_notification(
-            order_id=order_id,
-            notification_type=notification_map[status_update.status],
-            restaurant_id=restaurant_id
-        )
+    for result in results:
+        if not result["success"]:
+            continue
+        order = result["order"]
+        new_status = result["status"]
+        
+        # Libérer les utilisations de promotions réservées par la commande
+        if new_status == "canceled":
+            await release_order_reservations(db, order["id"])
+        
+        # Notifications déposées ensemble : écrites par le dispatcher en un insert_many
+        if new_status in NOTIFICATION_MAP:
+            notification = build_order_notification(order, NOTIFICATION_MAP[new_status], restaurant_id)
+            notification_dispatcher.enqueue(db, notification, coalesce_key=f"order_status:{order['id']}")
+        
+        order_events.publish(ORDER_STATUS_CHANGED, order)
     
-    # Get updated order
-    updated_order = await db.orders.find_one({"id": order_id}, {"_id": 0})
-    return {"success": True, "order": updated_order}
+    succeeded = sum(1 for result in results if result["success"])
+    return {
+        "success": succeeded == len(results),
+        "updated": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
 
 @router.post("/{order_id}/payment")
 async def update_order_payment(
@@ -191,7 +284,7 @@ async def update_order_payment(
     update_data = {
         "payment_method": payment_update.payment_method,
         "payment_status": payment_update.payment_status,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": utc_now()
     }
     
     # Add amount_received and change_given if provided
@@ -200,10 +293,14 @@ async def update_order_payment(
     if payment_update.change_given is not None:
         update_data["change_given"] = payment_update.change_given
     
-    await db.orders.update_one(
+    # Document avant écriture : ancien mode de paiement pour l'accumulateur des ventes
+    before = await db.orders.find_one_and_update(
         {"id": order_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
     )
+    await record_payment_change(db, before or existing, payment_update.payment_method)
+    order_events.publish(ORDER_PAYMENT_CHANGED, {**existing, **update_data})
     
     # Si le paiement est confirmé (paid) et que la commande est terminée, créditer le cashback
     if payment_update.payment_status == "paid" and existing.get("status") == "completed":
@@ -242,13 +339,16 @@ async def update_order_payment(
                 
                 new_loyalty_points = result["new_balance"]
                 
-                # Envoyer la notification
-                from routes.notifications import send_loyalty_credited_notification
-                await send_loyalty_credited_notification(
-                    user_id=customer.get("id"),
-                    order_id=order_id,
-                    amount_credited=cashback_earned,
-                    total_points=new_loyalty_points
+                # Envoyer la notification (en arrière-plan)
+                from routes.notifications import build_loyalty_credited_notification, db as notifications_db
+                notification_dispatcher.enqueue(
+                    notifications_db,
+                    build_loyalty_credited_notification(
+                        user_id=customer.get("id"),
+                        order_id=order_id,
+                        amount_credited=cashback_earned,
+                        total_points=new_loyalty_points
+                    )
                 )
     
     return {"success": True, "message": "Payment updated successfully"}
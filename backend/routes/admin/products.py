@@ -5,6 +5,7 @@ from middleware.auth import require_manager_or_admin
 from datetime import datetime, timezone
 
 from database import db
+from services.pricing_service import catalog_cache
 
 router = APIRouter(prefix="/products", tags=["admin-products"])
 
@@ -72,6 +73,7 @@ async def create_product(
     )
     
     await db.products.insert_one(product.model_dump())
+    catalog_cache.invalidate()
     return {"success": True, "product": product.model_dump()}
 
 @router.put("/{product_id}")  # response_model=Product
@@ -103,6 +105,7 @@ async def update_product(
         {"id": product_id},
         {"$set": update_data}
     )
+    catalog_cache.invalidate()
     
     # Get updated product
     updated_product = await db.products.find_one({"id": product_id}, {"_id": 0})
@@ -127,4 +130,5 @@ async def delete_product(
             detail="Product not found"
         )
     
+    catalog_cache.invalidate()
     return {"success": True, "message": "Product deleted"}
@@ -1,11 +1,23 @@
 from fastapi import APIRouter, HTTPException, status, Body
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone, date, time
+from datetime import date, time
 from models.promotion import (
     Promotion, PromotionCreate, PromotionUpdate,
     PromotionUsageLog, PromotionType
 )
 from services.promotion_engine import PromotionEngine
+from services.promotion_cache import promotion_cache, CompiledPromotion
+from services.promotion_batch import (
+    simulate_batch, iter_order_carts, targets_customers, BatchSummary
+)
+from services.promotion_backtest import start_backtest, get_backtest_job
+from services.promotion_metrics import promotion_metrics
+from services.promotion_analytics import get_usage_overview, get_daily_usage, record_usage_rollups
+from services.promotion_lifecycle import reschedule_promotion_transitions
+from services.promotion_usage import (
+    reserve_promotion_usage, configure_usage_limit, PromotionLimitReached
+)
+from utils.time_utils import day_range_query, utc_now
 from database import db
 import logging
 
@@ -46,11 +58,7 @@ async def create_promotion(promo_create: PromotionCreate):
         promo = Promotion(restaurant_id=RESTAURANT_ID, **promo_create.model_dump())
         promo_dict = promo.model_dump()
         
-        # Sérialiser les dates/times
-        if isinstance(promo_dict.get('created_at'), datetime):
-            promo_dict['created_at'] = promo_dict['created_at'].isoformat()
-        if isinstance(promo_dict.get('updated_at'), datetime):
-            promo_dict['updated_at'] = promo_dict['updated_at'].isoformat()
+        # Sérialiser les dates/times (created_at/updated_at restent des datetime BSON)
         if isinstance(promo_dict.get('start_date'), date):
             promo_dict['start_date'] = promo_dict['start_date'].isoformat()
         if isinstance(promo_dict.get('end_date'), date):
@@ -62,6 +70,10 @@ async def create_promotion(promo_create: PromotionCreate):
         
         await db.promotions.insert_one(promo_dict)
         promo_dict.pop("_id", None)
+        if promo_dict.get("limit_total"):
+            await configure_usage_limit(db, promo_dict["id"], promo_dict["limit_total"])
+        promotion_cache.invalidate()
+        reschedule_promotion_transitions()
         
         return {"success": True, "promotion": promo_dict}
     except Exception as e:
@@ -78,7 +90,7 @@ async def update_promotion(promotion_id: str, promo_update: PromotionUpdate):
             raise HTTPException(status_code=404, detail="Promotion not found")
         
         update_data = promo_update.model_dump(exclude_unset=True)
-        update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+        update_data["updated_at"] = utc_now()
         
         # Sérialiser dates/times si présentes
         if "start_date" in update_data and isinstance(update_data["start_date"], date):
@@ -94,6 +106,13 @@ async def update_promotion(promotion_id: str, promo_update: PromotionUpdate):
             {"id": promotion_id, "restaurant_id": RESTAURANT_ID},
             {"$set": update_data}
         )
+        if "limit_total" in update_data:
+            # Redistribue le quota restant sur les compteurs
+            await configure_usage_limit(
+                db, promotion_id, update_data["limit_total"], existing.get("usage_count", 0)
+            )
+        promotion_cache.invalidate()
+        reschedule_promotion_transitions()
         
         updated_promo = await db.promotions.find_one({"id": promotion_id, "restaurant_id": RESTAURANT_ID})
         updated_promo.pop("_id", None)
@@ -114,6 +133,9 @@ async def delete_promotion(promotion_id: str):
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Promotion not found")
         
+        promotion_cache.invalidate()
+        reschedule_promotion_transitions()
+        
         return {"success": True, "message": "Promotion deleted"}
     except HTTPException:
         raise
@@ -125,21 +147,68 @@ async def delete_promotion(promotion_id: str):
 async def simulate_promotions(
     cart: Dict[str, Any] = Body(...),
     customer: Optional[Dict[str, Any]] = Body(None),
-    promo_code: Optional[str] = Body(None)
+    promo_code: Optional[str] = Body(None),
+    stacking_mode: str = Body("greedy"),
+    trace: bool = Body(False)
 ):
-    """Simule l'application des promotions sur un panier"""
+    """Simule l'application des promotions sur un panier (trace : détail par promotion)"""
     try:
         engine = PromotionEngine(db)
-        result = await engine.apply_promotions(cart, customer, promo_code)
+        result = await engine.apply_promotions(cart, customer, promo_code, stacking_mode, trace=trace)
         
         return {
             "success": True,
             "simulation": result
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error simulating promotions: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/simulate/batch")
+async def simulate_promotions_batch(
+    carts: Optional[List[Dict[str, Any]]] = Body(None),
+    date_from: Optional[str] = Body(None),
+    date_to: Optional[str] = Body(None),
+    promotion_ids: Optional[List[str]] = Body(None),
+    promo_code: Optional[str] = Body(None),
+    include_carts: bool = Body(False)
+):
+    """
+    Simule les promotions sur un lot de paniers ou sur l'historique de commandes (date_from → date_to).
+    Sans promotion_ids, les promotions actives sont utilisées ; sinon les promotions demandées
+    (brouillons compris) sont évaluées quelles que soient leurs dates de validité.
+    """
+    try:
+        if carts is None and not (date_from and date_to):
+            raise HTTPException(status_code=400, detail="Fournir 'carts' ou 'date_from' et 'date_to'")
+        
+        if promotion_ids:
+            promos_raw = await db.promotions.find(
+                {"id": {"$in": promotion_ids}, "restaurant_id": RESTAURANT_ID},
+                {"_id": 0}
+            ).to_list(length=None)
+            promotions = sorted((CompiledPromotion(p) for p in promos_raw), key=lambda p: p.priority, reverse=True)
+        else:
+            promotions = (await promotion_cache.get_snapshot(db)).promotions
+        
+        if carts is not None:
+            return {"success": True, "simulation": simulate_batch(promotions, carts, promo_code, include_carts)}
+        
+        # Rejeu de l'historique par lots, sans charger toutes les commandes en mémoire
+        summary = BatchSummary()
+        with_customers = any(targets_customers(p) for p in promotions)
+        async for chunk in iter_order_carts(db, day_range_query(date_from, date_to), with_customers=with_customers):
+            summary.add(simulate_batch(promotions, chunk, promo_code))
+        
+        return {"success": True, "simulation": summary.to_dict()}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error simulating promotions batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/analytics/overview")
 async def get_analytics_overview():
     """Récupère les analytics globales des promotions"""
@@ -150,40 +219,31 @@ async def get_analytics_overview():
             "status": "active"
         })
         
-        # Total utilisation
-        usage_logs = await db.promotion_usage_log.find({}).to_list(length=None)
-        total_usage = len(usage_logs)
-        
-        # CA généré
-        total_revenue = sum(log.get("original_amount", 0) for log in usage_logs)
-        
-        # Remise totale
-        total_discount = sum(log.get("discount_amount", 0) for log in usage_logs)
-        
-        # Panier moyen
-        avg_cart = total_revenue / total_usage if total_usage > 0 else 0
-        
-        # Top 5 promos
-        promo_usage = {}
-        for log in usage_logs:
-            promo_id = log.get("promotion_id")
-            if promo_id:
-                promo_usage[promo_id] = promo_usage.get(promo_id, 0) + 1
-        
-        top_promos = sorted(promo_usage.items(), key=lambda x: x[1], reverse=True)[:5]
+        # Utilisation, CA, remises et top 5 : lus dans les rollups (un document par promotion)
+        overview = await get_usage_overview(db)
         
         return {
             "active_promotions": active_count,
-            "total_usage": total_usage,
-            "total_revenue": total_revenue,
-            "total_discount": total_discount,
-            "average_cart": avg_cart,
-            "top_promotions": [{"promo_id": pid, "usage_count": count} for pid, count in top_promos]
+            **overview
         }
     except Exception as e:
         logger.error(f"Error getting analytics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/analytics/daily")
+async def get_analytics_daily(
+    promotion_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+):
+    """Utilisation journalière des promotions (rollups)"""
+    try:
+        days = await get_daily_usage(db, promotion_id, date_from, date_to)
+        return {"days": days, "count": len(days)}
+    except Exception as e:
+        logger.error(f"Error getting daily analytics: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/calendar")
 async def get_promotions_calendar(
     start_date: Optional[str] = None,
@@ -219,6 +279,17 @@ async def get_promotions_calendar(
         logger.error(f"Error getting calendar: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/metrics")
+async def get_promotion_metrics():
+    """Compteurs du moteur : évaluations, remises, rejets par raison, temps p50/p99"""
+    return {"success": True, "metrics": promotion_metrics.to_dict()}
+
+@router.delete("/metrics")
+async def reset_promotion_metrics():
+    """Remet les compteurs du moteur à zéro"""
+    promotion_metrics.reset()
+    return {"success": True, "message": "Metrics reset"}
+
 @router.get("/{promotion_id}")
 async def get_promotion(promotion_id: str):
     """Récupère une promotion par ID"""
@@ -246,8 +317,18 @@ async def log_promotion_usage(
     final_amount: float = Body(...),
     promo_code_used: Optional[str] = Body(None)
 ):
-    """Enregistre l'utilisation d'une promotion"""
+    """Enregistre l'utilisation d'une promotion (réservation atomique des limites)"""
     try:
+        promo_doc = await db.promotions.find_one({"id": promotion_id}, {"_id": 0})
+        if not promo_doc:
+            raise HTTPException(status_code=404, detail="Promotion not found")
+        
+        # Réserve avant d'enregistrer : refus si limit_total / limit_per_customer atteinte
+        try:
+            await reserve_promotion_usage(db, CompiledPromotion(promo_doc), order_id, customer_id)
+        except PromotionLimitReached as e:
+            raise HTTPException(status_code=409, detail=f"Usage limit reached ({e.reason})")
+        
         log = PromotionUsageLog(
             promotion_id=promotion_id,
             order_id=order_id,
@@ -259,22 +340,49 @@ async def log_promotion_usage(
         )
         
         log_dict = log.model_dump()
-        if isinstance(log_dict.get('created_at'), datetime):
-            log_dict['created_at'] = log_dict['created_at'].isoformat()
         
         await db.promotion_usage_log.insert_one(log_dict)
-        
-        # Incrémenter usage_count
-        await db.promotions.update_one(
-            {"id": promotion_id},
-            {"$inc": {"usage_count": 1}}
-        )
+        await record_usage_rollups(db, log_dict)
+        # usage_count du document promotion : consolidé par le scheduler (pas de document chaud)
         
         return {"success": True, "message": "Usage logged"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error logging usage: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/{promotion_id}/backtest")
+async def backtest_promotion(
+    promotion_id: str,
+    date_from: Optional[str] = Body(None),
+    date_to: Optional[str] = Body(None)
+):
+    """Lance le backtest d'une promotion sur l'historique des commandes (30 derniers jours par défaut)"""
+    try:
+        promo = await db.promotions.find_one(
+            {"id": promotion_id, "restaurant_id": RESTAURANT_ID},
+            {"_id": 0, "id": 1}
+        )
+        if not promo:
+            raise HTTPException(status_code=404, detail="Promotion not found")
+        
+        job = await start_backtest(db, promotion_id, date_from, date_to)
+        return {"success": True, "job": job}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error starting backtest: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/backtests/{job_id}")
+async def get_backtest(job_id: str):
+    """Suivi de progression / résultat d'un backtest"""
+    job = await get_backtest_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Backtest not found")
+    return {"job": job}
+
 @router.get("/test/run-all")
 async def run_automated_tests():
     """Lance tous les tests automatiques des promotions"""
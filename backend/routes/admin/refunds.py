@@ -3,6 +3,9 @@ from pydantic import BaseModel
 from typing import List
 from datetime import datetime, timezone
 from database import db
+from utils.time_utils import utc_now
+from services.daily_sales import record_refund
+from pymongo import ReturnDocument
 
 router = APIRouter(prefix="/orders", tags=["admin-refunds"])
 
@@ -60,19 +63,19 @@ async def refund_missing_items(
         if not customer:
             raise HTTPException(status_code=404, detail="Client non trouvé")
         
-        # Créditer la carte de fidélité
-        current_points = customer.get("loyalty_points", 0)
-        new_points = current_points + refund_amount
-        
-        await db.users.update_one(
+        # Créditer la carte de fidélité (atomique : pas de perte si un autre crédit est concurrent)
+        credited = await db.users.find_one_and_update(
             {"email": customer_email},
             {
-                "$set": {
-                    "loyalty_points": new_points,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+                "$inc": {"loyalty_points": refund_amount},
+                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+            },
+            projection={"_id": 0, "loyalty_points": 1},
+            return_document=ReturnDocument.AFTER
         )
+        if not credited:
+            raise HTTPException(status_code=404, detail="Client non trouvé")
+        new_points = credited["loyalty_points"]
         
         # Mettre à jour la commande
         await db.orders.update_one(
@@ -82,12 +85,15 @@ async def refund_missing_items(
                     "items": items,
                     "refund_amount": refund_amount,
                     "refund_reason": request.reason,
-                    "refunded_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    "refunded_at": utc_now(),
+                    "updated_at": utc_now()
                 }
             }
         )
         
+        # refund_amount de la commande est remplacé : l'accumulateur suit l'écart
+        await record_refund(db, order, refund_amount - (order.get("refund_amount") or 0))
+        
         # Créer une transaction de fidélité
         await db.loyalty_transactions.insert_one({
             "user_email": customer_email,
@@ -3,6 +3,7 @@ from models.settings import RestaurantSettings, SettingsUpdate
 from middleware.auth import require_admin
 from datetime import datetime, timezone
 from database import db
+from services.cashback_service import invalidate_settings_cache
 
 router = APIRouter(prefix="/settings", tags=["admin-settings"])
 
@@ -37,6 +38,7 @@ async def update_settings(settings_update: SettingsUpdate):  # current_user: dic
         {"$set": update_data},
         upsert=True
     )
+    invalidate_settings_cache()
     
     updated = await db.settings.find_one({"restaurant_id": restaurant_id})
     return RestaurantSettings(**updated)
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timezone, timedelta
 from database import db
+from services.pricing_service import catalog_cache
 
 router = APIRouter(prefix="/products", tags=["admin-stock"])
 
@@ -55,6 +56,7 @@ async def update_stock_status(product_id: str, status_update: StockStatusUpdate)
                 }
             }
         )
+        catalog_cache.invalidate()
         
         return {
             "success": True,
@@ -100,6 +102,9 @@ async def check_and_resume_stock():
             )
             resumed_count += 1
         
+        if resumed_count:
+            catalog_cache.invalidate()
+        
         return {
             "success": True,
             "resumed_count": resumed_count,
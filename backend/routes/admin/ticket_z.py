@@ -6,6 +6,10 @@ import os
 
 from models.ticket_z import TicketZ, TicketZCreate, DailyStatus, PaymentBreakdown
 from database import get_db
+from pymongo.errors import DuplicateKeyError
+from services.ticket_z_service import summarize_day
+from services.daily_sales import get_daily_sales, pending_orders
+from utils.time_utils import local_day_bounds
 
 router = APIRouter(prefix="/ticket-z", tags=["admin-ticket-z"])
 
@@ -25,89 +29,48 @@ async def create_ticket_z(
     if existing:
         raise HTTPException(status_code=400, detail="Cette journée a déjà été clôturée")
     
-    # Récupérer toutes les commandes de cette journée
-    orders = await db.orders.find({
-        "created_at": {
-            "$gte": f"{data.date}T00:00:00",
-            "$lt": f"{data.date}T23:59:59"
-        }
-    }).to_list(length=None)
+    # Chiffres de la journée : une agrégation côté MongoDB
+    summary = await summarize_day(db, data.date)
     
     # Vérifier que toutes les commandes sont terminées ou annulées
-    pending_orders = [o for o in orders if o.get('status') not in ['completed', 'cancelled']]
-    if pending_orders:
+    if summary["pending_orders"]:
         raise HTTPException(
             status_code=400,
-            detail=f"Impossible de clôturer : {len(pending_orders)} commande(s) en attente. Toutes les commandes doivent être terminées ou annulées."
+            detail=f"Impossible de clôturer : {summary['pending_orders']} commande(s) en attente. Toutes les commandes doivent être terminées ou annulées."
         )
     
-    # Calculer les statistiques
-    completed = [o for o in orders if o.get('status') == 'completed']
-    cancelled = [o for o in orders if o.get('status') == 'cancelled']
-    
-    total_sales = sum(float(o.get('total', 0)) for o in completed)
-    
-    # Répartition par mode de paiement
-    payment_breakdown = PaymentBreakdown()
-    for order in completed:
-        # Si multi-paiement
-        if 'payments' in order and isinstance(order['payments'], list):
-            for payment in order['payments']:
-                method = payment.get('method', '')
-                amount = float(payment.get('amount', 0))
-                if method == 'espece':
-                    payment_breakdown.espece += amount
-                elif method == 'cb':
-                    payment_breakdown.cb += amount
-                elif method == 'cheque':
-                    payment_breakdown.cheque += amount
-                elif method == 'ticket_restaurant':
-                    payment_breakdown.ticket_restaurant += amount
-                elif method == 'online':
-                    payment_breakdown.online += amount
-        # Si paiement simple
-        elif 'payment_method' in order:
-            method = order.get('payment_method', '')
-            amount = float(order.get('total', 0))
-            if method == 'espece':
-                payment_breakdown.espece += amount
-            elif method == 'cb':
-                payment_breakdown.cb += amount
-            elif method == 'cheque':
-                payment_breakdown.cheque += amount
-            elif method == 'ticket_restaurant':
-                payment_breakdown.ticket_restaurant += amount
-            elif method == 'online':
-                payment_breakdown.online += amount
-    
-    # TVA (supposons 10% sur le total)
-    tva_collected = total_sales * 0.10
+    # Répartition par mode de paiement (rubriques inconnues ignorées)
+    payment_breakdown = PaymentBreakdown(**{
+        method: amount for method, amount in summary["payment_breakdown"].items()
+        if method in PaymentBreakdown.model_fields
+    })
     
     # Nombre de couverts (supposons nombre de commandes terminées)
-    covers_count = len(completed)
+    covers_count = summary["completed_orders"]
     
     # Créer le Ticket Z
     ticket_z = TicketZ(
         date=data.date,
         closed_by=user_email,
-        total_sales=total_sales,
-        total_orders=len(orders),
-        completed_orders=len(completed),
-        cancelled_orders=len(cancelled),
+        total_sales=summary["total_sales"],
+        total_orders=summary["total_orders"],
+        completed_orders=summary["completed_orders"],
+        cancelled_orders=summary["cancelled_orders"],
         payment_breakdown=payment_breakdown,
-        tva_collected=tva_collected,
+        tva_collected=summary["tva_collected"],
+        tva_breakdown=summary["vat_breakdown"],
         covers_count=covers_count
     )
     
     # Sauvegarder dans la base
+    # closed_at / created_at gardés en datetime BSON
     ticket_dict = ticket_z.dict()
-    # Convertir les datetimes en ISO string pour MongoDB
-    if isinstance(ticket_dict.get('closed_at'), datetime):
-        ticket_dict['closed_at'] = ticket_dict['closed_at'].isoformat()
-    if isinstance(ticket_dict.get('created_at'), datetime):
-        ticket_dict['created_at'] = ticket_dict['created_at'].isoformat()
     
-    await db.tickets_z.insert_one(ticket_dict)
+    try:
+        await db.tickets_z.insert_one(ticket_dict)
+    except DuplicateKeyError:
+        # Clôture concurrente de la même journée (index unique sur date)
+        raise HTTPException(status_code=400, detail="Cette journée a déjà été clôturée")
     
     return ticket_z
 
@@ -121,28 +84,20 @@ async def get_daily_status(
     # Vérifier si un Ticket Z existe pour cette date
     ticket_z = await db.tickets_z.find_one({"date": date})
     
-    # Récupérer les commandes de cette journée
-    orders = await db.orders.find({
-        "created_at": {
-            "$gte": f"{date}T00:00:00",
-            "$lt": f"{date}T23:59:59"
-        }
-    }).to_list(length=None)
-    
-    pending_orders = [o for o in orders if o.get('status') not in ['completed', 'cancelled']]
+    # Commandes en attente, depuis l'accumulateur de la journée (la clôture recompte)
+    pending = pending_orders(await get_daily_sales(db, date))
     
     # Déterminer si la clôture est nécessaire (après 4h du matin le lendemain)
     now = datetime.now(timezone.utc)
-    date_obj = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-    next_day_4am = date_obj + timedelta(days=1, hours=4)
+    next_day_4am = local_day_bounds(date)[1] + timedelta(hours=4)
     needs_closure = now >= next_day_4am and ticket_z is None
     
     status = DailyStatus(
         date=date,
         is_closed=ticket_z is not None,
         needs_closure=needs_closure,
-        pending_orders=len(pending_orders),
-        can_close=len(pending_orders) == 0,
+        pending_orders=pending,
+        can_close=pending == 0,
         ticket_z=TicketZ(**ticket_z) if ticket_z else None
     )
     
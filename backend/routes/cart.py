@@ -0,0 +1,66 @@
+"""
+Routes publiques pour le panier (tarification serveur)
+"""
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import Any, List, Optional
+from services.pricing_service import price_cart, PricingError
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+
+router = APIRouter()
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+client = AsyncIOMotorClient(MONGO_URL)
+db = client[os.environ.get('DB_NAME', 'test_database')]
+
+
+class CartItemSelection(BaseModel):
+    product_id: str
+    quantity: int = 1
+    options: List[Any] = Field(default_factory=list)  # ids d'options ou {"option_id": ...}
+    notes: Optional[str] = None
+
+
+class CartPriceRequest(BaseModel):
+    items: List[CartItemSelection]
+    customer_id: Optional[str] = None
+    customer_email: Optional[str] = None
+    promo_code: Optional[str] = None
+    use_cashback: bool = False
+
+
+async def find_customer(customer_id: Optional[str], customer_email: Optional[str]):
+    """Client par id ou, à défaut, par email"""
+    if customer_id:
+        return await db.customers.find_one({"id": customer_id}, {"_id": 0})
+    if customer_email:
+        return await db.customers.find_one({"email": customer_email}, {"_id": 0})
+    return None
+
+
+@router.post("/cart/price")
+async def price_cart_route(request: CartPriceRequest):
+    """
+    Tarifer un panier : prix catalogue, promotions, TVA et cashback en un seul appel
+    Remplace les appels séparés à /promotions/simulate et /cashback/preview
+    """
+    try:
+        customer = await find_customer(request.customer_id, request.customer_email)
+        
+        pricing = await price_cart(
+            db,
+            [item.model_dump() for item in request.items],
+            customer=customer,
+            promo_code=request.promo_code,
+            use_cashback=request.use_cashback
+        )
+        
+        return {
+            "success": True,
+            **pricing
+        }
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
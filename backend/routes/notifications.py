@@ -111,24 +111,30 @@ async def mark_all_as_read(user_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def build_loyalty_credited_notification(user_id: str, order_id: str, amount_credited: float, total_points: float) -> dict:
+    """
+    Document notification de crédit de fidélité (prêt pour db.notifications)
+    """
+    return PublicNotification(
+        user_id=user_id,
+        type="loyalty_credited",
+        title="🎉 Points de fidélité crédités !",
+        message=f"Merci pour ta commande, ta carte de fidélité a été crédité de {amount_credited:.2f} €!",
+        data={
+            "order_id": order_id,
+            "amount_credited": amount_credited,
+            "total_points": total_points
+        }
+    ).model_dump()
+
 async def send_loyalty_credited_notification(user_id: str, order_id: str, amount_credited: float, total_points: float):
     """
     Envoyer une notification de crédit de fidélité
     """
     try:
-        notification = PublicNotificationCreate(
-            user_id=user_id,
-            type="loyalty_credited",
-            title="🎉 Points de fidélité crédités !",
-            message=f"Merci pour ta commande, ta carte de fidélité a été crédité de {amount_credited:.2f} €!",
-            data={
-                "order_id": order_id,
-                "amount_credited": amount_credited,
-                "total_points": total_points
-            }
+        await db.notifications.insert_one(
+            build_loyalty_credited_notification(user_id, order_id, amount_credited, total_points)
         )
         
-        await create_notification(notification)
-        
     except Exception as e:
         print(f"Error sending loyalty notification: {e}")
@@ -1,15 +1,25 @@
 """
 Routes publiques pour les commandes
 """
-from fastapi import APIRouter, HTTPException
-from models.order import Order, OrderCreate
+from fastapi import APIRouter, HTTPException, Header
+from typing import Optional
+from models.order import Order, OrderCreate, OrderItem
 from services.cashback_service import (
-    calculate_cashback_earned,
-    calculate_cashback_to_use,
     deduct_cashback_from_customer,
     add_cashback_to_customer
 )
-from datetime import datetime, timezone
+from services.pricing_service import price_cart
+from services.sequence_service import allocate_order_number
+from services.order_events import order_events, ORDER_CREATED
+from services.order_archive import find_order, find_orders
+from services.daily_sales import record_order_created
+from utils.time_utils import utc_now
+from services.idempotency_service import idempotency_store, request_fingerprint, IdempotencyConflict
+from services.promotion_usage import (
+    reserve_applied_promotions,
+    release_order_reservations,
+    PromotionLimitReached
+)
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 
@@ -22,86 +32,130 @@ db = client[os.environ.get('DB_NAME', 'test_database')]
 
 async def generate_order_number():
     """Générer un numéro de commande unique"""
-    # Format: FD-XXXX
-    count = await db.orders.count_documents({})
-    return f"FD-{count + 2000:04d}"
+    # Format: FD-XXXX (séquence atomique, réservée par blocs)
+    return await allocate_order_number(db)
 
 
 @router.post("/orders")
-async def create_order(order_data: OrderCreate):
+async def create_order(
+    order_data: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """
     Créer une nouvelle commande avec gestion du cashback
+    Avec un header Idempotency-Key, un rejeu renvoie la réponse d'origine
+    sans nouvelle commande ni nouveau débit de cashback
     """
+    if not idempotency_key:
+        return await _create_order(order_data)
+    
     try:
-        # Générer le numéro de commande
-        order_number = await generate_order_number()
+        return await idempotency_store.run(
+            db,
+            f"orders:{idempotency_key}",
+            request_fingerprint(order_data.model_dump_json()),
+            lambda: _create_order(order_data)
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+async def _create_order(order_data: OrderCreate):
+    """
+    Création effective de la commande
+    Les montants sont recalculés côté serveur (même tarification que /cart/price)
+    """
+    try:
+        # Client (promotions ciblées + cashback)
+        customer = None
+        if order_data.customer_email:
+            customer = await db.customers.find_one({"email": order_data.customer_email}, {"_id": 0})
         
-        # Calculer le cashback gagné sur cette commande
-        cashback_earned = await calculate_cashback_earned(
-            subtotal=order_data.subtotal,
-            total_after_promos=order_data.total
+        # Tarification serveur : catalogue, promotions, TVA, cashback
+        pricing = await price_cart(
+            db,
+            [item.model_dump() for item in order_data.items],
+            customer=customer,
+            promo_code=order_data.promo_code,
+            use_cashback=order_data.use_cashback
         )
         
-        # Gérer l'utilisation du cashback
-        cashback_used = 0.0
-        final_total = order_data.total
+        # Générer le numéro de commande
+        order_number = await generate_order_number()
         
-        if order_data.use_cashback and order_data.customer_email:
-            # Trouver le client
-            customer = await db.customers.find_one({"email": order_data.customer_email})
-            
-            if customer:
-                customer_id = customer.get("id")
-                
-                # Calculer combien de cashback utiliser
-                cashback_calc = await calculate_cashback_to_use(
-                    customer_id,
-                    order_data.total
-                )
-                
-                cashback_used = cashback_calc["cashback_to_use"]
-                final_total = cashback_calc["remaining_to_pay"]
-                
-                # Déduire le cashback du compte client
-                if cashback_used > 0:
-                    await deduct_cashback_from_customer(customer_id, cashback_used)
+        cashback_earned = pricing["cashback"]["earned"]
+        cashback_used = pricing["cashback"]["to_use"]
+        final_total = pricing["amount_to_pay"]
         
         # Créer la commande
+        now = utc_now()
         order = Order(
             restaurant_id="family_restaurant_01",
             order_number=order_number,
             customer_email=order_data.customer_email,
             customer_name=order_data.customer_name,
             customer_phone=order_data.customer_phone,
-            items=order_data.items,
-            subtotal=order_data.subtotal,
-            vat_amount=order_data.vat_amount,
-            total=final_total,  # Total après utilisation du cashback
+            items=[OrderItem(**line) for line in pricing["items"]],
+            subtotal=pricing["subtotal"],
+            vat_amount=pricing["vat_amount"],
+            total=final_total,  # Total après promotions et utilisation du cashback
             cashback_used=cashback_used,
             cashback_earned=cashback_earned,
+            promo_discount=pricing["total_discount"],
+            applied_promotions=pricing["applied_promotions"],
             payment_method=order_data.payment_method,
             payment_status="pending",
             consumption_mode=order_data.consumption_mode,
             pickup_date=order_data.pickup_date,
             pickup_time=order_data.pickup_time,
             notes=order_data.notes,
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc)
+            status_history=[{"status": "new", "at": now}],
+            created_at=now,
+            updated_at=now
         )
         
-        # Sauvegarder dans la base
-        result = await db.orders.insert_one(order.dict())
+        # Réserver les utilisations des promotions appliquées (limites totales / par client)
+        customer_key = customer.get("id") if customer else order_data.customer_email
+        try:
+            await reserve_applied_promotions(db, pricing["applied_promotions"], order.id, customer_key)
+        except PromotionLimitReached as e:
+            await release_order_reservations(db, order.id)
+            raise HTTPException(status_code=409, detail=f"Promotion épuisée ({e.reason}), veuillez actualiser le panier")
+        
+        cashback_debited = False
+        try:
+            # Déduire le cashback du compte client (débit atomique, refusé si solde insuffisant)
+            if cashback_used > 0:
+                await deduct_cashback_from_customer(customer["id"], cashback_used)
+                cashback_debited = True
+            
+            # Sauvegarder dans la base
+            order_doc = order.dict()
+            await db.orders.insert_one(order_doc)
+        except Exception:
+            # Écritures compensatoires : la commande n'existe pas
+            if cashback_debited:
+                await add_cashback_to_customer(customer["id"], cashback_used)
+            await release_order_reservations(db, order.id)
+            raise
+        
+        await record_order_created(db, order_doc)
+        order_events.publish(ORDER_CREATED, order_doc)
         
         return {
             "success": True,
             "order_id": order.id,
             "order_number": order_number,
+            "subtotal": pricing["subtotal"],
+            "promo_discount": pricing["total_discount"],
             "total": final_total,
             "cashback_used": cashback_used,
             "cashback_earned": cashback_earned,
             "message": "Commande créée avec succès"
         }
         
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -115,7 +169,7 @@ async def get_order(order_id: str):
     Récupérer une commande par son ID
     """
     try:
-        order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+        order = await find_order(db, {"id": order_id}, {"_id": 0})
         
         if not order:
             raise HTTPException(status_code=404, detail="Commande non trouvée")
@@ -134,10 +188,14 @@ async def get_customer_orders(customer_email: str):
     Récupérer toutes les commandes d'un client
     """
     try:
-        orders = await db.orders.find(
+        # Historique complet : commandes récentes et archivées
+        orders = await find_orders(
+            db,
             {"customer_email": customer_email},
-            {"_id": 0}
-        ).sort("created_at", -1).to_list(length=50)
+            {"_id": 0},
+            sort=[("created_at", -1)],
+            limit=50
+        )
         
         return {
             "orders": orders,
@@ -0,0 +1,38 @@
+"""
+Script pour reconstruire les ventes par produit et par journée (product_daily_sales)
+depuis les commandes terminées, récentes et archivées (services/product_sales.py)
+
+Usage :
+    python scripts/backfill_product_sales.py                          # tout l'historique
+    python scripts/backfill_product_sales.py 2026-01-01 [2026-01-31]  # journées incluses
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.product_sales import rebuild_product_sales
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "familys_restaurant")
+
+
+async def main():
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+    dates = sys.argv[1:3]
+
+    print("🔄 Reconstruction des ventes par produit" + (f" ({' → '.join(dates)})" if dates else "") + "...")
+    result = await rebuild_product_sales(db, *dates)
+    print(f"✅ {result['orders']} commande(s), {result['rows']} ligne(s) produit/jour")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+"""
+Script pour créer les index MongoDB déclarés (services/index_registry.py)
+et comparer les index en base aux déclarations
+
+Usage :
+    python scripts/ensure_indexes.py           # crée les index manquants
+    python scripts/ensure_indexes.py --check   # rapport seul (manquants, non déclarés, inutilisés)
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.index_registry import ensure_indexes, check_indexes
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "familys_restaurant")
+
+
+def print_section(title, entries):
+    print(f"{title} ({len(entries)})")
+    for entry in entries:
+        print(f"   - {entry}")
+
+
+async def main():
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+    
+    failed = False
+    if "--check" not in sys.argv:
+        print("🔄 Création des index manquants...")
+        report = await ensure_indexes(db)
+        print_section("✅ Créés", report["created"])
+        print(f"   {len(report['existing'])} index déjà en place")
+        print_section("⚠️  Options différentes", report["conflicts"])
+        print_section("❌ Échecs", report["failed"])
+        failed = bool(report["failed"] or report["conflicts"])
+    
+    print("🔎 Vérification des index...")
+    report = await check_indexes(db)
+    print_section("❌ Manquants", report["missing"])
+    print_section("⚠️  Non déclarés", report["undeclared"])
+    print_section("💤 Inutilisés depuis le démarrage de mongod", report["unused"])
+    
+    client.close()
+    # Code retour non nul pour bloquer un déploiement
+    sys.exit(1 if failed or report["missing"] else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""
+Script pour convertir les horodatages chaîne ISO en datetime BSON
+(services/timestamp_migration.py), puis reconstruire les rollups promotions
+dont les journées sont désormais calculées dans le fuseau du restaurant
+
+Usage :
+    python scripts/migrate_timestamps.py             # convertit toutes les collections
+    python scripts/migrate_timestamps.py --dry-run   # compte sans écrire
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.promotion_analytics import rebuild_usage_rollups
+from services.timestamp_migration import migrate_timestamps
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "familys_restaurant")
+
+
+async def main():
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+    dry_run = "--dry-run" in sys.argv
+
+    print("🔄 Conversion des horodatages" + (" (simulation)" if dry_run else "") + "...")
+    results = await migrate_timestamps(db, dry_run=dry_run)
+    for name, counts in results.items():
+        print(f"   {name}: {counts['updated']} converti(s), {counts['unparsable']} illisible(s)")
+
+    if not dry_run:
+        print("🔄 Reconstruction des rollups promotions...")
+        result = await rebuild_usage_rollups(db)
+        print(f"✅ {result['promotions']} promotion(s), {result['days']} jour(s) reconstruits")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+"""
+Script pour reconstruire les rollups d'utilisation des promotions
+(promotion_usage_rollups / promotion_usage_daily) depuis promotion_usage_log
+
+Usage : python scripts/rebuild_promotion_rollups.py
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.promotion_analytics import rebuild_usage_rollups
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "familys_restaurant")
+
+
+async def main():
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+    
+    print("🔄 Reconstruction des rollups promotions...")
+    result = await rebuild_usage_rollups(db)
+    print(f"✅ {result['promotions']} promotion(s), {result['days']} jour(s) reconstruits")
+    
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
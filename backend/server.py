@@ -36,6 +36,7 @@ from routes.admin import dashboard_simple as admin_dashboard_simple
 from routes import notifications as notifications_routes
 from routes import cashback as cashback_routes
 from routes import orders as orders_routes
+from routes import cart as cart_routes
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -125,6 +126,9 @@ app.include_router(cashback_routes.router, prefix="/api/v1", tags=["cashback"])
 # Routes publiques pour orders
 app.include_router(orders_routes.router, prefix="/api/v1", tags=["orders"])
 
+# Routes publiques pour le panier (tarification serveur)
+app.include_router(cart_routes.router, prefix="/api/v1", tags=["cart"])
+
 # Include the routers in the main app
 app.include_router(api_router)
 app.include_router(admin_router)
@@ -158,6 +162,20 @@ async def startup_scheduler():
         logger.info("✅ Scheduler IA Marketing démarré avec succès")
     except Exception as e:
         logger.error(f"❌ Erreur démarrage scheduler: {str(e)}")
+    
+    from services.index_registry import ensure_indexes, ENSURE_INDEXES_ON_STARTUP
+    if ENSURE_INDEXES_ON_STARTUP:
+        try:
+            report = await ensure_indexes(db)
+            logger.info(
+                f"🗂️ Index MongoDB: {len(report['created'])} créé(s), {len(report['existing'])} en place, "
+                f"{len(report['conflicts']) + len(report['failed'])} en anomalie"
+            )
+        except Exception as e:
+            logger.error(f"❌ Erreur création des index: {str(e)}")
+    
+    from services.order_events import order_events
+    await order_events.start(db)
 
 @app.on_event("shutdown")
 async def shutdown_services():
@@ -168,4 +186,8 @@ async def shutdown_services():
         logger.info("🛑 Scheduler IA Marketing arrêté")
     except:
         pass
+    from services.order_events import order_events
+    await order_events.stop()
+    from services.notification_dispatcher import notification_dispatcher
+    await notification_dispatcher.stop()
     close_db()
\ No newline at end of file
@@ -4,6 +4,10 @@ from datetime import datetime, timezone, timedelta
 from typing import List, Dict
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 from database import db
+from services.promotion_analytics import get_usage_rollups
+from services.order_archive import find_orders
+from services.product_sales import get_category_sales, get_product_sales
+from utils.time_utils import day_range_query, utc_now
 import json
 
 EMERGENT_LLM_KEY = os.getenv("EMERGENT_LLM_KEY", "sk-emergent-13c430b876b353768F")
@@ -23,20 +27,21 @@ async def collect_restaurant_data(restaurant_id: str) -> Dict:
     """Collecte toutes les données nécessaires pour l'analyse."""
     
     # Derniers 30 jours
-    thirty_days_ago = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
-    seven_days_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
+    now = utc_now()
+    thirty_days_ago = now - timedelta(days=30)
+    seven_days_ago = now - timedelta(days=7)
     
     # Commandes récentes
     recent_orders = await db.orders.find({
         "restaurant_id": restaurant_id,
         "created_at": {"$gte": seven_days_ago}
-    }).to_list(length=None)
+    }, {"_id": 0, "total": 1}).to_list(length=None)
     
     # Commandes du mois précédent (pour comparaison)
     previous_month_orders = await db.orders.find({
         "restaurant_id": restaurant_id,
         "created_at": {"$gte": thirty_days_ago, "$lt": seven_days_ago}
-    }).to_list(length=None)
+    }, {"_id": 0, "total": 1}).to_list(length=None)
     
     # Produits
     products = await db.products.find({"restaurant_id": restaurant_id}).to_list(length=None)
@@ -58,40 +63,20 @@ async def collect_restaurant_data(restaurant_id: str) -> Dict:
     # Combiner les deux
     past_promos = past_promos_old + past_promos_v2
     
-    # Usage des promotions V2
-    promotion_usage_logs = await db.promotion_usage_log.find({}).to_list(length=None)
+    # Usage des promotions V2 (rollups : un document par promotion)
+    usage_rollups = await get_usage_rollups(db)
+    usage_by_promo = {r["promotion_id"]: r for r in usage_rollups}
     
     # Clients
     customers = await db.customers.find({"restaurant_id": restaurant_id}).to_list(length=None)
     
-    # Analyser les ventes par produit
-    product_sales = {}
-    for order in recent_orders:
-        for item in order.get("items", []):
-            pid = item.get("product_id")
-            if pid:
-                if pid not in product_sales:
-                    product_sales[pid] = {
-                        "quantity": 0,
-                        "revenue": 0,
-                        "name": item.get("name", "Unknown")
-                    }
-                product_sales[pid]["quantity"] += item.get("quantity", 0)
-                product_sales[pid]["revenue"] += item.get("total_price", 0)
-    
-    # Analyser les ventes par catégorie
-    category_sales = {}
-    for order in recent_orders:
-        for item in order.get("items", []):
-            cat_id = item.get("category_id")
-            if cat_id:
-                if cat_id not in category_sales:
-                    category_sales[cat_id] = {
-                        "quantity": 0,
-                        "revenue": 0
-                    }
-                category_sales[cat_id]["quantity"] += item.get("quantity", 0)
-                category_sales[cat_id]["revenue"] += item.get("total_price", 0)
+    # Ventes par produit (7 jours) et par catégorie (30 jours) : rollup product_daily_sales
+    top_products = await get_product_sales(db, restaurant_id, days=7, sort_by="revenue", limit=10)
+    product_sales = {
+        p["product_id"]: {"quantity": p["quantity"], "revenue": p["revenue"], "name": p["name"] or "Unknown"}
+        for p in top_products
+    }
+    category_sales = await get_category_sales(db, restaurant_id, days=30)
     
     # Clients inactifs (>14 jours sans commande)
     fourteen_days_ago = (datetime.now(timezone.utc) - timedelta(days=14)).isoformat()
@@ -105,14 +90,14 @@ async def collect_restaurant_data(restaurant_id: str) -> Dict:
     promo_performance = {}
     for promo in past_promos:
         promo_id = promo.get("id")
-        usage = [log for log in promotion_usage_logs if log.get("promotion_id") == promo_id]
-        if usage:
+        usage = usage_by_promo.get(promo_id)
+        if usage and usage.get("usage_count"):
             promo_performance[promo_id] = {
                 "name": promo.get("name") or promo.get("title", "Unknown"),
                 "type": promo.get("type", "unknown"),
-                "usage_count": len(usage),
-                "total_discount": sum(log.get("discount_amount", 0) for log in usage),
-                "total_revenue": sum(log.get("original_amount", 0) for log in usage)
+                "usage_count": usage["usage_count"],
+                "total_discount": usage.get("total_discount", 0),
+                "total_revenue": usage.get("original_amount", 0)
             }
     
     # Top 3 meilleures promos
@@ -126,11 +111,11 @@ async def collect_restaurant_data(restaurant_id: str) -> Dict:
         "avg_basket": round(total_ca_week / len(recent_orders), 2) if recent_orders else 0,
         "ca_trend": "hausse" if total_ca_week > total_ca_prev else "baisse",
         "ca_evolution_percent": round(((total_ca_week - total_ca_prev) / total_ca_prev * 100), 1) if total_ca_prev > 0 else 0,
-        "product_sales": dict(sorted(product_sales.items(), key=lambda x: x[1]["revenue"], reverse=True)[:10]),
+        "product_sales": product_sales,
         "category_sales": category_sales,
         "inactive_customers_count": len(inactive_customers),
         "past_promos_count": len(past_promos),
-        "promotion_usage_logs_count": len(promotion_usage_logs),
+        "promotion_usage_logs_count": sum(r.get("usage_count", 0) for r in usage_rollups),
         "top_performing_promos": top_promos,
         "products_count": len(products),
         "categories_count": len(categories)
@@ -161,7 +146,7 @@ Analyse ces données et génère {max_suggestions} campagnes marketing pertinent
 **Top produits vendus :**
 {json.dumps(data['product_sales'], indent=2, ensure_ascii=False)}
 
-**Ventes par catégorie :**
+**Ventes par catégorie (30 derniers jours) :**
 {json.dumps(data['category_sales'], indent=2, ensure_ascii=False)}
 
 **Objectifs prioritaires :** {', '.join(priority_objectives)}
@@ -373,11 +358,11 @@ async def calculate_campaign_results(campaign_id: str, restaurant_id: str) -> Di
     start = campaign.get("start_date")
     end = campaign.get("end_date")
     
-    # Commandes pendant la campagne
-    orders = await db.orders.find({
+    # Commandes pendant la campagne (journées YYYY-MM-DD incluses)
+    orders = await find_orders(db, {
         "restaurant_id": restaurant_id,
-        "created_at": {"$gte": start, "$lte": end}
-    }).to_list(length=None)
+        **day_range_query(start, end)
+    })
     
     total_ca = sum(o.get("total", 0) for o in orders)
     orders_count = len(orders)
@@ -3,22 +3,39 @@ Service pour gérer le système de cashback Family's
 """
 from typing import Dict, Optional
 import os
+from datetime import datetime, timezone, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = AsyncIOMotorClient(MONGO_URL)
 db = client[os.environ.get('DB_NAME', 'test_database')]
 
+# Les settings sont relus au plus toutes les SETTINGS_MAX_AGE_SECONDS (une lecture de moins par commande)
+SETTINGS_MAX_AGE_SECONDS = 60
+_settings_cache: Dict[str, any] = {"value": None, "expires_at": None}
+
+
+def invalidate_settings_cache():
+    """À appeler après modification des settings"""
+    _settings_cache["value"] = None
+
 
 async def get_settings():
     """Récupérer les settings du restaurant"""
+    now = datetime.now(timezone.utc)
+    if _settings_cache["value"] is not None and now < _settings_cache["expires_at"]:
+        return _settings_cache["value"]
+    
     settings = await db.settings.find_one({"restaurant_id": "family_restaurant_01"})
     if not settings:
         # Valeurs par défaut
-        return {
+        settings = {
             "loyalty_percentage": 5.0,
             "loyalty_exclude_promos_from_calculation": False
         }
+    _settings_cache["value"] = settings
+    _settings_cache["expires_at"] = now + timedelta(seconds=SETTINGS_MAX_AGE_SECONDS)
     return settings
 
 
@@ -104,6 +121,8 @@ async def deduct_cashback_from_customer(
 ) -> Dict[str, any]:
     """
     Déduire le cashback du solde du client
+    Débit atomique conditionnel ($inc si solde >= montant) : deux commandes
+    concurrentes ne peuvent pas dépenser le même solde.
     
     Args:
         customer_id: ID du client
@@ -112,29 +131,29 @@ async def deduct_cashback_from_customer(
     Returns:
         Dict avec success, old_balance, new_balance
     """
-    customer = await db.customers.find_one({"id": customer_id})
+    amount = round(amount, 2)
+    customer = await db.customers.find_one_and_update(
+        {"id": customer_id, "loyalty_points": {"$gte": amount}},
+        {"$inc": {"loyalty_points": -amount}},
+        projection={"_id": 0, "loyalty_points": 1},
+        return_document=ReturnDocument.AFTER
+    )
     
     if not customer:
-        raise ValueError("Client non trouvé")
-    
-    old_balance = customer.get("loyalty_points", 0.0)
-    
-    if old_balance < amount:
-        raise ValueError(f"Solde insuffisant. Disponible: {old_balance}€, demandé: {amount}€")
+        # Échec uniquement : relecture pour distinguer client absent et solde insuffisant
+        existing = await db.customers.find_one({"id": customer_id}, {"_id": 0, "loyalty_points": 1})
+        if not existing:
+            raise ValueError("Client non trouvé")
+        available = round(existing.get("loyalty_points", 0.0), 2)
+        raise ValueError(f"Solde insuffisant. Disponible: {available}€, demandé: {amount}€")
     
-    new_balance = old_balance - amount
-    
-    # Mettre à jour le solde
-    await db.customers.update_one(
-        {"id": customer_id},
-        {"$set": {"loyalty_points": round(new_balance, 2)}}
-    )
+    new_balance = customer["loyalty_points"]
     
     return {
         "success": True,
-        "old_balance": round(old_balance, 2),
+        "old_balance": round(new_balance + amount, 2),
         "new_balance": round(new_balance, 2),
-        "amount_deducted": round(amount, 2)
+        "amount_deducted": amount
     }
 
 
@@ -143,7 +162,7 @@ async def add_cashback_to_customer(
     amount: float
 ) -> Dict[str, any]:
     """
-    Ajouter du cashback au solde du client
+    Ajouter du cashback au solde du client (crédit atomique $inc)
     
     Args:
         customer_id: ID du client
@@ -152,25 +171,24 @@ async def add_cashback_to_customer(
     Returns:
         Dict avec success, old_balance, new_balance
     """
-    customer = await db.customers.find_one({"id": customer_id})
+    amount = round(amount, 2)
+    customer = await db.customers.find_one_and_update(
+        {"id": customer_id},
+        {"$inc": {"loyalty_points": amount}},
+        projection={"_id": 0, "loyalty_points": 1},
+        return_document=ReturnDocument.AFTER
+    )
     
     if not customer:
         raise ValueError("Client non trouvé")
     
-    old_balance = customer.get("loyalty_points", 0.0)
-    new_balance = old_balance + amount
-    
-    # Mettre à jour le solde
-    await db.customers.update_one(
-        {"id": customer_id},
-        {"$set": {"loyalty_points": round(new_balance, 2)}}
-    )
+    new_balance = customer["loyalty_points"]
     
     return {
         "success": True,
-        "old_balance": round(old_balance, 2),
+        "old_balance": round(new_balance - amount, 2),
         "new_balance": round(new_balance, 2),
-        "amount_added": round(amount, 2)
+        "amount_added": amount
     }
 
 
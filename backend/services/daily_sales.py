@@ -0,0 +1,209 @@
+"""
+Accumulateur des ventes par restaurant et par journée (collection daily_sales)
+Création de commande, changements de statut, paiement et remboursement appliquent un
+$inc atomique sur le document de la journée de la commande (fuseau du restaurant) :
+les tableaux de bord lisent un document au lieu de reparcourir les commandes.
+Un échec d'écriture n'interrompt pas la requête ; reconcile_daily_sales compare
+l'accumulateur aux commandes et corrige les écarts (job planifié).
+"""
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from services.index_registry import ensure_collection_indexes
+from services.ticket_z_service import CLOSED_STATUSES
+from utils.time_utils import day_range_query, local_date, local_today, utc_now
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAYMENT_METHOD = "card"
+DEFAULT_CONSUMPTION_MODE = "takeaway"
+# Écart toléré sur les montants (cumul de flottants)
+RECONCILE_TOLERANCE = 0.01
+
+COUNTER_FIELDS = ("order_count", "cashback_used", "cashback_earned", "refund_total")
+BREAKDOWN_FIELDS = ("status_counts", "status_totals", "payment_totals", "mode_totals")
+
+Key = Tuple[str, str]
+
+
+def _key(order: Dict[str, Any]) -> Optional[Key]:
+    day = local_date(order.get("created_at"))
+    return (order.get("restaurant_id"), day) if day else None
+
+
+def _amount(value: Any) -> float:
+    return float(value or 0)
+
+
+def _add(inc: Dict[str, float], field: str, value: float):
+    if value:
+        inc[field] = inc.get(field, 0) + value
+
+
+def created_increments(order: Dict[str, Any]) -> Dict[str, float]:
+    """Contribution d'une commande à l'accumulateur de sa journée"""
+    total = _amount(order.get("total"))
+    status = order.get("status") or "new"
+    inc: Dict[str, float] = {"order_count": 1, f"status_counts.{status}": 1}
+    _add(inc, f"status_totals.{status}", total)
+    _add(inc, f"payment_totals.{order.get('payment_method') or DEFAULT_PAYMENT_METHOD}", total)
+    _add(inc, f"mode_totals.{order.get('consumption_mode') or DEFAULT_CONSUMPTION_MODE}", total)
+    _add(inc, "cashback_used", _amount(order.get("cashback_used")))
+    _add(inc, "cashback_earned", _amount(order.get("cashback_earned")))
+    _add(inc, "refund_total", _amount(order.get("refund_amount")))
+    return inc
+
+
+def status_change_increments(order: Dict[str, Any], previous_status: Optional[str]) -> Dict[str, float]:
+    total = _amount(order.get("total"))
+    new_status = order.get("status")
+    inc: Dict[str, float] = {f"status_counts.{new_status}": 1}
+    _add(inc, f"status_totals.{new_status}", total)
+    if previous_status:
+        _add(inc, f"status_counts.{previous_status}", -1)
+        _add(inc, f"status_totals.{previous_status}", -total)
+    return inc
+
+
+async def _apply(db, increments: Iterable[Tuple[Optional[Key], Dict[str, float]]]):
+    merged: Dict[Key, Dict[str, float]] = {}
+    for key, inc in increments:
+        if key is None or not inc:
+            continue
+        target = merged.setdefault(key, {})
+        for field, value in inc.items():
+            target[field] = target.get(field, 0) + value
+    if not merged:
+        return
+
+    now = utc_now()
+    operations = [
+        UpdateOne(
+            {"restaurant_id": restaurant_id, "day": day},
+            {"$inc": inc, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for (restaurant_id, day), inc in merged.items()
+    ]
+    try:
+        await ensure_collection_indexes(db, "daily_sales")
+        await db.daily_sales.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # Corrigé à la prochaine réconciliation
+        logger.error(f"Accumulateur daily_sales non mis à jour: {e}")
+
+
+async def record_order_created(db, order: Dict[str, Any]):
+    await _apply(db, [(_key(order), created_increments(order))])
+
+
+async def record_status_changes(db, changes: List[Tuple[Dict[str, Any], Optional[str]]]):
+    """(commande après transition, statut de départ) renvoyés par order_status ; un seul bulk_write par lot"""
+    await _apply(db, [(_key(order), status_change_increments(order, previous)) for order, previous in changes])
+
+
+async def record_payment_change(db, before: Dict[str, Any], payment_method: str):
+    old_method = before.get("payment_method") or DEFAULT_PAYMENT_METHOD
+    if old_method == payment_method:
+        return
+    total = _amount(before.get("total"))
+    inc: Dict[str, float] = {}
+    _add(inc, f"payment_totals.{old_method}", -total)
+    _add(inc, f"payment_totals.{payment_method}", total)
+    await _apply(db, [(_key(before), inc)])
+
+
+async def record_refund(db, order: Dict[str, Any], refund_amount: float):
+    await _apply(db, [(_key(order), {"refund_total": refund_amount})])
+
+
+def empty_daily_sales(restaurant_id: Optional[str], day: str) -> Dict[str, Any]:
+    doc: Dict[str, Any] = {"restaurant_id": restaurant_id, "day": day}
+    doc.update({field: 0 for field in COUNTER_FIELDS})
+    doc.update({field: {} for field in BREAKDOWN_FIELDS})
+    return doc
+
+
+def _merge(target: Dict[str, Any], source: Dict[str, Any]):
+    for field in COUNTER_FIELDS:
+        target[field] = target.get(field, 0) + source.get(field, 0)
+    for field in BREAKDOWN_FIELDS:
+        breakdown = target.setdefault(field, {})
+        for name, value in (source.get(field) or {}).items():
+            breakdown[name] = breakdown.get(name, 0) + value
+
+
+async def get_daily_sales(db, day: Optional[str] = None, restaurant_id: Optional[str] = None) -> Dict[str, Any]:
+    """Chiffres d'une journée (aujourd'hui par défaut) ; tous restaurants confondus sans restaurant_id"""
+    day = day or local_today().isoformat()
+    query: Dict[str, Any] = {"day": day}
+    if restaurant_id is not None:
+        query["restaurant_id"] = restaurant_id
+    summary = empty_daily_sales(restaurant_id, day)
+    async for doc in db.daily_sales.find(query, {"_id": 0}):
+        _merge(summary, doc)
+    return summary
+
+
+def pending_orders(sales: Dict[str, Any]) -> int:
+    """Commandes ni terminées ni annulées"""
+    counts = sales.get("status_counts") or {}
+    return int(sales.get("order_count", 0) - sum(counts.get(status, 0) for status in CLOSED_STATUSES))
+
+
+async def compute_daily_sales(db, day: str) -> Dict[Optional[str], Dict[str, Any]]:
+    """Accumulateurs recalculés depuis les commandes de la journée, par restaurant"""
+    computed: Dict[Optional[str], Dict[str, Any]] = {}
+    async for order in db.orders.find(day_range_query(day), {
+        "_id": 0, "restaurant_id": 1, "created_at": 1, "status": 1, "total": 1, "payment_method": 1,
+        "consumption_mode": 1, "cashback_used": 1, "cashback_earned": 1, "refund_amount": 1
+    }):
+        doc = computed.setdefault(order.get("restaurant_id"), empty_daily_sales(order.get("restaurant_id"), day))
+        for field, value in created_increments(order).items():
+            name, _, sub = field.partition(".")
+            if sub:
+                doc[name][sub] = doc[name].get(sub, 0) + value
+            else:
+                doc[name] += value
+    return computed
+
+
+def _differs(stored: Dict[str, Any], computed: Dict[str, Any]) -> bool:
+    for field in COUNTER_FIELDS:
+        if abs(stored.get(field, 0) - computed[field]) > RECONCILE_TOLERANCE:
+            return True
+    for field in BREAKDOWN_FIELDS:
+        stored_values = stored.get(field) or {}
+        for name in set(stored_values) | set(computed[field]):
+            if abs(stored_values.get(name, 0) - computed[field].get(name, 0)) > RECONCILE_TOLERANCE:
+                return True
+    return False
+
+
+async def reconcile_daily_sales(db, day: Optional[str] = None) -> Dict[str, int]:
+    """
+    Compare les accumulateurs d'une journée aux commandes et remplace ceux qui divergent.
+    Une commande modifiée pendant le calcul peut laisser un écart : corrigé au passage suivant.
+    """
+    day = day or local_today().isoformat()
+    computed = await compute_daily_sales(db, day)
+    stored = {doc.get("restaurant_id"): doc async for doc in db.daily_sales.find({"day": day}, {"_id": 0})}
+
+    repaired = 0
+    now = utc_now()
+    for restaurant_id in set(computed) | set(stored):
+        expected = computed.get(restaurant_id) or empty_daily_sales(restaurant_id, day)
+        current = stored.get(restaurant_id)
+        if current is not None and not _differs(current, expected):
+            continue
+        if current is not None:
+            logger.warning(f"daily_sales {restaurant_id} {day} divergent, recalculé depuis les commandes")
+        await db.daily_sales.replace_one(
+            {"restaurant_id": restaurant_id, "day": day},
+            {**expected, "updated_at": now, "reconciled_at": now},
+            upsert=True
+        )
+        repaired += 1
+    return {"restaurants": len(computed), "repaired": repaired}
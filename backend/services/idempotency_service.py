@@ -0,0 +1,130 @@
+"""
+Clés d'idempotence (header Idempotency-Key) pour les créations rejouées par les clients mobiles
+- LRU process-local des réponses récentes : un rejeu ne touche pas MongoDB
+- requête identique en cours dans le même worker : attendue, pas ré-exécutée
+- collection idempotency_keys (index TTL) : partage entre workers et survie au redémarrage
+Seules les réponses réussies sont mémorisées ; un échec libère la clé.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from services.index_registry import ensure_collection_indexes
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_LRU_SIZE = 1024
+# Attente max d'une requête identique en cours dans un autre worker
+IDEMPOTENCY_WAIT_SECONDS = 15.0
+IDEMPOTENCY_POLL_SECONDS = 0.1
+
+
+class IdempotencyConflict(Exception):
+    """Clé réutilisée avec une requête différente, ou requête d'origine toujours en cours"""
+
+
+def request_fingerprint(payload: str) -> str:
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+
+    def __init__(self, lru_size: int = IDEMPOTENCY_LRU_SIZE):
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        # clé -> (empreinte, réponse à venir)
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    def _remember(self, key: str, fingerprint: str, response: Dict[str, Any]):
+        self._lru[key] = (fingerprint, response)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    @staticmethod
+    def _check(key: str, fingerprint: str, stored_fingerprint: str):
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflict(f"Clé d'idempotence {key} déjà utilisée pour une autre requête")
+
+    async def run(
+        self,
+        db,
+        key: str,
+        fingerprint: str,
+        handler: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Exécute handler une seule fois par clé ; les rejeux reçoivent la réponse mémorisée"""
+        cached = self._lru.get(key)
+        if cached:
+            self._check(key, fingerprint, cached[0])
+            self._lru.move_to_end(key)
+            return cached[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._check(key, fingerprint, inflight[0])
+            return await asyncio.shield(inflight[1])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        try:
+            response = await self._run_claimed(db, key, fingerprint, handler)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            # Évite l'avertissement "exception never retrieved" sans rejeu concurrent
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run_claimed(self, db, key, fingerprint, handler) -> Dict[str, Any]:
+        await ensure_collection_indexes(db, "idempotency_keys")
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "status": "in_progress",
+                "response": None,
+                "created_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            return await self._wait_completed(db, key, fingerprint)
+
+        try:
+            response = await handler()
+        except BaseException:
+            # Échec : la clé est libérée, un rejeu ré-exécutera la requête
+            await db.idempotency_keys.delete_one({"_id": key, "status": "in_progress"})
+            raise
+
+        await db.idempotency_keys.update_one(
+            {"_id": key},
+            {"$set": {"status": "completed", "response": response}}
+        )
+        self._remember(key, fingerprint, response)
+        return response
+
+    async def _wait_completed(self, db, key, fingerprint) -> Dict[str, Any]:
+        """Requête d'origine traitée par un autre worker (ou déjà terminée)"""
+        deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            doc = await db.idempotency_keys.find_one({"_id": key})
+            if doc is None:
+                raise IdempotencyConflict(f"Requête d'origine {key} échouée, veuillez réessayer")
+            self._check(key, fingerprint, doc.get("fingerprint"))
+            if doc.get("status") == "completed":
+                self._remember(key, fingerprint, doc["response"])
+                return doc["response"]
+            if asyncio.get_running_loop().time() >= deadline:
+                raise IdempotencyConflict(f"Requête {key} toujours en cours de traitement")
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+
+idempotency_store = IdempotencyStore()
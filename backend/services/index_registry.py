@@ -0,0 +1,217 @@
+"""
+Index MongoDB déclarés par collection
+Créés au démarrage (server.py) et par scripts/ensure_indexes.py au déploiement.
+La création est idempotente : seuls les index absents sont construits ; un conflit
+(mêmes clés, options différentes) ou des doublons bloquant un index unique sont
+signalés sans interrompre le démarrage.
+"""
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+ENSURE_INDEXES_ON_STARTUP = os.environ.get("ENSURE_INDEXES_ON_STARTUP", "1") == "1"
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+
+Keys = List[Tuple[str, int]]
+
+
+class IndexSpec:
+    """Un index : clés ordonnées et options create_index (unique, sparse, expireAfterSeconds...)"""
+
+    __slots__ = ("keys", "options")
+
+    def __init__(self, keys: Any, **options):
+        self.keys: Keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        self.options = options
+
+    def describe(self) -> str:
+        keys = ", ".join(f"{field}:{direction}" for field, direction in self.keys)
+        options = ", ".join(f"{k}={v}" for k, v in self.options.items())
+        return f"({keys})" + (f" [{options}]" if options else "")
+
+
+INDEXES: Dict[str, List[IndexSpec]] = {
+    "orders": [
+        IndexSpec("id", unique=True),
+        IndexSpec("order_number"),
+        # Liste admin paginée par curseur (services/order_listing.py)
+        IndexSpec([("restaurant_id", 1), ("created_at", -1), ("id", -1)]),
+        IndexSpec([("restaurant_id", 1), ("status", 1), ("created_at", -1)]),
+        IndexSpec([("customer_email", 1), ("created_at", -1)]),
+    ],
+    # Commandes des journées clôturées anciennes (services/order_archive.py)
+    "orders_archive": [
+        IndexSpec("id", unique=True),
+        IndexSpec([("restaurant_id", 1), ("created_at", -1), ("id", -1)]),
+        IndexSpec([("customer_email", 1), ("created_at", -1)]),
+        IndexSpec("created_at"),
+    ],
+    "customers": [
+        IndexSpec("id", unique=True),
+        IndexSpec("email"),
+        IndexSpec("phone", sparse=True),
+        IndexSpec("restaurant_id"),
+    ],
+    "users": [
+        IndexSpec("email", unique=True),
+    ],
+    "products": [
+        IndexSpec("id", unique=True),
+        IndexSpec([("restaurant_id", 1), ("category", 1)]),
+    ],
+    "promotions": [
+        IndexSpec("id", unique=True),
+        # Chargement du cache et bascules de statut (services/promotion_lifecycle.py)
+        IndexSpec([("status", 1), ("start_date", 1), ("end_date", 1)]),
+        IndexSpec([("status", 1), ("end_date", 1)]),
+    ],
+    "notifications": [
+        IndexSpec("id", unique=True),
+        IndexSpec([("user_id", 1), ("created_at", -1)]),
+        IndexSpec([("restaurant_id", 1), ("created_at", -1)]),
+        IndexSpec([("restaurant_id", 1), ("customer_id", 1), ("created_at", -1)]),
+    ],
+    "tickets_z": [
+        IndexSpec("date", unique=True),
+        IndexSpec([("archived_at", 1), ("date", 1)]),
+        IndexSpec("id", unique=True),
+    ],
+    "reservations": [
+        IndexSpec([("restaurant_id", 1), ("reservation_date", 1)]),
+    ],
+    "promotion_usage_log": [
+        IndexSpec([("promotion_id", 1), ("created_at", -1)]),
+    ],
+    # Réservations d'utilisation (services/promotion_usage.py)
+    "promotion_usage_counters": [
+        IndexSpec([("promotion_id", 1), ("stripe", 1)], unique=True),
+    ],
+    "promotion_customer_usage": [
+        IndexSpec([("promotion_id", 1), ("customer_id", 1)], unique=True),
+    ],
+    "promotion_reservations": [
+        IndexSpec([("promotion_id", 1), ("order_id", 1)], unique=True),
+        IndexSpec("order_id"),
+    ],
+    # Rollups (services/promotion_analytics.py) : unicité requise pour les upserts concurrents
+    "promotion_usage_rollups": [
+        IndexSpec("promotion_id", unique=True),
+    ],
+    "promotion_usage_daily": [
+        IndexSpec([("promotion_id", 1), ("day", 1)], unique=True),
+    ],
+    # Accumulateurs des ventes du jour (services/daily_sales.py) : upserts concurrents
+    "daily_sales": [
+        IndexSpec([("restaurant_id", 1), ("day", 1)], unique=True),
+        IndexSpec("day"),
+    ],
+    # Ventes par produit et par journée (services/product_sales.py)
+    "product_daily_sales": [
+        IndexSpec([("restaurant_id", 1), ("day", 1), ("product_id", 1)], unique=True),
+    ],
+    "idempotency_keys": [
+        IndexSpec("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS),
+    ],
+}
+
+# Options comparées entre l'index déclaré et l'index existant
+_COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+# (base, collection) déjà vérifiées : plusieurs bases coexistent dans un process
+_ensured: set = set()
+
+
+def _existing_keys(index: Dict[str, Any]) -> Keys:
+    return [(field, int(direction)) for field, direction in index["key"].items()]
+
+
+async def _existing_indexes(collection) -> List[Dict[str, Any]]:
+    try:
+        return await collection.list_indexes().to_list(length=None)
+    except OperationFailure:
+        # Collection inexistante
+        return []
+
+
+async def ensure_indexes(db, collections: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """
+    Crée les index déclarés absents.
+    Retourne {"created", "existing", "conflicts", "failed"} (descriptions "collection (clés)").
+    """
+    report: Dict[str, List[str]] = {"created": [], "existing": [], "conflicts": [], "failed": []}
+    for name in collections or INDEXES:
+        collection = db[name]
+        existing = await _existing_indexes(collection)
+        by_keys = {tuple(_existing_keys(index)): index for index in existing}
+
+        for spec in INDEXES.get(name, []):
+            label = f"{name} {spec.describe()}"
+            current = by_keys.get(tuple(spec.keys))
+            if current is not None:
+                differs = any(current.get(opt) != spec.options.get(opt) for opt in _COMPARED_OPTIONS)
+                report["conflicts" if differs else "existing"].append(label)
+                continue
+            try:
+                await collection.create_index(spec.keys, **spec.options)
+                report["created"].append(label)
+            except OperationFailure as e:
+                # Doublons existants sur un index unique, conflit de nom...
+                report["failed"].append(f"{label}: {e}")
+        _ensured.add((db.name, name))
+
+    for label in report["created"]:
+        logger.info(f"Index créé: {label}")
+    for label in report["conflicts"]:
+        logger.warning(f"Index existant avec des options différentes: {label}")
+    for label in report["failed"]:
+        logger.error(f"Index non créé: {label}")
+    return report
+
+
+async def ensure_collection_indexes(db, *collections: str):
+    """Garde paresseuse des services : une seule vérification par collection et par process"""
+    pending = [name for name in collections if (db.name, name) not in _ensured]
+    if pending:
+        await ensure_indexes(db, pending)
+
+
+async def check_indexes(db) -> Dict[str, List[str]]:
+    """
+    Compare les index en base aux déclarations, sans rien créer.
+    unused : index sans accès depuis le dernier redémarrage de mongod ($indexStats).
+    """
+    report: Dict[str, List[str]] = {"missing": [], "undeclared": [], "unused": []}
+    collection_names = await db.list_collection_names()
+    for name in collection_names:
+        collection = db[name]
+        declared = {tuple(spec.keys) for spec in INDEXES.get(name, [])}
+        existing = await _existing_indexes(collection)
+        present = set()
+
+        for index in existing:
+            keys = tuple(_existing_keys(index))
+            present.add(keys)
+            if index["name"] != "_id_" and keys not in declared:
+                report["undeclared"].append(f"{name} {index['name']}")
+
+        for spec in INDEXES.get(name, []):
+            if tuple(spec.keys) not in present:
+                report["missing"].append(f"{name} {spec.describe()}")
+
+        try:
+            async for stats in collection.aggregate([{"$indexStats": {}}]):
+                if stats["name"] != "_id_" and stats.get("accesses", {}).get("ops", 0) == 0:
+                    report["unused"].append(f"{name} {stats['name']}")
+        except OperationFailure:
+            # $indexStats indisponible (droits, stockage)
+            pass
+
+    for name in INDEXES:
+        if name not in collection_names:
+            report["missing"].extend(f"{name} {spec.describe()}" for spec in INDEXES[name])
+    return report
@@ -0,0 +1,161 @@
+"""
+File d'envoi des notifications en arrière-plan
+Les routes déposent une notification déjà construite (aucune relecture) et répondent
+sans attendre l'écriture. NOTIFICATION_WORKERS tâches vident la file par lots
+(insert_many), avec reprise exponentielle en cas d'échec. Les notifications de statut
+successives d'une même commande encore en file sont fusionnées : seule la dernière part.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_WORKERS = int(os.environ.get("NOTIFICATION_WORKERS", "2"))
+NOTIFICATION_QUEUE_SIZE = 1000
+NOTIFICATION_BATCH_SIZE = 50
+# Attente après la première notification d'un lot : regroupement et fusion des statuts
+NOTIFICATION_FLUSH_SECONDS = 0.2
+NOTIFICATION_MAX_RETRIES = 5
+NOTIFICATION_RETRY_BASE_SECONDS = 0.5
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class _Entry:
+    __slots__ = ("db", "doc", "coalesce_key")
+
+    def __init__(self, db, doc: Dict[str, Any], coalesce_key: Optional[str]):
+        self.db = db
+        self.doc = doc
+        self.coalesce_key = coalesce_key
+
+
+class NotificationDispatcher:
+
+    def __init__(
+        self,
+        workers: int = NOTIFICATION_WORKERS,
+        queue_size: int = NOTIFICATION_QUEUE_SIZE,
+        batch_size: int = NOTIFICATION_BATCH_SIZE,
+        flush_seconds: float = NOTIFICATION_FLUSH_SECONDS
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Clé de fusion -> entrée encore en attente d'écriture
+        self._pending: Dict[str, _Entry] = {}
+        self.stats = {"enqueued": 0, "coalesced": 0, "inserted": 0, "retried": 0, "dropped": 0}
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def enqueue(self, db, doc: Dict[str, Any], coalesce_key: Optional[str] = None) -> bool:
+        """
+        Dépose une notification (document prêt à insérer dans db.notifications).
+        Non bloquant ; False si la file est pleine (notification perdue, journalisée).
+        """
+        self._ensure_started()
+        self.stats["enqueued"] += 1
+
+        if coalesce_key:
+            pending = self._pending.get(coalesce_key)
+            if pending is not None and pending.db is db:
+                pending.doc = doc
+                self.stats["coalesced"] += 1
+                return True
+
+        entry = _Entry(db, doc, coalesce_key)
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.error(f"File de notifications pleine, notification {doc.get('type')} perdue")
+            return False
+        if coalesce_key:
+            self._pending[coalesce_key] = entry
+        return True
+
+    async def _collect(self) -> List[_Entry]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Au-delà de ce point, une nouvelle notification de même clé repart dans la file
+        for entry in batch:
+            if entry.coalesce_key and self._pending.get(entry.coalesce_key) is entry:
+                del self._pending[entry.coalesce_key]
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._collect()
+            try:
+                by_db: Dict[int, List[_Entry]] = {}
+                for entry in batch:
+                    by_db.setdefault(id(entry.db), []).append(entry)
+                for entries in by_db.values():
+                    await self._insert(entries[0].db, [entry.doc for entry in entries])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notifications perdues ({len(batch)}): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _insert(self, db, docs: List[Dict[str, Any]]):
+        for attempt in range(NOTIFICATION_MAX_RETRIES + 1):
+            try:
+                await db.notifications.insert_many(docs, ordered=False)
+                self.stats["inserted"] += len(docs)
+                return
+            except BulkWriteError as e:
+                # Doublons d'id : déjà écrits par une tentative précédente
+                errors = e.details.get("writeErrors", [])
+                if all(error.get("code") == DUPLICATE_KEY_ERROR for error in errors):
+                    self.stats["inserted"] += len(docs) - len(errors)
+                    return
+                failure = e
+            except Exception as e:
+                failure = e
+            if attempt == NOTIFICATION_MAX_RETRIES:
+                raise failure
+            self.stats["retried"] += 1
+            delay = NOTIFICATION_RETRY_BASE_SECONDS * (2 ** attempt)
+            logger.warning(f"Insertion notifications échouée ({failure}), nouvel essai dans {delay}s")
+            await asyncio.sleep(delay)
+
+    async def drain(self, timeout: float = 10.0):
+        """Attend l'écriture des notifications en file (arrêt du serveur, tests)"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._queue.qsize()} notification(s) non écrite(s) à l'arrêt")
+
+    async def stop(self, timeout: float = 10.0):
+        await self.drain(timeout)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+notification_dispatcher = NotificationDispatcher()
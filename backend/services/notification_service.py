@@ -1,18 +1,36 @@
 from database import db
-from datetime import datetime, timezone
+from utils.time_utils import utc_now
 import uuid
 
-async def send_order_notification(order_id: str, notification_type: str, restaurant_id: str):
+async def send_order_notification(order_id: str, notification_type: str, restaurant_id: str, order: dict = None):
     """
     Envoie une notification au client pour une commande.
     Types: order_preparing, order_ready, order_delivering, order_completed
+    order : commande déjà chargée par l'appelant (évite une relecture)
     """
     
     # Récupérer la commande
-    order = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant_id})
+    if order is None:
+        order = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant_id})
     if not order:
         return False
     
+    notification = build_order_notification(order, notification_type, restaurant_id)
+    if not notification:
+        return False
+    
+    await db.notifications.insert_one(notification)
+    
+    # TODO: Envoyer vraiment la notification (email, SMS, push)
+    # Pour l'instant on stocke juste dans la DB
+    
+    print(f"📱 Notification envoyée: {notification['title']} pour commande {order_id[:8]}")
+    return True
+
+def build_order_notification(order: dict, notification_type: str, restaurant_id: str):
+    """Document notification d'une commande (None si type inconnu), sans accès base"""
+    order_id = order["id"]
+    
     # Messages selon le type
     messages = {
         "order_preparing": {
@@ -39,9 +57,10 @@ async def send_order_notification(order_id: str, notification_type: str, restaur
     
     notification_data = messages.get(notification_type)
     if not notification_data:
-        return False
+        return None
     
-    # Créer la notification dans la DB
+    # Document notification (inséré par l'appelant)
+    now = utc_now()
     notification = {
         "id": str(uuid.uuid4()),
         "restaurant_id": restaurant_id,
@@ -55,17 +74,11 @@ async def send_order_notification(order_id: str, notification_type: str, restaur
         "message": notification_data["message"],
         "icon": notification_data["icon"],
         "is_read": False,
-        "sent_at": datetime.now(timezone.utc).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "sent_at": now,
+        "created_at": now
     }
     
-    await db.notifications.insert_one(notification)
-    
-    # TODO: Envoyer vraiment la notification (email, SMS, push)
-    # Pour l'instant on stocke juste dans la DB
-    
-    print(f"📱 Notification envoyée: {notification_data['title']} pour commande {order_id[:8]}")
-    return True
+    return notification
 
 async def get_customer_notifications(customer_id: str, restaurant_id: str):
     """Récupère les notifications d'un client."""
@@ -0,0 +1,151 @@
+"""
+Archivage des commandes anciennes (collection orders_archive)
+Un job nocturne déplace les commandes terminées des journées clôturées (Ticket Z)
+plus anciennes que ORDER_ARCHIVE_AFTER_DAYS : orders et ses index restent petits.
+Les lectures d'historique passent par find_order / find_orders / iter_orders, qui
+interrogent les deux collections.
+Le déplacement est rejouable : copie (doublons ignorés) puis suppression, journée
+marquée archivée sur son Ticket Z en dernier.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from utils.time_utils import day_range_query, utc_now
+
+logger = logging.getLogger(__name__)
+
+# Doit rester au-delà des fenêtres lues sur la seule collection chaude (30 jours IA marketing)
+ORDER_ARCHIVE_MIN_DAYS = 31
+ORDER_ARCHIVE_AFTER_DAYS = max(ORDER_ARCHIVE_MIN_DAYS, int(os.environ.get("ORDER_ARCHIVE_AFTER_DAYS", "90")))
+ORDER_ARCHIVE_BATCH_SIZE = 500
+# Rattrapage progressif d'un historique existant
+ORDER_ARCHIVE_MAX_DAYS_PER_RUN = 30
+
+ARCHIVE_COLLECTION = "orders_archive"
+CLOSED_STATUSES = ["completed", "canceled", "cancelled"]
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _collections(db, include_archive: bool = True):
+    return [db.orders, db[ARCHIVE_COLLECTION]] if include_archive else [db.orders]
+
+
+def _sort_value(value: Any) -> Tuple[int, Any]:
+    # Ordre BSON : valeurs absentes < nombres < chaînes < dates
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, datetime):
+        return (3, value)
+    return (2, str(value))
+
+
+def merge_sorted(
+    documents: List[Dict[str, Any]],
+    sort: Sequence[Tuple[str, int]],
+    limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Fusionne des résultats de plusieurs collections selon une spécification de tri Mongo"""
+    for field, direction in reversed(sort):
+        documents.sort(key=lambda doc: _sort_value(doc.get(field)), reverse=direction < 0)
+    return documents[:limit] if limit is not None else documents
+
+
+async def find_order(db, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None):
+    """Commande de la collection chaude, sinon de l'archive"""
+    for collection in _collections(db):
+        order = await collection.find_one(query, projection)
+        if order:
+            return order
+    return None
+
+
+async def find_orders(
+    db,
+    query: Dict[str, Any],
+    projection: Optional[Dict[str, Any]] = None,
+    sort: Optional[Sequence[Tuple[str, int]]] = None,
+    limit: Optional[int] = None,
+    include_archive: bool = True
+) -> List[Dict[str, Any]]:
+    """find sur orders et orders_archive ; avec sort/limit, chaque collection est limitée avant fusion"""
+    documents: List[Dict[str, Any]] = []
+    for collection in _collections(db, include_archive):
+        cursor = collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(list(sort))
+        if limit:
+            cursor = cursor.limit(limit)
+        documents.extend(await cursor.to_list(length=None))
+    if sort:
+        return merge_sorted(documents, sort, limit)
+    return documents[:limit] if limit else documents
+
+
+async def count_orders(db, query: Dict[str, Any]) -> int:
+    return sum([await collection.count_documents(query) for collection in _collections(db)])
+
+
+async def iter_orders(
+    db,
+    query: Dict[str, Any],
+    projection: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1000
+) -> AsyncIterator[Dict[str, Any]]:
+    """Parcours en flux des deux collections (sans ordre global)"""
+    for collection in _collections(db):
+        async for order in collection.find(query, projection).batch_size(batch_size):
+            yield order
+
+
+async def archive_day(db, day: str, now: Optional[datetime] = None) -> int:
+    """Déplace les commandes terminées d'une journée vers l'archive ; retourne le nombre déplacé"""
+    query = {"$and": [day_range_query(day), {"status": {"$in": CLOSED_STATUSES}}]}
+    moved = 0
+    while True:
+        batch = await db.orders.find(query).limit(ORDER_ARCHIVE_BATCH_SIZE).to_list(length=None)
+        if not batch:
+            break
+        try:
+            await db[ARCHIVE_COLLECTION].insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Doublons : lot déjà copié par une exécution interrompue
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+        await db.orders.delete_many({"_id": {"$in": [order["_id"] for order in batch]}})
+        moved += len(batch)
+
+    await db.tickets_z.update_one(
+        {"date": day},
+        {"$set": {
+            "archived_at": now or utc_now(),
+            "archived_orders": moved
+        }}
+    )
+    return moved
+
+
+async def archive_closed_days(db, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Archive les journées clôturées plus anciennes que ORDER_ARCHIVE_AFTER_DAYS"""
+    now = now or utc_now()
+    cutoff = (now.date() - timedelta(days=ORDER_ARCHIVE_AFTER_DAYS)).isoformat()
+
+    days = await db.tickets_z.find(
+        {"date": {"$lt": cutoff}, "archived_at": {"$exists": False}},
+        {"_id": 0, "date": 1}
+    ).sort("date", 1).limit(ORDER_ARCHIVE_MAX_DAYS_PER_RUN).to_list(length=None)
+
+    moved = 0
+    for ticket in days:
+        moved += await archive_day(db, ticket["date"], now)
+
+    if days:
+        logger.info(f"Archivage commandes: {len(days)} journée(s), {moved} commande(s) déplacée(s)")
+    return {"days": len(days), "orders": moved}
@@ -0,0 +1,147 @@
+"""
+Flux d'événements commandes pour les écrans cuisine / comptoir (SSE)
+- order_created, order_status_changed, order_payment_changed
+- source change_stream : change streams MongoDB (replica set requis), tous workers confondus
+- source local : bus en mémoire alimenté par les routes de ce worker
+ORDER_EVENTS_SOURCE=auto choisit change_stream si le serveur est un replica set.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENTS_SOURCE = os.environ.get("ORDER_EVENTS_SOURCE", "auto")
+# Abonné trop lent : sa file déborde, il est déconnecté et doit recharger le snapshot
+SUBSCRIBER_QUEUE_SIZE = 256
+CHANGE_STREAM_RETRY_SECONDS = 5
+
+ORDER_CREATED = "order_created"
+ORDER_STATUS_CHANGED = "order_status_changed"
+ORDER_PAYMENT_CHANGED = "order_payment_changed"
+
+# Statuts affichés sur les écrans (snapshot initial)
+ACTIVE_STATUSES = ["new", "in_preparation", "ready", "out_for_delivery"]
+
+# Champs utiles aux écrans (projection du snapshot et des événements)
+ORDER_EVENT_FIELDS = (
+    "id", "restaurant_id", "order_number", "status", "payment_status", "payment_method",
+    "customer_name", "consumption_mode", "order_type", "pickup_date", "pickup_time",
+    "items", "notes", "total", "created_at", "updated_at"
+)
+ORDER_EVENT_PROJECTION = {"_id": 0, **{field: 1 for field in ORDER_EVENT_FIELDS}}
+
+
+def compact_order(order: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: order[field] for field in ORDER_EVENT_FIELDS if field in order}
+
+
+class OrderEventBus:
+    """Diffusion des événements aux abonnés SSE de ce worker"""
+
+    def __init__(self):
+        self.source = "local"
+        self._subscribers: Set[asyncio.Queue] = set()
+        # Rappels synchrones (invalidation de caches), appelés pour chaque événement
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._seq = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any]], None]):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _dispatch(self, event_type: str, order: Dict[str, Any]):
+        for listener in self._listeners:
+            try:
+                listener(event_type, order)
+            except Exception as e:
+                logger.error(f"Écouteur d'événements commandes en erreur: {e}")
+        self._seq += 1
+        event = {
+            "seq": self._seq,
+            "type": event_type,
+            "order": compact_order(order),
+            "at": datetime.now(timezone.utc).isoformat()
+        }
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # None en tête de file : le flux SSE se ferme, le client se resynchronise
+                self._subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def publish(self, event_type: str, order: Dict[str, Any]):
+        """Appelé par les routes après écriture ; ignoré quand les change streams alimentent le bus"""
+        if self.source == "local":
+            self._dispatch(event_type, order)
+
+    async def start(self, db):
+        if ORDER_EVENTS_SOURCE == "local":
+            return
+        if ORDER_EVENTS_SOURCE == "auto":
+            try:
+                hello = await db.client.admin.command("hello")
+            except Exception as e:
+                logger.warning(f"Détection replica set impossible, bus local: {e}")
+                return
+            if not hello.get("setName") and hello.get("msg") != "isdbgrid":
+                logger.info("MongoDB sans replica set : événements commandes par bus local")
+                return
+        self.source = "change_stream"
+        self._task = asyncio.create_task(self._watch(db))
+        logger.info("Événements commandes alimentés par change stream")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.source = "local"
+
+    async def _watch(self, db):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+        resume_token = None
+        while True:
+            try:
+                async with db.orders.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._on_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change stream commandes interrompu: {e}")
+                await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def _on_change(self, change: Dict[str, Any]):
+        order = change.get("fullDocument")
+        if not order:
+            return
+        if change["operationType"] == "insert":
+            self._dispatch(ORDER_CREATED, order)
+            return
+
+        updated = (change.get("updateDescription") or {}).get("updatedFields", {})
+        if change["operationType"] == "replace" or "status" in updated:
+            self._dispatch(ORDER_STATUS_CHANGED, order)
+        if "payment_status" in updated or "payment_method" in updated:
+            self._dispatch(ORDER_PAYMENT_CHANGED, order)
+
+
+order_events = OrderEventBus()
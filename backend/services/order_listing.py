@@ -0,0 +1,120 @@
+"""
+Pagination par curseur (keyset) de la liste admin des commandes
+Tri (created_at, id) décroissant ; le curseur opaque encode la dernière commande
+renvoyée, la page suivante repart de l'index au lieu de sauter les précédentes.
+created_at est historiquement stocké en datetime ou en chaîne ISO : dans l'ordre
+BSON les dates passent avant les chaînes en tri décroissant, le curseur en tient compte.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.index_registry import ensure_collection_indexes
+from services.order_archive import find_orders
+
+# Champs des écrans liste (commandes, kiosque cuisine, impression) pour view=compact ;
+# les notes portent les allergies, elles ne doivent jamais être retirées
+ORDER_LIST_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "order_number": 1,
+    "status": 1,
+    "payment_status": 1,
+    "payment_method": 1,
+    "customer_name": 1,
+    "customer_email": 1,
+    "customer_phone": 1,
+    "consumption_mode": 1,
+    "order_type": 1,
+    "pickup_date": 1,
+    "pickup_time": 1,
+    "subtotal": 1,
+    "total": 1,
+    "notes": 1,
+    "cancellation_reason": 1,
+    "delivery_time": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "items.name": 1,
+    "items.quantity": 1,
+    "items.notes": 1,
+    "items.options": 1,
+    "items.total_price": 1,
+}
+
+# Index (restaurant_id, created_at, id) déclaré dans services/index_registry.py
+ORDER_LIST_SORT = [("created_at", -1), ("id", -1)]
+
+
+class InvalidCursor(ValueError):
+    """Curseur illisible ou falsifié"""
+
+
+def encode_cursor(order: Dict[str, Any]) -> str:
+    created_at = order.get("created_at")
+    payload = {
+        "t": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+        "d": isinstance(created_at, datetime),
+        "id": order.get("id")
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        created_at = payload["t"]
+        if payload.get("d"):
+            created_at = datetime.fromisoformat(created_at)
+        return created_at, payload["id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Curseur invalide: {cursor}") from e
+
+
+def after_cursor_query(cursor: str) -> Dict[str, Any]:
+    """Commandes strictement après le curseur dans l'ordre ORDER_LIST_SORT"""
+    created_at, order_id = decode_cursor(cursor)
+    clauses: List[Dict[str, Any]] = [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": order_id}},
+    ]
+    if isinstance(created_at, datetime):
+        # Après toutes les dates viennent les created_at au format chaîne
+        clauses.append({"created_at": {"$type": "string"}})
+    return {"$or": clauses}
+
+
+async def list_orders_page(
+    db,
+    query: Dict[str, Any],
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    include_archive: bool = False
+) -> Dict[str, Any]:
+    """
+    Une page de commandes et le curseur de la suivante (None en fin de liste).
+    include_archive : même requête sur orders_archive, pages fusionnées.
+    """
+    await ensure_collection_indexes(db, "orders")
+    if cursor:
+        query = {"$and": [query, after_cursor_query(cursor)]}
+
+    # Une commande de plus pour savoir s'il reste une page
+    orders = await find_orders(
+        db,
+        query,
+        projection or ORDER_LIST_PROJECTION,
+        sort=ORDER_LIST_SORT,
+        limit=limit + 1,
+        include_archive=include_archive
+    )
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1])
+    return {"orders": orders, "next_cursor": next_cursor}
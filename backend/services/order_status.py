@@ -0,0 +1,239 @@
+"""
+Transitions de statut des commandes
+Table précompilée : pour chaque statut cible, les statuts de départ autorisés et les
+conditions sur la commande. La transition est un compare-and-set : un seul
+find_one_and_update dont le filtre contient le statut attendu, l'éventuelle
+condition de paiement et le type de commande. Deux validations simultanées ne
+peuvent donc pas réussir toutes les deux. En lot, les mêmes compare-and-set partent
+dans un seul bulk_write. Dans les deux cas le statut de départ réel est renvoyé
+(accumulateurs daily_sales), y compris pour les commandes sans status_history.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from utils.time_utils import to_datetime, utc_now
+
+VALID_STATUSES = ["new", "in_preparation", "ready", "out_for_delivery", "completed", "canceled"]
+
+# Transitions autorisées depuis chaque statut ("delivery_only" : commandes en livraison seulement)
+_TRANSITIONS = {
+    "new": ["in_preparation", "canceled"],
+    "in_preparation": ["ready", "canceled"],
+    "ready": ["out_for_delivery:delivery_only", "completed", "canceled"],
+    "out_for_delivery": ["completed", "canceled"],
+    "completed": [],  # État final
+    "canceled": []    # État final
+}
+
+# Notification client envoyée après la transition
+NOTIFICATION_MAP = {
+    "in_preparation": "order_preparing",
+    "ready": "order_ready",
+    "out_for_delivery": "order_delivering",
+    "completed": "order_completed"
+}
+
+
+class StatusTransitionError(Exception):
+    """Transition refusée (code HTTP et message destinés à l'API)"""
+
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(detail)
+
+
+def _compile_transitions() -> Dict[str, Dict[str, Any]]:
+    """statut cible -> {"from": statuts de départ, "conditions": filtre Mongo additionnel}"""
+    compiled: Dict[str, Dict[str, Any]] = {
+        status: {"from": [], "conditions": {}} for status in VALID_STATUSES
+    }
+    for source, targets in _TRANSITIONS.items():
+        for target in targets:
+            target, _, restriction = target.partition(":")
+            compiled[target]["from"].append(source)
+            if restriction == "delivery_only":
+                compiled[target]["conditions"]["order_type"] = "delivery"
+
+    # Complétion : commande payée obligatoirement
+    compiled["completed"]["conditions"]["payment_status"] = "paid"
+    return compiled
+
+
+TRANSITION_TABLE = _compile_transitions()
+
+
+def allowed_targets(current_status: Optional[str], order: Dict[str, Any]) -> List[str]:
+    """Statuts atteignables depuis l'état actuel de la commande (messages d'erreur)"""
+    targets = []
+    for target, rule in TRANSITION_TABLE.items():
+        if current_status not in rule["from"]:
+            continue
+        if rule["conditions"].get("order_type") and order.get("order_type", "takeaway") != rule["conditions"]["order_type"]:
+            continue
+        targets.append(target)
+    return targets
+
+
+def transition_filter(
+    order_id: str,
+    restaurant_id: str,
+    new_status: str,
+    current_status: Optional[str] = None
+) -> Dict[str, Any]:
+    """current_status : statut relu, le compare-and-set n'accepte alors que celui-ci"""
+    rule = TRANSITION_TABLE[new_status]
+    return {
+        "id": order_id,
+        "restaurant_id": restaurant_id,
+        "status": current_status if current_status is not None else {"$in": rule["from"]},
+        **rule["conditions"]
+    }
+
+
+def transition_update(
+    new_status: str,
+    cancellation_reason: Optional[str] = None,
+    now: Optional[datetime] = None
+) -> Dict[str, Any]:
+    at = now or utc_now()
+    update_data = {"status": new_status, "updated_at": at}
+    history_entry = {"status": new_status, "at": at}
+    if cancellation_reason:
+        update_data["cancellation_reason"] = cancellation_reason
+        history_entry["reason"] = cancellation_reason
+    return {"$set": update_data, "$push": {"status_history": history_entry}}
+
+
+def validate_status(new_status: str):
+    if new_status not in TRANSITION_TABLE:
+        raise StatusTransitionError(
+            400, f"Statut invalide: {new_status}. Statuts valides: {', '.join(VALID_STATUSES)}"
+        )
+
+
+def explain_rejection(order: Optional[Dict[str, Any]], new_status: str) -> StatusTransitionError:
+    """Raison d'un compare-and-set refusé, d'après l'état relu de la commande"""
+    if not order:
+        return StatusTransitionError(404, "Order not found")
+
+    current_status = order.get("status")
+    targets = allowed_targets(current_status, order)
+    if new_status not in targets:
+        return StatusTransitionError(
+            400,
+            f"Transition non autorisée: {current_status} → {new_status}. "
+            f"Transitions possibles depuis {current_status}: {', '.join(targets)}"
+        )
+    if new_status == "completed" and order.get("payment_status", "pending") != "paid":
+        return StatusTransitionError(
+            400,
+            "❌ PAIEMENT REQUIS: Cette commande ne peut pas être terminée car elle n'est pas encore payée. "
+            "Veuillez d'abord enregistrer le paiement."
+        )
+    # L'état relu autorise la transition : la commande a changé entre-temps
+    return StatusTransitionError(409, "Commande modifiée entre-temps, veuillez réessayer")
+
+
+async def transition_order_status(
+    db,
+    order_id: str,
+    restaurant_id: str,
+    new_status: str,
+    cancellation_reason: Optional[str] = None
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Applique la transition en un aller-retour.
+    Renvoie (commande mise à jour, statut de départ) ; lève StatusTransitionError si refusée.
+    """
+    validate_status(new_status)
+    update = transition_update(new_status, cancellation_reason)
+    # Document d'avant : seul à connaître le statut de départ parmi ceux du filtre
+    before = await db.orders.find_one_and_update(
+        transition_filter(order_id, restaurant_id, new_status),
+        update,
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        # Échec uniquement : relecture pour expliquer le refus
+        existing = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant_id}, {"_id": 0})
+        raise explain_rejection(existing, new_status)
+    updated = {
+        **before,
+        **update["$set"],
+        "status_history": (before.get("status_history") or []) + [update["$push"]["status_history"]]
+    }
+    return updated, before.get("status")
+
+
+async def bulk_transition_order_status(
+    db,
+    restaurant_id: str,
+    updates: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Applique N transitions en un bulk_write (compare-and-set par commande) puis une lecture.
+    updates : [{"order_id", "status", "cancellation_reason"?}] ; une commande répétée garde
+    sa dernière demande. Retourne un résultat par commande :
+    {"order_id", "status", "success", "order", "previous_status"}
+    ou {"order_id", "status", "success", "status_code", "error"}.
+    """
+    requested: Dict[str, Dict[str, Any]] = {}
+    for update in updates:
+        requested[update["order_id"]] = update
+
+    # Statuts actuels : chaque compare-and-set attend exactement le statut relu
+    current = {
+        order["id"]: order.get("status")
+        async for order in db.orders.find(
+            {"id": {"$in": list(requested)}, "restaurant_id": restaurant_id}, {"_id": 0, "id": 1, "status": 1}
+        )
+    }
+
+    # Horodatage commun du lot, tronqué à la milliseconde : relu à l'identique
+    stamp = utc_now()
+    results: Dict[str, Dict[str, Any]] = {}
+    operations = []
+    for order_id, update in requested.items():
+        new_status = update["status"]
+        try:
+            validate_status(new_status)
+        except StatusTransitionError as e:
+            results[order_id] = {"order_id": order_id, "status": new_status, "success": False,
+                                 "status_code": e.status_code, "error": e.detail}
+            continue
+        if current.get(order_id) not in TRANSITION_TABLE[new_status]["from"]:
+            # Absente ou transition interdite : expliqué après la relecture
+            continue
+        operations.append(UpdateOne(
+            transition_filter(order_id, restaurant_id, new_status, current[order_id]),
+            transition_update(new_status, update.get("cancellation_reason"), stamp)
+        ))
+
+    if operations:
+        await db.orders.bulk_write(operations, ordered=False)
+
+    # Une lecture pour toutes les commandes : appliquée si la dernière entrée d'historique est la nôtre
+    pending = [order_id for order_id in requested if order_id not in results]
+    orders = {
+        order["id"]: order
+        async for order in db.orders.find(
+            {"id": {"$in": pending}, "restaurant_id": restaurant_id}, {"_id": 0}
+        )
+    }
+    for order_id in pending:
+        new_status = requested[order_id]["status"]
+        order = orders.get(order_id)
+        history = (order or {}).get("status_history") or [{}]
+        if order and order.get("status") == new_status and to_datetime(history[-1].get("at")) == stamp:
+            results[order_id] = {"order_id": order_id, "status": new_status, "success": True, "order": order,
+                                 "previous_status": current[order_id]}
+        else:
+            error = explain_rejection(order, new_status)
+            results[order_id] = {"order_id": order_id, "status": new_status, "success": False,
+                                 "status_code": error.status_code, "error": error.detail}
+
+    return [results[order_id] for order_id in requested]
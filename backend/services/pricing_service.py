@@ -0,0 +1,255 @@
+"""
+Tarification serveur du panier Family's
+Prix catalogue (base_price + delta_price des options), TVA par taux, promotions,
+multiplicateur fidélité et cashback en un seul calcul. Utilisé par /cart/price et
+par la création de commande : les montants envoyés par le client ne sont plus repris.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from services.promotion_engine import PromotionEngine
+from services.cashback_service import calculate_cashback_earned
+
+logger = logging.getLogger(__name__)
+
+# Filet de sécurité multi-workers (les routes produits invalident le cache localement)
+CATALOG_MAX_AGE_SECONDS = 60
+
+CATALOG_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "category": 1,
+    "base_price": 1,
+    "vat_rate": 1,
+    "option_groups": 1,
+    "is_available": 1,
+    "is_out_of_stock": 1,
+    "stock_resume_at": 1,
+}
+
+
+class PricingError(ValueError):
+    """Panier invalide (produit inconnu ou indisponible, option inconnue, quantité)"""
+
+
+class CatalogProduct:
+    """Produit prêt à tarifer : options indexées par id"""
+
+    __slots__ = ("id", "name", "category", "base_price", "vat_rate", "options",
+                 "is_available", "is_out_of_stock", "stock_resume_at")
+
+    def __init__(self, doc: Dict[str, Any]):
+        self.id = doc["id"]
+        self.name = doc.get("name", "")
+        self.category = doc.get("category")
+        self.base_price = float(doc.get("base_price") or 0)
+        self.vat_rate = float(doc.get("vat_rate", 10.0))
+        self.is_available = doc.get("is_available", True)
+        self.is_out_of_stock = doc.get("is_out_of_stock", False)
+        self.stock_resume_at = doc.get("stock_resume_at")
+
+        self.options: Dict[str, Dict[str, Any]] = {}
+        for group in doc.get("option_groups") or []:
+            for option in group.get("options") or []:
+                self.options[option["id"]] = {
+                    "id": option["id"],
+                    "group_id": group.get("id"),
+                    "name": option.get("name"),
+                    "delta_price": float(option.get("delta_price") or 0)
+                }
+
+    def orderable(self, now: datetime) -> bool:
+        if not self.is_available:
+            return False
+        if not self.is_out_of_stock:
+            return True
+        # Rupture temporaire : remise en stock automatique à stock_resume_at
+        if self.stock_resume_at:
+            resume_at = datetime.fromisoformat(self.stock_resume_at)
+            if resume_at.tzinfo is None:
+                resume_at = resume_at.replace(tzinfo=timezone.utc)
+            return resume_at <= now
+        return False
+
+
+class CatalogCache:
+    """Cache process-local du catalogue produits"""
+
+    def __init__(self):
+        self._products: Optional[Dict[str, CatalogProduct]] = None
+        self._expires_at: Optional[datetime] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """À appeler après toute modification de produit (prix, options, stock)"""
+        self._generation += 1
+        self._products = None
+
+    async def get(self, db) -> Dict[str, CatalogProduct]:
+        products = self._products
+        if products is not None and datetime.now(timezone.utc) < self._expires_at:
+            return products
+
+        async with self._lock:
+            products = self._products
+            if products is not None and datetime.now(timezone.utc) < self._expires_at:
+                return products
+
+            generation = self._generation
+            products = {}
+            async for doc in db.products.find({}, CATALOG_PROJECTION):
+                try:
+                    products[doc["id"]] = CatalogProduct(doc)
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Produit {doc.get('id')} ignoré (invalide): {e}")
+
+            if generation == self._generation:
+                self._products = products
+                self._expires_at = datetime.now(timezone.utc) + timedelta(seconds=CATALOG_MAX_AGE_SECONDS)
+            return products
+
+
+catalog_cache = CatalogCache()
+
+
+def _option_id(selection: Any) -> Optional[str]:
+    """Une option peut être envoyée par id ou sous forme de dict ({"option_id"} ou {"id"})"""
+    if isinstance(selection, str):
+        return selection
+    if isinstance(selection, dict):
+        return selection.get("option_id") or selection.get("id")
+    return None
+
+
+def price_items(catalog: Dict[str, CatalogProduct], items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Tarifie chaque ligne au prix catalogue (TTC)"""
+    now = datetime.now(timezone.utc)
+    lines = []
+    for item in items:
+        product = catalog.get(item.get("product_id"))
+        if product is None:
+            raise PricingError(f"Produit inconnu: {item.get('product_id')}")
+        if not product.orderable(now):
+            raise PricingError(f"Produit indisponible: {product.name}")
+
+        quantity = int(item.get("quantity") or 0)
+        if quantity <= 0:
+            raise PricingError(f"Quantité invalide pour {product.name}")
+
+        options = []
+        for selection in item.get("options") or []:
+            option = product.options.get(_option_id(selection))
+            if option is None:
+                raise PricingError(f"Option inconnue pour {product.name}: {selection}")
+            options.append(option)
+
+        unit_price = product.base_price + sum(o["delta_price"] for o in options)
+        lines.append({
+            "product_id": product.id,
+            "name": product.name,
+            "base_price": product.base_price,
+            "quantity": quantity,
+            "options": options,
+            "unit_price": round(unit_price, 2),
+            "total_price": round(unit_price * quantity, 2),
+            "vat_rate": product.vat_rate,
+            "category_id": product.category,
+            "notes": item.get("notes")
+        })
+    return lines
+
+
+def _vat_breakdown(lines: List[Dict[str, Any]], ratio: float) -> List[Dict[str, Any]]:
+    """TVA incluse par taux, après remises (réparties au prorata)"""
+    by_rate: Dict[float, float] = {}
+    for line in lines:
+        by_rate[line["vat_rate"]] = by_rate.get(line["vat_rate"], 0.0) + line["total_price"] * ratio
+
+    breakdown = []
+    for rate, amount_ttc in sorted(by_rate.items()):
+        vat = amount_ttc * rate / (100 + rate)
+        breakdown.append({
+            "rate": rate,
+            "base_ht": round(amount_ttc - vat, 2),
+            "vat_amount": round(vat, 2),
+            "total_ttc": round(amount_ttc, 2)
+        })
+    return breakdown
+
+
+async def price_cart(
+    db,
+    items: List[Dict[str, Any]],
+    customer: Optional[Dict[str, Any]] = None,
+    promo_code: Optional[str] = None,
+    use_cashback: bool = False
+) -> Dict[str, Any]:
+    """
+    Calcule le panier complet : lignes, promotions, TVA, cashback gagné et utilisable.
+    Lève PricingError si le panier est invalide.
+    """
+    if not items:
+        raise PricingError("Panier vide")
+
+    catalog = await catalog_cache.get(db)
+    lines = price_items(catalog, items)
+    subtotal = round(sum(line["total_price"] for line in lines), 2)
+
+    # Promotions : le moteur travaille sur le prix unitaire options comprises
+    engine_cart = {
+        "items": [
+            {
+                "product_id": line["product_id"],
+                "category_id": line["category_id"],
+                "name": line["name"],
+                "price": line["unit_price"],
+                "quantity": line["quantity"]
+            }
+            for line in lines
+        ],
+        "total": subtotal
+    }
+    promotions = await PromotionEngine(db).apply_promotions(engine_cart, customer, promo_code)
+    total_discount = round(min(promotions["total_discount"], subtotal), 2)
+    total = round(subtotal - total_discount, 2)
+
+    breakdown = _vat_breakdown(lines, total / subtotal if subtotal else 0.0)
+
+    # Cashback : gain (x multiplicateur fidélité) et solde utilisable
+    loyalty_multiplier = promotions["loyalty_multiplier"]
+    cashback_earned = await calculate_cashback_earned(subtotal, total, total_discount)
+    cashback_earned = round(cashback_earned * loyalty_multiplier, 2)
+
+    cashback = {
+        "earned": cashback_earned,
+        "available": 0.0,
+        "to_use": 0.0,
+        "new_balance_after_order": 0.0
+    }
+    amount_to_pay = total
+    if customer and customer.get("id"):
+        available = round(customer.get("loyalty_points", 0.0), 2)
+        cashback["available"] = available
+        if use_cashback and available > 0:
+            # Même règle que calculate_cashback_to_use, sans relire le client
+            cashback["to_use"] = round(min(available, total), 2)
+            amount_to_pay = round(total - cashback["to_use"], 2)
+        cashback["new_balance_after_order"] = round(available - cashback["to_use"] + cashback_earned, 2)
+
+    return {
+        "items": lines,
+        "subtotal": subtotal,
+        "total_discount": total_discount,
+        "applied_promotions": promotions["applied_promotions"],
+        "loyalty_multiplier": loyalty_multiplier,
+        "total": total,
+        "vat_amount": round(sum(b["vat_amount"] for b in breakdown), 2),
+        "vat_breakdown": breakdown,
+        "cashback": cashback,
+        "amount_to_pay": amount_to_pay,
+        "priced_at": datetime.now(timezone.utc).isoformat()
+    }
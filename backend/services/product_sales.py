@@ -0,0 +1,175 @@
+"""
+Ventes par produit et par journée (collection product_daily_sales)
+Un document par (restaurant, journée, produit) : quantité, CA, nom et catégorie.
+Alimenté par $inc au passage d'une commande à "completed" (journée de création de la
+commande, fuseau du restaurant) ; rebuild_product_sales le reconstruit depuis l'historique.
+Top produits et ventes par catégorie deviennent des lectures indexées sur quelques
+centaines de documents au lieu de parcourir chaque article de chaque commande.
+"""
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from services.index_registry import ensure_collection_indexes
+from services.order_archive import iter_orders
+from utils.time_utils import DateLike, day_range_query, local_date, local_today, utc_now
+
+logger = logging.getLogger(__name__)
+
+COMPLETED_STATUS = "completed"
+
+ORDER_ITEMS_PROJECTION = {
+    "_id": 0,
+    "restaurant_id": 1,
+    "created_at": 1,
+    "items.product_id": 1,
+    "items.name": 1,
+    "items.category_id": 1,
+    "items.quantity": 1,
+    "items.total_price": 1,
+}
+
+Key = Tuple[Optional[str], str, str]
+
+
+def _accumulate(
+    acc: Dict[Key, Dict[str, Any]],
+    order: Dict[str, Any],
+    product_categories: Optional[Dict[str, str]] = None
+):
+    day = local_date(order.get("created_at"))
+    if not day:
+        return
+    for item in order.get("items") or []:
+        product_id = item.get("product_id")
+        if not product_id:
+            continue
+        key = (order.get("restaurant_id"), day, product_id)
+        entry = acc.setdefault(key, {"quantity": 0, "revenue": 0.0, "name": None, "category_id": None})
+        entry["quantity"] += item.get("quantity") or 0
+        entry["revenue"] += float(item.get("total_price") or 0)
+        entry["name"] = item.get("name") or entry["name"]
+        entry["category_id"] = (
+            item.get("category_id") or (product_categories or {}).get(product_id) or entry["category_id"]
+        )
+
+
+async def record_completed_orders(db, orders: List[Dict[str, Any]]):
+    """Répercute des commandes passées à "completed" ; un bulk_write pour le lot"""
+    acc: Dict[Key, Dict[str, Any]] = {}
+    for order in orders:
+        if order.get("status") == COMPLETED_STATUS:
+            _accumulate(acc, order)
+    if not acc:
+        return
+
+    now = utc_now()
+    operations = []
+    for (restaurant_id, day, product_id), entry in acc.items():
+        fields = {"updated_at": now}
+        if entry["name"]:
+            fields["name"] = entry["name"]
+        if entry["category_id"]:
+            fields["category_id"] = entry["category_id"]
+        operations.append(UpdateOne(
+            {"restaurant_id": restaurant_id, "day": day, "product_id": product_id},
+            {"$inc": {"quantity": entry["quantity"], "revenue": entry["revenue"]}, "$set": fields},
+            upsert=True
+        ))
+    try:
+        await ensure_collection_indexes(db, "product_daily_sales")
+        await db.product_daily_sales.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # Corrigé par scripts/backfill_product_sales.py sur la période concernée
+        logger.error(f"Rollup product_daily_sales non mis à jour: {e}")
+
+
+def _window_match(restaurant_id: Optional[str], days: int) -> Dict[str, Any]:
+    """Les `days` dernières journées, aujourd'hui compris"""
+    today = local_today()
+    query: Dict[str, Any] = {"day": {"$gte": (today - timedelta(days=days - 1)).isoformat(), "$lte": today.isoformat()}}
+    if restaurant_id is not None:
+        query["restaurant_id"] = restaurant_id
+    return query
+
+
+async def get_product_sales(
+    db,
+    restaurant_id: Optional[str],
+    days: int,
+    sort_by: str = "quantity",
+    limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """[{product_id, name, category_id, quantity, revenue}] triés par sort_by décroissant"""
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": _window_match(restaurant_id, days)},
+        {"$group": {
+            "_id": "$product_id",
+            "name": {"$last": "$name"},
+            "category_id": {"$last": "$category_id"},
+            "quantity": {"$sum": "$quantity"},
+            "revenue": {"$sum": "$revenue"},
+        }},
+        {"$sort": {sort_by: -1, "_id": 1}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    rows = await db.product_daily_sales.aggregate(pipeline).to_list(length=None)
+    return [
+        {"product_id": row["_id"], "name": row.get("name"), "category_id": row.get("category_id"),
+         "quantity": row["quantity"], "revenue": round(row["revenue"], 2)}
+        for row in rows
+    ]
+
+
+async def get_category_sales(db, restaurant_id: Optional[str], days: int) -> Dict[str, Dict[str, Any]]:
+    """{category_id: {quantity, revenue}} sur les `days` dernières journées"""
+    rows = await db.product_daily_sales.aggregate([
+        {"$match": {**_window_match(restaurant_id, days), "category_id": {"$ne": None}}},
+        {"$group": {"_id": "$category_id", "quantity": {"$sum": "$quantity"}, "revenue": {"$sum": "$revenue"}}},
+    ]).to_list(length=None)
+    return {row["_id"]: {"quantity": row["quantity"], "revenue": round(row["revenue"], 2)} for row in rows}
+
+
+async def rebuild_product_sales(
+    db,
+    date_from: Optional[DateLike] = None,
+    date_to: Optional[DateLike] = None
+) -> Dict[str, int]:
+    """
+    Reconstruit le rollup depuis les commandes terminées (récentes et archivées),
+    sur [date_from, date_to] (YYYY-MM-DD inclus) ou sur tout l'historique.
+    À lancer hors trafic : les commandes terminées pendant la reconstruction de la période sont perdues.
+    """
+    await ensure_collection_indexes(db, "product_daily_sales")
+    query: Dict[str, Any] = {"status": COMPLETED_STATUS}
+    day_filter: Dict[str, Any] = {}
+    if date_from:
+        query.update(day_range_query(date_from, date_to or local_today()))
+        day_filter = {"day": {"$gte": str(date_from)[:10], "$lte": str(date_to or local_today())[:10]}}
+
+    # Articles enregistrés avant category_id : catégorie actuelle du produit
+    product_categories = {
+        p["id"]: p.get("category")
+        async for p in db.products.find({}, {"_id": 0, "id": 1, "category": 1})
+    }
+
+    acc: Dict[Key, Dict[str, Any]] = {}
+    orders = 0
+    async for order in iter_orders(db, query, ORDER_ITEMS_PROJECTION):
+        _accumulate(acc, order, product_categories)
+        orders += 1
+
+    now = utc_now()
+    await db.product_daily_sales.delete_many(day_filter)
+    if acc:
+        await db.product_daily_sales.insert_many([
+            {"restaurant_id": restaurant_id, "day": day, "product_id": product_id,
+             **entry, "updated_at": now}
+            for (restaurant_id, day, product_id), entry in acc.items()
+        ], ordered=False)
+
+    logger.info(f"Rollup product_daily_sales reconstruit: {orders} commande(s), {len(acc)} ligne(s)")
+    return {"orders": orders, "rows": len(acc)}
@@ -6,6 +6,7 @@ Convertit une campagne IA validée en promotion V2 (brouillon)
 from datetime import datetime, timezone, date, time
 from typing import Dict, Any
 from models.promotion import Promotion, PromotionType, DiscountValueType
+from services.promotion_backtest import start_backtest
 from database import db
 import uuid
 
@@ -172,11 +173,7 @@ async def create_promotion_draft_from_ai(campaign_id: str) -> Dict[str, Any]:
     # Sauvegarder dans la DB
     promo_dict = promotion.model_dump()
     
-    # Sérialiser les dates/times
-    if isinstance(promo_dict.get('created_at'), datetime):
-        promo_dict['created_at'] = promo_dict['created_at'].isoformat()
-    if isinstance(promo_dict.get('updated_at'), datetime):
-        promo_dict['updated_at'] = promo_dict['updated_at'].isoformat()
+    # Sérialiser les dates/times (created_at/updated_at restent des datetime BSON)
     if isinstance(promo_dict.get('start_date'), date):
         promo_dict['start_date'] = promo_dict['start_date'].isoformat()
     if isinstance(promo_dict.get('end_date'), date):
@@ -188,9 +185,13 @@ async def create_promotion_draft_from_ai(campaign_id: str) -> Dict[str, Any]:
     
     await db.promotions.insert_one(promo_dict)
     
+    # Backtest du brouillon sur l'historique (tâche de fond) pour chiffrer son coût avant activation
+    backtest_job = await start_backtest(db, promotion.id)
+    
     return {
         "success": True,
         "promotion_id": promotion.id,
         "already_exists": False,
+        "backtest_job_id": backtest_job["id"],
         "message": f"Promotion V2 créée en brouillon : {promotion.name}"
     }
@@ -0,0 +1,131 @@
+"""
+Agrégats d'utilisation des promotions (rollups)
+- promotion_usage_rollups : un document par promotion
+- promotion_usage_daily : un document par promotion et par jour (fuseau du restaurant)
+Mis à jour par $inc à chaque log-usage ; reconstructibles depuis promotion_usage_log.
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from services.index_registry import ensure_collection_indexes
+from utils.time_utils import local_date, to_datetime, utc_now
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ("usage_count", "total_discount", "original_amount", "final_amount")
+
+
+async def _ensure_indexes(db):
+    # Unicité requise : deux upserts concurrents ne doivent pas créer deux rollups
+    await ensure_collection_indexes(db, "promotion_usage_rollups", "promotion_usage_daily")
+
+
+def _usage_day(created_at: Any) -> str:
+    return local_date(created_at) or str(created_at)[:10]
+
+
+def _usage_values(log: Dict[str, Any]) -> tuple:
+    return (1, log.get("discount_amount", 0), log.get("original_amount", 0), log.get("final_amount", 0))
+
+
+async def record_usage_rollups(db, log: Dict[str, Any]):
+    """Répercute une utilisation (document promotion_usage_log) dans les rollups"""
+    await _ensure_indexes(db)
+    inc = dict(zip(ROLLUP_FIELDS, _usage_values(log)))
+    promotion_id = log["promotion_id"]
+    created_at = log.get("created_at") or utc_now()
+
+    await db.promotion_usage_rollups.update_one(
+        {"promotion_id": promotion_id},
+        {"$inc": inc, "$max": {"last_used_at": created_at}},
+        upsert=True
+    )
+    await db.promotion_usage_daily.update_one(
+        {"promotion_id": promotion_id, "day": _usage_day(created_at)},
+        {"$inc": inc},
+        upsert=True
+    )
+
+
+async def get_usage_rollups(db, promotion_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    query = {"promotion_id": {"$in": promotion_ids}} if promotion_ids is not None else {}
+    return await db.promotion_usage_rollups.find(query, {"_id": 0}).to_list(length=None)
+
+
+async def get_usage_overview(db, top: int = 5) -> Dict[str, Any]:
+    """Totaux globaux et top promotions, en O(nombre de promotions)"""
+    rollups = await get_usage_rollups(db)
+
+    total_usage = sum(r.get("usage_count", 0) for r in rollups)
+    total_revenue = sum(r.get("original_amount", 0) for r in rollups)
+    total_discount = sum(r.get("total_discount", 0) for r in rollups)
+    top_rollups = sorted(rollups, key=lambda r: r.get("usage_count", 0), reverse=True)[:top]
+
+    return {
+        "total_usage": total_usage,
+        "total_revenue": total_revenue,
+        "total_discount": total_discount,
+        "average_cart": total_revenue / total_usage if total_usage > 0 else 0,
+        "top_promotions": [
+            {"promo_id": r["promotion_id"], "usage_count": r.get("usage_count", 0)}
+            for r in top_rollups
+        ]
+    }
+
+
+async def get_daily_usage(
+    db,
+    promotion_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Série journalière (YYYY-MM-DD inclus)"""
+    query: Dict[str, Any] = {}
+    if promotion_id:
+        query["promotion_id"] = promotion_id
+    if date_from or date_to:
+        query["day"] = {}
+        if date_from:
+            query["day"]["$gte"] = date_from[:10]
+        if date_to:
+            query["day"]["$lte"] = date_to[:10]
+    return await db.promotion_usage_daily.find(query, {"_id": 0}).sort("day", 1).to_list(length=None)
+
+
+async def rebuild_usage_rollups(db) -> Dict[str, int]:
+    """
+    Recalcule les rollups depuis le journal brut promotion_usage_log.
+    À lancer hors trafic : les utilisations journalisées pendant la reconstruction sont perdues.
+    """
+    totals: Dict[str, Dict[str, Any]] = {}
+    daily: Dict[tuple, Dict[str, Any]] = {}
+
+    projection = {"_id": 0, "promotion_id": 1, "discount_amount": 1, "original_amount": 1,
+                  "final_amount": 1, "created_at": 1}
+    async for log in db.promotion_usage_log.find({}, projection):
+        promotion_id = log.get("promotion_id")
+        if not promotion_id:
+            continue
+        created_at = to_datetime(log.get("created_at"))
+        day = _usage_day(created_at)
+
+        values = _usage_values(log)
+        for acc in (
+            totals.setdefault(promotion_id, {"promotion_id": promotion_id, "last_used_at": None}),
+            daily.setdefault((promotion_id, day), {"promotion_id": promotion_id, "day": day}),
+        ):
+            for field, value in zip(ROLLUP_FIELDS, values):
+                acc[field] = acc.get(field, 0) + value
+        last_used_at = totals[promotion_id]["last_used_at"]
+        if created_at and (last_used_at is None or last_used_at < created_at):
+            totals[promotion_id]["last_used_at"] = created_at
+
+    await db.promotion_usage_rollups.delete_many({})
+    await db.promotion_usage_daily.delete_many({})
+    if totals:
+        await db.promotion_usage_rollups.insert_many(list(totals.values()), ordered=False)
+    if daily:
+        await db.promotion_usage_daily.insert_many(list(daily.values()), ordered=False)
+
+    logger.info(f"Rollups promotions reconstruits: {len(totals)} promotion(s), {len(daily)} jour(s)")
+    return {"promotions": len(totals), "days": len(daily)}
@@ -0,0 +1,154 @@
+"""
+Backtest d'une promotion (brouillon IA ou manuelle) sur l'historique des commandes
+Les commandes sont parcourues avec un curseur, par lots : mémoire constante
+quel que soit le nombre de commandes rejouées.
+Promotion à code : rejouée comme si chaque client avait saisi le code.
+Conditions client (nouveau / inactif) : évaluées sur l'historique du client à la date
+de chaque commande ; les commandes invitées ne sont pas évaluables et sont exclues.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from services.promotion_cache import CompiledPromotion
+from services.promotion_batch import simulate_batch, iter_order_carts, targets_customers, BatchSummary
+from services.order_archive import count_orders
+from utils.time_utils import day_range_query, local_today, utc_now
+
+logger = logging.getLogger(__name__)
+
+# Fenêtre par défaut : les 30 derniers jours complets
+BACKTEST_DEFAULT_DAYS = 30
+BACKTEST_CHUNK_SIZE = 2000
+
+# Garde une référence sur les tâches en cours (sinon collectées par le GC)
+_running_backtests = set()
+
+
+async def start_backtest(
+    db,
+    promotion_id: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Crée un job de backtest et le lance en tâche de fond.
+    Retourne le document du job (suivi via get_backtest_job).
+    """
+    if not date_to:
+        date_to = (local_today() - timedelta(days=1)).isoformat()
+    if not date_from:
+        date_from = (datetime.fromisoformat(date_to) - timedelta(days=BACKTEST_DEFAULT_DAYS - 1)).date().isoformat()
+
+    job = {
+        "id": str(uuid.uuid4()),
+        "promotion_id": promotion_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "status": "pending",
+        "total_orders": None,
+        "processed_orders": 0,
+        "progress_percent": 0.0,
+        "created_at": utc_now(),
+        "finished_at": None,
+        "error": None
+    }
+    await db.promotion_backtests.insert_one(dict(job))
+
+    task = asyncio.create_task(run_backtest(db, job))
+    _running_backtests.add(task)
+    task.add_done_callback(_running_backtests.discard)
+
+    return job
+
+
+async def get_backtest_job(db, job_id: str) -> Optional[Dict[str, Any]]:
+    return await db.promotion_backtests.find_one({"id": job_id}, {"_id": 0})
+
+
+async def run_backtest(db, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Rejoue la promotion seule sur chaque commande de la fenêtre et enregistre
+    le résultat dans promotions.analytics.backtest
+    """
+    job_id = job["id"]
+    try:
+        promo_doc = await db.promotions.find_one({"id": job["promotion_id"]}, {"_id": 0})
+        if not promo_doc:
+            raise ValueError(f"Promotion {job['promotion_id']} introuvable")
+        promotion = CompiledPromotion(promo_doc)
+
+        query = day_range_query(job["date_from"], job["date_to"])
+        total_orders = await count_orders(db, query)
+        await db.promotion_backtests.update_one(
+            {"id": job_id},
+            {"$set": {"status": "running", "total_orders": total_orders}}
+        )
+
+        with_customers = targets_customers(promotion)
+        summary = BatchSummary()
+        processed = not_evaluable = 0
+        async for chunk in iter_order_carts(db, query, BACKTEST_CHUNK_SIZE, with_customers=with_customers):
+            processed += len(chunk)
+            if with_customers:
+                evaluable = [cart for cart in chunk if cart.get("customer")]
+                not_evaluable += len(chunk) - len(evaluable)
+                chunk = evaluable
+            if chunk:
+                summary.add(simulate_batch([promotion], chunk, promotion.promo_code))
+            progress = round(processed / total_orders * 100, 1) if total_orders else 100.0
+            await db.promotion_backtests.update_one(
+                {"id": job_id},
+                {"$set": {"processed_orders": processed, "progress_percent": min(progress, 100.0)}}
+            )
+
+        stats = summary.to_dict()
+        result = {
+            "date_from": job["date_from"],
+            "date_to": job["date_to"],
+            "orders_replayed": stats["carts"],
+            # Commandes sans client connu, non rejouées (promotion à conditions client)
+            "not_evaluable_orders": not_evaluable,
+            "affected_orders": stats["carts_discounted"],
+            "affected_orders_percent": round(stats["carts_discounted"] / stats["carts"] * 100, 1) if stats["carts"] else 0,
+            "revenue_before": stats["original_total"],
+            "affected_revenue": stats["discounted_original_total"],
+            "projected_discount": stats["total_discount"],
+            "revenue_after": stats["final_total"],
+            # Points de marge perdus sur le CA de la période (pas de coût de revient en base)
+            "margin_impact_percent": stats["discount_rate_percent"],
+            "average_discount_per_order": stats["average_discount"],
+            "job_id": job_id,
+            "computed_at": utc_now()
+        }
+
+        await db.promotions.update_one(
+            {"id": job["promotion_id"]},
+            {"$set": {"analytics.backtest": result}}
+        )
+        await db.promotion_backtests.update_one(
+            {"id": job_id},
+            {"$set": {
+                "status": "completed",
+                "processed_orders": processed,
+                "progress_percent": 100.0,
+                "result": result,
+                "finished_at": utc_now()
+            }}
+        )
+        logger.info(f"Backtest {job_id} terminé: {stats['carts']} commandes, remise projetée {stats['total_discount']}€")
+        return result
+
+    except Exception as e:
+        logger.error(f"Backtest {job_id} échoué: {e}")
+        await db.promotion_backtests.update_one(
+            {"id": job_id},
+            {"$set": {
+                "status": "error",
+                "error": str(e),
+                "finished_at": utc_now()
+            }}
+        )
+        return None
@@ -0,0 +1,420 @@
+"""
+Simulation de promotions sur des lots de paniers (milliers de paniers ou historique de commandes)
+Les calculs de remise par type sont vectorisés avec NumPy : une opération par promotion,
+pas de boucle Python par article.
+"""
+from bisect import bisect_left
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from models.promotion import PromotionType, DiscountValueType
+from services.order_archive import iter_orders
+from services.promotion_cache import CompiledPromotion, MINUTES_PER_WEEK, week_minute
+from utils.time_utils import to_datetime, to_local, utc_now
+
+# Nombre de commandes chargées par lot lors d'un rejeu d'historique
+ORDER_CHUNK_SIZE = 5000
+
+# Champs de commande nécessaires pour reconstruire un panier
+ORDER_CART_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "items": 1,
+    "subtotal": 1,
+    "total": 1,
+    "delivery_fee": 1,
+    "customer_email": 1,
+    "created_at": 1,
+}
+
+_CART_PERCENT_TYPES = (
+    PromotionType.HAPPY_HOUR,
+    PromotionType.FLASH,
+    PromotionType.NEW_CUSTOMER,
+    PromotionType.INACTIVE_CUSTOMER,
+    PromotionType.SEASONAL,
+    PromotionType.PROMO_CODE,
+)
+
+
+def order_to_cart(order: Dict[str, Any], product_categories: Dict[str, str]) -> Dict[str, Any]:
+    """Reconstruit un panier moteur de promotions à partir d'une commande enregistrée"""
+    items = []
+    for item in order.get("items", []):
+        quantity = item.get("quantity") or 1
+        total_price = item.get("total_price")
+        price = total_price / quantity if total_price else item.get("base_price", 0)
+        product_id = item.get("product_id")
+        items.append({
+            "product_id": product_id,
+            "category_id": item.get("category_id") or product_categories.get(product_id),
+            "name": item.get("name"),
+            "price": price,
+            "quantity": quantity,
+        })
+
+    total = order.get("subtotal")
+    if total is None:
+        total = sum(i["price"] * i["quantity"] for i in items)
+
+    return {
+        "id": order.get("id"),
+        "items": items,
+        "total": total,
+        "delivery_fee": order.get("delivery_fee", 0),
+        "customer_email": order.get("customer_email"),
+        "created_at": order.get("created_at"),
+    }
+
+
+def targets_customers(promo: CompiledPromotion) -> bool:
+    """Conditions client (nouveau / inactif) : nécessitent l'historique du client"""
+    return bool(promo.target_new_customers or promo.target_inactive_days)
+
+
+async def attach_customer_history(db, carts: List[Dict[str, Any]]):
+    """
+    Renseigne cart["customer"] tel qu'il était à la date de chaque commande :
+    orders_count = commandes antérieures du client (customer_email), last_order_date = la précédente.
+    Les commandes sans client (invités) restent sans customer.
+    """
+    emails = {cart["customer_email"] for cart in carts if cart.get("customer_email")}
+    if not emails:
+        return
+    latest = max((to_datetime(cart.get("created_at")) for cart in carts if cart.get("customer_email")), default=None)
+    query: Dict[str, Any] = {"customer_email": {"$in": list(emails)}}
+    if latest is not None:
+        query["created_at"] = {"$lt": latest}
+
+    history: Dict[str, List[datetime]] = {}
+    async for order in iter_orders(db, query, {"_id": 0, "customer_email": 1, "created_at": 1}):
+        moment = to_datetime(order.get("created_at"))
+        if moment is not None:
+            history.setdefault(order["customer_email"], []).append(moment)
+    for dates in history.values():
+        dates.sort()
+
+    for cart in carts:
+        email = cart.get("customer_email")
+        moment = to_datetime(cart.get("created_at"))
+        if not email or moment is None:
+            continue
+        dates = history.get(email, [])
+        previous = bisect_left(dates, moment)
+        cart["customer"] = {
+            "orders_count": previous,
+            "last_order_date": dates[previous - 1] if previous else None
+        }
+
+
+async def iter_order_carts(
+    db,
+    query: Dict[str, Any],
+    chunk_size: int = ORDER_CHUNK_SIZE,
+    with_customers: bool = False
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Parcourt les commandes (récentes et archivées) avec un curseur et les restitue en lots de paniers.
+    Seul le lot courant est gardé en mémoire.
+    with_customers : historique client de chaque commande (attach_customer_history).
+    """
+    product_categories = {
+        p["id"]: p.get("category")
+        async for p in db.products.find({}, {"_id": 0, "id": 1, "category": 1})
+    }
+
+    chunk = []
+    async for order in iter_orders(db, query, ORDER_CART_PROJECTION, batch_size=chunk_size):
+        chunk.append(order_to_cart(order, product_categories))
+        if len(chunk) >= chunk_size:
+            if with_customers:
+                await attach_customer_history(db, chunk)
+            yield chunk
+            chunk = []
+    if chunk:
+        if with_customers:
+            await attach_customer_history(db, chunk)
+        yield chunk
+
+
+class CartBatch:
+    """Lot de paniers aplati en tableaux NumPy (un tableau par attribut, un élément par article)"""
+
+    def __init__(self, carts: List[Dict[str, Any]], now: Optional[datetime] = None):
+        now = to_local(now or utc_now())
+        n = len(carts)
+
+        self.size = n
+        self.cart_ids = [c.get("id") for c in carts]
+        self.totals = np.array([float(c.get("total", 0) or 0) for c in carts], dtype=np.float64)
+        self.delivery_fees = np.array([float(c.get("delivery_fee", 0) or 0) for c in carts], dtype=np.float64)
+
+        week_minutes = np.empty(n, dtype=np.int32)
+        orders_count = np.zeros(n, dtype=np.int32)
+        days_inactive = np.full(n, np.nan)
+
+        cart_index, prices, quantities, product_ids, category_ids = [], [], [], [], []
+        for idx, cart in enumerate(carts):
+            # Horaires des promotions : heure locale du restaurant
+            moment = to_local(cart.get("created_at")) or now
+            week_minutes[idx] = week_minute(moment)
+
+            customer = cart.get("customer")
+            if customer:
+                orders_count[idx] = customer.get("orders_count", 0)
+                last_order = to_datetime(customer.get("last_order_date"))
+                if last_order:
+                    # Inactivité à la date du panier (rejeu d'historique)
+                    days_inactive[idx] = (moment - last_order).days
+
+            for item in cart.get("items", []):
+                cart_index.append(idx)
+                prices.append(float(item.get("price", 0) or 0))
+                quantities.append(int(item.get("quantity", 1) or 0))
+                product_ids.append(item.get("product_id"))
+                category_ids.append(item.get("category_id"))
+
+        self.week_minutes = week_minutes
+        self.orders_count = orders_count
+        self.days_inactive = days_inactive
+
+        self.item_cart = np.array(cart_index, dtype=np.int64)
+        self.item_price = np.array(prices, dtype=np.float64)
+        self.item_qty = np.array(quantities, dtype=np.int64)
+        self.item_amount = self.item_price * self.item_qty
+
+        # Identifiants produit/catégorie encodés en entiers pour np.isin
+        self._product_codes: Dict[Any, int] = {}
+        self._category_codes: Dict[Any, int] = {}
+        self.item_product = np.array(
+            [self._product_codes.setdefault(p, len(self._product_codes)) for p in product_ids], dtype=np.int64
+        )
+        self.item_category = np.array(
+            [self._category_codes.setdefault(c, len(self._category_codes)) for c in category_ids], dtype=np.int64
+        )
+
+    def product_mask(self, product_ids: Iterable[str]) -> np.ndarray:
+        codes = [self._product_codes[p] for p in product_ids if p in self._product_codes]
+        return np.isin(self.item_product, codes)
+
+    def category_mask(self, category_ids: Iterable[str]) -> np.ndarray:
+        codes = [self._category_codes[c] for c in category_ids if c in self._category_codes]
+        return np.isin(self.item_category, codes)
+
+    def per_cart(self, item_values: np.ndarray) -> np.ndarray:
+        """Somme par panier d'une valeur calculée par article"""
+        return np.bincount(self.item_cart, weights=item_values, minlength=self.size)
+
+
+def _activation_array(bitmap: int) -> np.ndarray:
+    """Timeline hebdomadaire (entier) dépliée en tableau booléen indexé par minute"""
+    raw = np.frombuffer(bitmap.to_bytes(MINUTES_PER_WEEK // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little").astype(bool)
+
+
+def _condition_mask(promo: CompiledPromotion, batch: CartBatch, promo_code: Optional[str]) -> np.ndarray:
+    """Équivalent vectorisé de PromotionEngine._check_conditions (hors dates de validité)"""
+    if promo.code_required and promo.promo_code != promo_code:
+        return np.zeros(batch.size, dtype=bool)
+    if promo.limit_total and promo.usage_count >= promo.limit_total:
+        return np.zeros(batch.size, dtype=bool)
+
+    mask = np.ones(batch.size, dtype=bool)
+
+    # Jour et plage horaire : lecture de la timeline hebdomadaire à la minute de chaque panier
+    if promo.activation is not None:
+        mask &= _activation_array(promo.activation)[batch.week_minutes]
+
+    if promo.min_cart_amount:
+        mask &= batch.totals >= promo.min_cart_amount
+    if promo.max_cart_amount:
+        mask &= batch.totals <= promo.max_cart_amount
+
+    if promo.target_new_customers:
+        mask &= batch.orders_count <= 0
+    if promo.target_inactive_days:
+        # Pas de date de dernière commande connue : condition ignorée (comme le moteur unitaire)
+        mask &= np.isnan(batch.days_inactive) | (batch.days_inactive >= promo.target_inactive_days)
+
+    return mask
+
+
+def _excluded_items(promo: CompiledPromotion, batch: CartBatch) -> Optional[np.ndarray]:
+    if not promo.excluded_products and not promo.excluded_categories:
+        return None
+    return batch.product_mask(promo.excluded_products) | batch.category_mask(promo.excluded_categories)
+
+
+def _eligible_items(promo: CompiledPromotion, batch: CartBatch, by_product: bool = True, by_category: bool = True) -> np.ndarray:
+    mask = np.zeros(batch.item_cart.shape[0], dtype=bool)
+    if by_product:
+        mask |= batch.product_mask(promo.eligible_products)
+    if by_category:
+        mask |= batch.category_mask(promo.eligible_categories)
+    excluded = _excluded_items(promo, batch)
+    if excluded is not None:
+        mask &= ~excluded
+    return mask
+
+
+def _cart_base(promo: CompiledPromotion, batch: CartBatch) -> np.ndarray:
+    excluded = _excluded_items(promo, batch)
+    if excluded is None:
+        return batch.totals
+    return np.maximum(0, batch.totals - batch.per_cart(np.where(excluded, batch.item_amount, 0)))
+
+
+def compute_discounts(promo: CompiledPromotion, batch: CartBatch) -> np.ndarray:
+    """Remise de la promotion pour chaque panier du lot (sans vérification des conditions)"""
+    rate = promo.discount_value / 100
+
+    if promo.type == PromotionType.BOGO:
+        eligible = _eligible_items(promo, batch)
+        sets = batch.item_qty // (promo.bogo_buy_quantity + promo.bogo_get_quantity)
+        free_amount = sets * promo.bogo_get_quantity * batch.item_price
+        return batch.per_cart(np.where(eligible, free_amount, 0))
+
+    if promo.type in (PromotionType.PERCENT_ITEM, PromotionType.PERCENT_CATEGORY):
+        by_product = promo.type == PromotionType.PERCENT_ITEM
+        eligible = _eligible_items(promo, batch, by_product=by_product, by_category=not by_product)
+        return batch.per_cart(np.where(eligible, batch.item_amount * rate, 0))
+
+    if promo.type in (PromotionType.FIXED_ITEM, PromotionType.FIXED_CATEGORY):
+        by_product = promo.type == PromotionType.FIXED_ITEM
+        eligible = _eligible_items(promo, batch, by_product=by_product, by_category=not by_product)
+        fixed = np.minimum(promo.discount_value * batch.item_qty, batch.item_amount)
+        return batch.per_cart(np.where(eligible, fixed, 0))
+
+    if promo.type == PromotionType.CONDITIONAL_DISCOUNT:
+        if not promo.conditional_quantity:
+            return np.zeros(batch.size)
+        eligible = _eligible_items(promo, batch) & (batch.item_qty >= promo.conditional_quantity)
+        percent = (promo.conditional_discount_percent or 0) / 100
+        discounted = (batch.item_qty // promo.conditional_quantity) * batch.item_price * percent
+        return batch.per_cart(np.where(eligible, discounted, 0))
+
+    if promo.type == PromotionType.THRESHOLD:
+        reached = batch.totals >= (promo.min_cart_amount or 0)
+        if promo.discount_type == DiscountValueType.PERCENTAGE:
+            return np.where(reached, _cart_base(promo, batch) * rate, 0)
+        return np.where(reached, promo.discount_value, 0)
+
+    if promo.type == PromotionType.SHIPPING_FREE:
+        return batch.delivery_fees.copy()
+
+    if promo.type in _CART_PERCENT_TYPES:
+        return _cart_base(promo, batch) * rate
+
+    return np.zeros(batch.size)
+
+
+class BatchSummary:
+    """Agrégats cumulables d'une simulation (mémoire constante quel que soit le nombre de paniers)"""
+
+    def __init__(self):
+        self.carts = 0
+        self.carts_discounted = 0
+        self.discounted_original_total = 0.0
+        self.original_total = 0.0
+        self.total_discount = 0.0
+        self.final_total = 0.0
+        self.promotions: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, result: Dict[str, Any]):
+        self.carts += result["carts"]
+        self.carts_discounted += result["carts_discounted"]
+        self.discounted_original_total += result["discounted_original_total"]
+        self.original_total += result["original_total"]
+        self.total_discount += result["total_discount"]
+        self.final_total += result["final_total"]
+        for promo_id, stats in result["promotions"].items():
+            acc = self.promotions.setdefault(promo_id, {"name": stats["name"], "type": stats["type"], "applications": 0, "discount": 0.0})
+            acc["applications"] += stats["applications"]
+            acc["discount"] += stats["discount"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "carts": self.carts,
+            "carts_discounted": self.carts_discounted,
+            "discounted_original_total": round(self.discounted_original_total, 2),
+            "original_total": round(self.original_total, 2),
+            "total_discount": round(self.total_discount, 2),
+            "final_total": round(self.final_total, 2),
+            "average_discount": round(self.total_discount / self.carts_discounted, 2) if self.carts_discounted else 0,
+            "discount_rate_percent": round(self.total_discount / self.original_total * 100, 2) if self.original_total else 0,
+            "promotions": {
+                promo_id: {**stats, "discount": round(stats["discount"], 2)}
+                for promo_id, stats in self.promotions.items()
+            }
+        }
+
+
+def simulate_batch(
+    promotions: List[CompiledPromotion],
+    carts: List[Dict[str, Any]],
+    promo_code: Optional[str] = None,
+    include_carts: bool = False,
+    now: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """
+    Applique les promotions (triées par priorité) à un lot de paniers,
+    avec les mêmes règles de cumul que PromotionEngine.apply_promotions.
+    """
+    batch = CartBatch(carts, now)
+    total_discount = np.zeros(batch.size)
+    applied_any = np.zeros(batch.size, dtype=bool)
+    loyalty_multiplier = np.ones(batch.size)
+    per_promotion: Dict[str, Dict[str, Any]] = {}
+
+    for promo in promotions:
+        eligible = _condition_mask(promo, batch, promo_code)
+        if not eligible.any():
+            continue
+
+        if promo.type == PromotionType.LOYALTY_MULTIPLIER:
+            loyalty_multiplier = np.where(eligible, np.maximum(loyalty_multiplier, promo.multiplier_value or 1.0), loyalty_multiplier)
+            applied_any |= eligible
+            taken, discount = eligible, np.zeros(batch.size)
+        else:
+            discount = np.where(eligible, compute_discounts(promo, batch), 0)
+            taken = discount > 0
+            if not promo.stackable:
+                # Ne pas cumuler avec une promo déjà appliquée
+                taken &= ~applied_any
+            total_discount += np.where(taken, discount, 0)
+            applied_any |= taken
+
+        per_promotion[promo.id] = {
+            "name": promo.name,
+            "type": promo.type.value,
+            "applications": int(taken.sum()),
+            "discount": float(np.where(taken, discount, 0).sum())
+        }
+
+    final_totals = np.maximum(0, batch.totals - total_discount)
+    discounted = total_discount > 0
+    result = {
+        "carts": batch.size,
+        "carts_discounted": int(discounted.sum()),
+        "discounted_original_total": float(batch.totals[discounted].sum()),
+        "original_total": float(batch.totals.sum()),
+        "total_discount": float(total_discount.sum()),
+        "final_total": float(final_totals.sum()),
+        "promotions": per_promotion
+    }
+
+    if include_carts:
+        result["cart_results"] = [
+            {
+                "id": batch.cart_ids[i],
+                "original_total": float(batch.totals[i]),
+                "total_discount": float(total_discount[i]),
+                "final_total": float(final_totals[i]),
+                "loyalty_multiplier": float(loyalty_multiplier[i])
+            }
+            for i in range(batch.size)
+        ]
+
+    return result
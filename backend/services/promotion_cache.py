@@ -0,0 +1,323 @@
+"""
+Cache mémoire des promotions actives (compilées) pour le moteur de promotions
+Reconstruit uniquement lors d'une modification admin ou au passage d'une borne date/heure
+
+Chaque promotion est compilée en une timeline hebdomadaire (bitmap d'une minute par bit,
+lundi 00:00 = bit 0) : "active maintenant ?" se résume à un test de bit.
+"""
+import asyncio
+import logging
+from bisect import bisect_right
+from datetime import datetime, date, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.promotion import PromotionType, DiscountValueType
+from utils.time_utils import to_local, utc_now
+
+logger = logging.getLogger(__name__)
+
+# Types de promotions dont la remise dépend des articles ciblés (indexés par produit/catégorie)
+ITEM_SCOPED_TYPES = frozenset({
+    PromotionType.BOGO,
+    PromotionType.PERCENT_ITEM,
+    PromotionType.PERCENT_CATEGORY,
+    PromotionType.FIXED_ITEM,
+    PromotionType.FIXED_CATEGORY,
+    PromotionType.CONDITIONAL_DISCOUNT,
+})
+
+DAY_KEYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+_FULL_WEEK = (1 << MINUTES_PER_WEEK) - 1
+_FULL_DAY = (1 << MINUTES_PER_DAY) - 1
+
+# Filet de sécurité multi-workers : un autre process uvicorn a pu modifier une promo
+CACHE_MAX_AGE_SECONDS = 60
+
+
+def _parse_date(value: Any) -> Optional[date]:
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+def _parse_time(value: Any) -> Optional[time]:
+    if value is None or isinstance(value, time):
+        return value
+    if isinstance(value, datetime):
+        return value.time()
+    return time.fromisoformat(str(value))
+
+
+def week_minute(moment: datetime) -> int:
+    """Position d'un instant dans la semaine, en minutes depuis lundi 00:00 (heure de moment)"""
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+def week_start(moment: datetime) -> datetime:
+    return datetime.combine(moment.date() - timedelta(days=moment.weekday()), time.min, tzinfo=moment.tzinfo)
+
+
+def compile_activation(days_active, start_time: Optional[time], end_time: Optional[time]) -> Optional[int]:
+    """
+    Bitmap hebdomadaire des minutes actives (None = active en permanence).
+    Plage horaire bornes incluses ; une plage start > end déborde sur le lendemain.
+    """
+    if not days_active and not (start_time and end_time):
+        return None
+
+    days = [i for i, key in enumerate(DAY_KEYS) if key in days_active] if days_active else range(7)
+
+    if start_time and end_time:
+        start = start_time.hour * 60 + start_time.minute
+        end = end_time.hour * 60 + end_time.minute
+        if start <= end:
+            day_bits = ((1 << (end - start + 1)) - 1) << start
+        else:
+            day_bits = (_FULL_DAY >> start << start) | (((1 << (end + 1)) - 1) << MINUTES_PER_DAY)
+    else:
+        day_bits = _FULL_DAY
+
+    bitmap = 0
+    for day in days:
+        bitmap |= day_bits << (day * MINUTES_PER_DAY)
+    # Débordement du dimanche soir sur le lundi matin
+    return (bitmap | (bitmap >> MINUTES_PER_WEEK)) & _FULL_WEEK
+
+
+def activation_transitions(bitmap: Optional[int]) -> Tuple[int, ...]:
+    """Minutes de la semaine où l'état actif/inactif change"""
+    if bitmap is None:
+        return ()
+    previous = ((bitmap << 1) | (bitmap >> (MINUTES_PER_WEEK - 1))) & _FULL_WEEK
+    changes = bitmap ^ previous
+    transitions = []
+    while changes:
+        low = changes & -changes
+        transitions.append(low.bit_length() - 1)
+        changes ^= low
+    return tuple(transitions)
+
+
+class CompiledPromotion:
+    """
+    Version allégée d'une Promotion, construite une seule fois à partir du document MongoDB.
+    Expose les mêmes attributs que le modèle Pydantic utilisés par le moteur.
+    """
+
+    __slots__ = (
+        "id", "name", "type", "discount_type", "discount_value",
+        "eligible_products", "eligible_categories", "excluded_products", "excluded_categories",
+        "bogo_buy_quantity", "bogo_get_quantity", "bogo_cheapest_free",
+        "conditional_quantity", "conditional_discount_percent",
+        "min_cart_amount", "max_cart_amount",
+        "start_date", "end_date", "start_time", "end_time", "days_active",
+        "promo_code", "code_required", "limit_per_customer", "limit_total", "usage_count",
+        "priority", "stackable", "stacking_group",
+        "target_new_customers", "target_inactive_days",
+        "multiplier_value", "limit_points", "badge_text", "ticket_text", "rank",
+        "activation", "transitions",
+    )
+
+    def __init__(self, doc: Dict[str, Any]):
+        self.id = doc.get("id")
+        self.name = doc.get("name", "")
+        self.type = PromotionType(doc["type"])
+        self.discount_type = DiscountValueType(doc.get("discount_type", DiscountValueType.PERCENTAGE))
+        self.discount_value = float(doc.get("discount_value") or 0)
+
+        self.eligible_products = frozenset(doc.get("eligible_products") or ())
+        self.eligible_categories = frozenset(doc.get("eligible_categories") or ())
+        self.excluded_products = frozenset(doc.get("excluded_products") or ())
+        self.excluded_categories = frozenset(doc.get("excluded_categories") or ())
+
+        self.bogo_buy_quantity = doc.get("bogo_buy_quantity") or 1
+        self.bogo_get_quantity = doc.get("bogo_get_quantity") or 1
+        self.bogo_cheapest_free = bool(doc.get("bogo_cheapest_free", False))
+        self.conditional_quantity = doc.get("conditional_quantity")
+        self.conditional_discount_percent = doc.get("conditional_discount_percent")
+
+        self.min_cart_amount = doc.get("min_cart_amount")
+        self.max_cart_amount = doc.get("max_cart_amount")
+
+        self.start_date = _parse_date(doc.get("start_date"))
+        self.end_date = _parse_date(doc.get("end_date"))
+        self.start_time = _parse_time(doc.get("start_time"))
+        self.end_time = _parse_time(doc.get("end_time"))
+        self.days_active = frozenset(doc.get("days_active") or ())
+        self.activation = compile_activation(self.days_active, self.start_time, self.end_time)
+        self.transitions = activation_transitions(self.activation)
+
+        self.promo_code = doc.get("promo_code")
+        self.code_required = bool(doc.get("code_required", False))
+        self.limit_per_customer = doc.get("limit_per_customer")
+        self.limit_total = doc.get("limit_total")
+        self.usage_count = int(doc.get("usage_count") or 0)
+
+        self.priority = int(doc.get("priority") or 0)
+        self.stackable = bool(doc.get("stackable", False))
+        self.stacking_group = doc.get("stacking_group")
+
+        self.target_new_customers = bool(doc.get("target_new_customers", False))
+        self.target_inactive_days = doc.get("target_inactive_days")
+
+        self.multiplier_value = doc.get("multiplier_value")
+        self.limit_points = doc.get("limit_points")
+        self.badge_text = doc.get("badge_text")
+        self.ticket_text = doc.get("ticket_text")
+
+        # Position dans le snapshot (ordre de priorité), attribuée à la construction du snapshot
+        self.rank = 0
+
+    def is_active_at(self, minute: int) -> bool:
+        """Jour et plage horaire (minute de la semaine, cf. week_minute)"""
+        return self.activation is None or bool(self.activation >> minute & 1)
+
+    def next_transition(self, minute: int) -> Optional[int]:
+        """Prochaine bascule actif/inactif après la minute donnée (peut dépasser la semaine)"""
+        if not self.transitions:
+            return None
+        index = bisect_right(self.transitions, minute)
+        if index < len(self.transitions):
+            return self.transitions[index]
+        return self.transitions[0] + MINUTES_PER_WEEK
+
+
+class PromotionSnapshot:
+    """
+    Ensemble immuable de promotions compilées, triées par priorité décroissante.
+    Les index ne contiennent que les promotions actives à loaded_at (jour et plage horaire) :
+    le snapshot expire à la prochaine bascule, aucune vérification horaire par requête.
+    Maintient un index inversé produit/catégorie -> promotions candidates.
+    """
+
+    def __init__(self, promotions: List[CompiledPromotion], loaded_at: datetime, expires_at: datetime):
+        self.promotions = promotions
+        self.loaded_at = loaded_at
+        self.by_id = {p.id: p for p in promotions}
+
+        minute = week_minute(loaded_at)
+        self.next_transition = _next_transition(promotions, loaded_at)
+        self.expires_at = min(expires_at, self.next_transition) if self.next_transition else expires_at
+        self.active = [p for p in promotions if p.is_active_at(minute)]
+
+        # Promotions panier (seuil, % panier, fidélité...) : toujours candidates
+        self.cart_wide: List[CompiledPromotion] = []
+        self.by_product: Dict[str, List[CompiledPromotion]] = {}
+        self.by_category: Dict[str, List[CompiledPromotion]] = {}
+
+        for rank, promo in enumerate(promotions):
+            promo.rank = rank
+        for promo in self.active:
+            if promo.type not in ITEM_SCOPED_TYPES:
+                self.cart_wide.append(promo)
+                continue
+            for product_id in promo.eligible_products:
+                self.by_product.setdefault(product_id, []).append(promo)
+            for category_id in promo.eligible_categories:
+                self.by_category.setdefault(category_id, []).append(promo)
+
+    def candidates_for(self, items: List[Dict[str, Any]]) -> List[CompiledPromotion]:
+        """Promotions pouvant s'appliquer au panier, dans l'ordre de priorité"""
+        if not self.by_product and not self.by_category:
+            return self.cart_wide
+
+        matched: Dict[str, CompiledPromotion] = {}
+        for item in items:
+            for promo in self.by_product.get(item.get("product_id"), ()):
+                matched[promo.id] = promo
+            for promo in self.by_category.get(item.get("category_id"), ()):
+                matched[promo.id] = promo
+
+        if not matched:
+            return self.cart_wide
+
+        candidates = self.cart_wide + list(matched.values())
+        candidates.sort(key=lambda p: p.rank)
+        return candidates
+
+
+def _next_transition(promotions: List[CompiledPromotion], now: datetime) -> Optional[datetime]:
+    """Prochaine bascule actif/inactif (jour ou plage horaire) parmi les promotions"""
+    minute = week_minute(now)
+    upcoming = [m for m in (p.next_transition(minute) for p in promotions) if m is not None]
+    if not upcoming:
+        return None
+    return week_start(now) + timedelta(minutes=min(upcoming))
+
+
+def _next_boundary(now: datetime) -> datetime:
+    """Prochaine borne de dates (minuit) ou âge maximal du snapshot"""
+    midnight = datetime.combine(now.date() + timedelta(days=1), time.min, tzinfo=now.tzinfo)
+    return min(midnight, now + timedelta(seconds=CACHE_MAX_AGE_SECONDS))
+
+
+class PromotionCache:
+    """
+    Cache process-local des promotions actives.
+    Une évaluation de panier ne fait aucun aller-retour MongoDB tant que le snapshot est valide.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[PromotionSnapshot] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """À appeler après toute création / modification / suppression de promotion"""
+        self._generation += 1
+        self._snapshot = None
+
+    def note_usage(self, promotion_id: str, count: int = 1):
+        """Répercute une utilisation dans le snapshot courant (vérification limit_total)"""
+        snapshot = self._snapshot
+        if snapshot and promotion_id in snapshot.by_id:
+            snapshot.by_id[promotion_id].usage_count += count
+
+    async def get_snapshot(self, db) -> PromotionSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and utc_now() < snapshot.expires_at:
+            return snapshot
+
+        async with self._lock:
+            # Un autre appel a pu reconstruire pendant l'attente du verrou
+            snapshot = self._snapshot
+            if snapshot is not None and utc_now() < snapshot.expires_at:
+                return snapshot
+
+            generation = self._generation
+            snapshot = await self._load(db)
+            # Ne pas conserver un snapshot chargé pendant une invalidation concurrente
+            if generation == self._generation:
+                self._snapshot = snapshot
+            return snapshot
+
+    async def _load(self, db) -> PromotionSnapshot:
+        # Dates et plages horaires des promotions : heure locale du restaurant
+        now = to_local(utc_now())
+        today = now.date()
+
+        query = {
+            "is_active": True,
+            "status": "active",
+            "start_date": {"$lte": today.isoformat()},
+            "end_date": {"$gte": today.isoformat()}
+        }
+
+        promotions = []
+        async for promo_dict in db.promotions.find(query, {"_id": 0}):
+            try:
+                promotions.append(CompiledPromotion(promo_dict))
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Promotion {promo_dict.get('id')} ignorée (invalide): {e}")
+
+        promotions.sort(key=lambda p: p.priority, reverse=True)
+
+        logger.info(f"Cache promotions reconstruit: {len(promotions)} promotion(s) active(s)")
+        return PromotionSnapshot(promotions, now, _next_boundary(now))
+
+
+promotion_cache = PromotionCache()
@@ -1,10 +1,24 @@
-from typing import List, Dict, Any, Optional
-from datetime import datetime, date, time
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import date, time
+from time import perf_counter
 from models.promotion import Promotion, PromotionType, DiscountValueType
+from services.promotion_cache import promotion_cache, CompiledPromotion
+from services.promotion_metrics import promotion_metrics
+from utils.time_utils import to_datetime, utc_now
 import logging
 
 logger = logging.getLogger(__name__)
 
+STACKING_MODES = ("greedy", "customer_best", "restaurant_best")
+
+# Budget du solveur de cumul ; au-delà, repli sur l'algorithme glouton
+SOLVER_TIME_BUDGET_SECONDS = 0.003
+
+
+class _SolverTimeout(Exception):
+    pass
+
+
 class PromotionEngine:
     """
     Moteur de calcul et d'application des promotions Family's
@@ -18,40 +32,65 @@ class PromotionEngine:
         cart: Dict[str, Any],
         customer: Optional[Dict[str, Any]] = None,
         promo_code: Optional[str] = None
-    ) -> List[Promotion]:
+    ) -> List[CompiledPromotion]:
         """
         Récupère toutes les promotions applicables au panier
+        (depuis le cache mémoire, sans requête MongoDB tant qu'il est valide)
         """
-        now = datetime.now()
-        today = now.date()
-        current_time = now.time()
-        current_day = now.strftime("%a").lower()[:3]  # mon, tue, wed...
-        
-        # Requête MongoDB pour promos actives
-        query = {
-            "is_active": True,
-            "status": "active",
-            "start_date": {"$lte": today.isoformat()},
-            "end_date": {"$gte": today.isoformat()}
-        }
+        # Le snapshot ne contient que les promotions actives maintenant (jour / plage horaire)
+        snapshot = await promotion_cache.get_snapshot(self.db)
         
-        promos_raw = await self.db.promotions.find(query).to_list(length=None)
-        applicable_promos = []
+        # Index inversé : seules les promos pouvant cibler les articles du panier sont évaluées
+        candidates = snapshot.candidates_for(cart.get("items", []))
         
-        for promo_dict in promos_raw:
-            # Reconstruire le modèle Promotion
-            promo = Promotion(**promo_dict)
+        # Les candidates sont déjà triées par priorité (plus haute en premier)
+        return [
+            promo for promo in candidates
+            if self._rejection_reason(promo, cart, customer, promo_code) is None
+        ]
+    
+    async def _traced_applicable_promotions(
+        self,
+        cart: Dict[str, Any],
+        customer: Optional[Dict[str, Any]],
+        promo_code: Optional[str]
+    ) -> Tuple[List[CompiledPromotion], Dict[str, Dict[str, Any]]]:
+        """
+        Variante tracée de get_applicable_promotions : une entrée par promotion du snapshot
+        (raison du rejet, temps d'évaluation des conditions)
+        """
+        snapshot = await promotion_cache.get_snapshot(self.db)
+        active_ids = {p.id for p in snapshot.active}
+        candidate_ids = {p.id for p in snapshot.candidates_for(cart.get("items", []))}
+        
+        applicable = []
+        trace = {}
+        for promo in snapshot.promotions:
+            entry = {
+                "promotion_id": promo.id,
+                "name": promo.name,
+                "type": promo.type,
+                "status": "rejected",
+                "reason": None,
+                "discount": 0,
+                "evaluation_ms": None
+            }
+            trace[promo.id] = entry
             
-            # Vérifier conditions
-            if not self._check_conditions(promo, cart, customer, promo_code, current_day, current_time):
+            if promo.id not in active_ids:
+                entry["reason"] = "schedule"
+                continue
+            if promo.id not in candidate_ids:
+                entry["reason"] = "no_eligible_item"
                 continue
             
-            applicable_promos.append(promo)
+            start = perf_counter()
+            entry["reason"] = self._rejection_reason(promo, cart, customer, promo_code)
+            entry["evaluation_ms"] = (perf_counter() - start) * 1000
+            if entry["reason"] is None:
+                applicable.append(promo)
         
-        # Trier par priorité (plus haute en premier)
-        applicable_promos.sort(key=lambda p: p.priority, reverse=True)
-        
-        return applicable_promos
+        return applicable, trace
     
     def _check_conditions(
         self,
@@ -63,12 +102,8 @@ class PromotionEngine:
         current_time: time
     ) -> bool:
         """
-        Vérifie toutes les conditions d'applicabilité
+        Vérifie toutes les conditions d'applicabilité, jour et horaires compris
         """
-        # Code promo requis
-        if promo.code_required and promo.promo_code != promo_code:
-            return False
-        
         # Jours actifs
         if promo.days_active and current_day not in promo.days_active:
             return False
@@ -78,31 +113,83 @@ class PromotionEngine:
             if not (promo.start_time <= current_time <= promo.end_time):
                 return False
         
+        return self._rejection_reason(promo, cart, customer, promo_code) is None
+    
+    def _rejection_reason(
+        self,
+        promo: Promotion,
+        cart: Dict[str, Any],
+        customer: Optional[Dict[str, Any]],
+        promo_code: Optional[str]
+    ) -> Optional[str]:
+        """
+        Conditions liées au panier, au client et au code (hors calendrier)
+        Retourne la première condition non remplie, None si la promotion est applicable
+        """
+        # Code promo requis
+        if promo.code_required and promo.promo_code != promo_code:
+            return "promo_code"
+        
         # Montant panier
         cart_total = cart.get("total", 0)
         if promo.min_cart_amount and cart_total < promo.min_cart_amount:
-            return False
+            return "min_cart_amount"
         if promo.max_cart_amount and cart_total > promo.max_cart_amount:
-            return False
+            return "max_cart_amount"
         
         # Limite d'utilisation totale
         if promo.limit_total and promo.usage_count >= promo.limit_total:
-            return False
+            return "limit_total"
         
         # Nouveau client
         if promo.target_new_customers and customer:
             if customer.get("orders_count", 0) > 0:
-                return False
+                return "new_customers_only"
         
         # Client inactif
         if promo.target_inactive_days and customer:
-            last_order_date = customer.get("last_order_date")
+            last_order_date = to_datetime(customer.get("last_order_date"))
             if last_order_date:
-                days_inactive = (datetime.now() - datetime.fromisoformat(last_order_date)).days
+                days_inactive = (utc_now() - last_order_date).days
                 if days_inactive < promo.target_inactive_days:
-                    return False
+                    return "inactive_days"
         
-        return True
+        return None
+    
+    @staticmethod
+    def _is_excluded(promo: Promotion, item: Dict) -> bool:
+        """Article exclu de la promotion (excluded_products / excluded_categories)"""
+        return (
+            item.get("product_id") in promo.excluded_products or
+            item.get("category_id") in promo.excluded_categories
+        )
+    
+    def _eligible_items(
+        self,
+        promo: Promotion,
+        items: List[Dict],
+        by_product: bool = True,
+        by_category: bool = True
+    ) -> List[Dict]:
+        """Articles ciblés par la promotion, hors exclusions"""
+        has_exclusions = bool(promo.excluded_products or promo.excluded_categories)
+        return [
+            item for item in items
+            if ((by_product and item.get("product_id") in promo.eligible_products) or
+                (by_category and item.get("category_id") in promo.eligible_categories))
+            and not (has_exclusions and self._is_excluded(promo, item))
+        ]
+    
+    def _cart_base(self, promo: Promotion, items: List[Dict], cart_total: float) -> float:
+        """Montant du panier soumis à une remise globale (articles exclus déduits)"""
+        if not promo.excluded_products and not promo.excluded_categories:
+            return cart_total
+        excluded_amount = sum(
+            item.get("price", 0) * item.get("quantity", 1)
+            for item in items
+            if self._is_excluded(promo, item)
+        )
+        return max(0, cart_total - excluded_amount)
     
     def calculate_discount(
         self,
@@ -134,38 +221,26 @@ class PromotionEngine:
             return self._calculate_conditional(promo, items)
         
         elif promo.type == PromotionType.THRESHOLD:
-            return self._calculate_threshold(promo, cart_total)
+            return self._calculate_threshold(promo, cart_total, self._cart_base(promo, items, cart_total))
         
         elif promo.type == PromotionType.SHIPPING_FREE:
             return {"discount": cart.get("delivery_fee", 0), "type": "shipping"}
         
-        elif promo.type == PromotionType.HAPPY_HOUR:
-            return self._calculate_percent_cart(promo, cart_total)
-        
-        elif promo.type == PromotionType.FLASH:
-            return self._calculate_percent_cart(promo, cart_total)
-        
-        elif promo.type == PromotionType.NEW_CUSTOMER:
-            return self._calculate_percent_cart(promo, cart_total)
-        
-        elif promo.type == PromotionType.INACTIVE_CUSTOMER:
-            return self._calculate_percent_cart(promo, cart_total)
-        
-        elif promo.type == PromotionType.SEASONAL:
-            return self._calculate_percent_cart(promo, cart_total)
-        
-        elif promo.type == PromotionType.PROMO_CODE:
-            return self._calculate_percent_cart(promo, cart_total)
+        elif promo.type in (
+            PromotionType.HAPPY_HOUR,
+            PromotionType.FLASH,
+            PromotionType.NEW_CUSTOMER,
+            PromotionType.INACTIVE_CUSTOMER,
+            PromotionType.SEASONAL,
+            PromotionType.PROMO_CODE
+        ):
+            return self._calculate_percent_cart(promo, self._cart_base(promo, items, cart_total))
         
         return {"discount": 0, "type": "unknown"}
     
     def _calculate_bogo(self, promo: Promotion, items: List[Dict]) -> Dict[str, Any]:
         """BOGO: Achetez X obtenez Y gratuit"""
-        eligible_items = [
-            item for item in items
-            if item.get("product_id") in promo.eligible_products or
-               item.get("category_id") in promo.eligible_categories
-        ]
+        eligible_items = self._eligible_items(promo, items)
         
         if not eligible_items:
             return {"discount": 0, "type": "bogo", "items_free": []}
@@ -193,11 +268,10 @@ class PromotionEngine:
         """Remise % sur produit(s) spécifique(s)"""
         total_discount = 0
         
-        for item in items:
-            if item.get("product_id") in promo.eligible_products:
-                item_total = item.get("price", 0) * item.get("quantity", 1)
-                discount = item_total * (promo.discount_value / 100)
-                total_discount += discount
+        for item in self._eligible_items(promo, items, by_category=False):
+            item_total = item.get("price", 0) * item.get("quantity", 1)
+            discount = item_total * (promo.discount_value / 100)
+            total_discount += discount
         
         return {"discount": total_discount, "type": "percent_item"}
     
@@ -205,11 +279,10 @@ class PromotionEngine:
         """Remise % sur catégorie"""
         total_discount = 0
         
-        for item in items:
-            if item.get("category_id") in promo.eligible_categories:
-                item_total = item.get("price", 0) * item.get("quantity", 1)
-                discount = item_total * (promo.discount_value / 100)
-                total_discount += discount
+        for item in self._eligible_items(promo, items, by_product=False):
+            item_total = item.get("price", 0) * item.get("quantity", 1)
+            discount = item_total * (promo.discount_value / 100)
+            total_discount += discount
         
         return {"discount": total_discount, "type": "percent_category"}
     
@@ -217,11 +290,10 @@ class PromotionEngine:
         """Remise fixe sur produit(s)"""
         total_discount = 0
         
-        for item in items:
-            if item.get("product_id") in promo.eligible_products:
-                qty = item.get("quantity", 1)
-                discount = min(promo.discount_value * qty, item.get("price", 0) * qty)
-                total_discount += discount
+        for item in self._eligible_items(promo, items, by_category=False):
+            qty = item.get("quantity", 1)
+            discount = min(promo.discount_value * qty, item.get("price", 0) * qty)
+            total_discount += discount
         
         return {"discount": total_discount, "type": "fixed_item"}
     
@@ -229,21 +301,16 @@ class PromotionEngine:
         """Remise fixe sur catégorie"""
         total_discount = 0
         
-        for item in items:
-            if item.get("category_id") in promo.eligible_categories:
-                qty = item.get("quantity", 1)
-                discount = min(promo.discount_value * qty, item.get("price", 0) * qty)
-                total_discount += discount
+        for item in self._eligible_items(promo, items, by_product=False):
+            qty = item.get("quantity", 1)
+            discount = min(promo.discount_value * qty, item.get("price", 0) * qty)
+            total_discount += discount
         
         return {"discount": total_discount, "type": "fixed_category"}
     
     def _calculate_conditional(self, promo: Promotion, items: List[Dict]) -> Dict[str, Any]:
         """Remise conditionnelle: 2e à -50%, 3 pour 2, etc."""
-        eligible_items = [
-            item for item in items
-            if item.get("product_id") in promo.eligible_products or
-               item.get("category_id") in promo.eligible_categories
-        ]
+        eligible_items = self._eligible_items(promo, items)
         
         if not eligible_items:
             return {"discount": 0, "type": "conditional"}
@@ -262,11 +329,17 @@ class PromotionEngine:
         
         return {"discount": total_discount, "type": "conditional"}
     
-    def _calculate_threshold(self, promo: Promotion, cart_total: float) -> Dict[str, Any]:
+    def _calculate_threshold(
+        self,
+        promo: Promotion,
+        cart_total: float,
+        discount_base: Optional[float] = None
+    ) -> Dict[str, Any]:
         """Seuil de panier atteint"""
         if cart_total >= promo.min_cart_amount:
             if promo.discount_type == DiscountValueType.PERCENTAGE:
-                discount = cart_total * (promo.discount_value / 100)
+                base = cart_total if discount_base is None else discount_base
+                discount = base * (promo.discount_value / 100)
             else:
                 discount = promo.discount_value
             
@@ -279,20 +352,134 @@ class PromotionEngine:
         discount = cart_total * (promo.discount_value / 100)
         return {"discount": discount, "type": "cart_percent"}
     
+    def _solve_stacking(
+        self,
+        options: List[Tuple[Promotion, float]],
+        mode: str,
+        time_budget: float = SOLVER_TIME_BUDGET_SECONDS
+    ) -> Optional[List[Tuple[Promotion, float]]]:
+        """
+        Meilleure combinaison valide de promotions à remise > 0 (options triées par priorité).
+        Règles : une promo non cumulable s'applique seule ; les promos cumulables se combinent,
+        avec au plus une promo par stacking_group.
+        - customer_best : remise totale maximale
+        - restaurant_best : remise minimale parmi les combinaisons maximales
+          (aucune promo éligible ne peut y être ajoutée)
+        Retourne None si le budget de temps est dépassé.
+        """
+        deadline = perf_counter() + time_budget
+        maximize = mode == "customer_best"
+        
+        # Promos cumulables regroupées par stacking_group : l'état de recherche
+        # ne porte alors que sur le groupe courant (pris / écarté)
+        stackables = sorted(
+            (index for index, option in enumerate(options) if option[0].stackable),
+            key=lambda index: (options[index][0].stacking_group or "", index)
+        )
+        groups = [options[index][0].stacking_group for index in stackables]
+        memo: Dict[Tuple[int, bool, bool], Optional[Tuple[float, Tuple[int, ...]]]] = {}
+        
+        def better(a, b):
+            if a is None:
+                return b
+            if b is None:
+                return a
+            if maximize:
+                return b if b[0] > a[0] else a
+            return b if b[0] < a[0] else a
+        
+        def search(i: int, taken: bool, skipped: bool):
+            """(remise, indices) optimal pour stackables[i:], selon l'état du groupe en cours"""
+            if perf_counter() > deadline:
+                raise _SolverTimeout()
+            
+            group = groups[i] if i < len(stackables) else None
+            if i == len(stackables) or (i > 0 and group != groups[i - 1]):
+                # Clôture du groupe précédent : en mode restaurant, un groupe écarté
+                # sans aucune promo retenue laisse une combinaison non maximale
+                if not maximize and skipped and not taken:
+                    return None
+                taken = skipped = False
+            if i == len(stackables):
+                return (0.0, ())
+            
+            key = (i, taken, skipped)
+            if key in memo:
+                return memo[key]
+            
+            discount = options[stackables[i]][1]
+            if group and taken:
+                # Une seule promo par stacking_group
+                result = search(i + 1, taken, skipped)
+            else:
+                kept = search(i + 1, bool(group), skipped)
+                if kept is not None:
+                    kept = (kept[0] + discount, (stackables[i],) + kept[1])
+                
+                # Écarter une promo sans groupe rend la combinaison non maximale
+                if maximize or group:
+                    left = search(i + 1, taken, skipped or bool(group))
+                else:
+                    left = None
+                result = better(kept, left)
+            
+            memo[key] = result
+            return result
+        
+        try:
+            best = None
+            if stackables:
+                found = search(0, False, False)
+                if found is not None:
+                    best = (found[0], sorted(found[1]))
+            
+            for index, option in enumerate(options):
+                if not option[0].stackable:
+                    best = better(best, (option[1], [index]))
+        except _SolverTimeout:
+            return None
+        
+        return [options[index] for index in best[1]] if best else []
+    
+    @staticmethod
+    def _applied_entry(promo: Promotion, discount: float) -> Dict[str, Any]:
+        return {
+            "id": promo.id,
+            "name": promo.name,
+            "type": promo.type,
+            "discount": discount,
+            "badge": promo.badge_text,
+            "ticket_text": promo.ticket_text
+        }
+    
     async def apply_promotions(
         self,
         cart: Dict[str, Any],
         customer: Optional[Dict[str, Any]] = None,
-        promo_code: Optional[str] = None
+        promo_code: Optional[str] = None,
+        stacking_mode: str = "greedy",
+        trace: bool = False
     ) -> Dict[str, Any]:
         """
         Applique toutes les promotions applicables au panier
+        stacking_mode : greedy (ordre de priorité), customer_best ou restaurant_best (solveur)
+        trace : ajoute au résultat le détail par promotion (raison du rejet, remise, temps)
         """
-        applicable_promos = await self.get_applicable_promotions(cart, customer, promo_code)
+        if stacking_mode not in STACKING_MODES:
+            raise ValueError(f"Mode de cumul invalide: {stacking_mode}. Modes valides: {', '.join(STACKING_MODES)}")
+        
+        # Hors trace / échantillon, chemin nominal sans aucune mesure
+        traced = promotion_metrics.tick() or trace
+        if traced:
+            cart_start = perf_counter()
+            applicable_promos, trace_entries = await self._traced_applicable_promotions(cart, customer, promo_code)
+        else:
+            applicable_promos = await self.get_applicable_promotions(cart, customer, promo_code)
         
         applied_promos = []
         total_discount = 0
         loyalty_multiplier = 1.0
+        options = []
         
         for promo in applicable_promos:
             # Loyalty multiplier
@@ -307,29 +494,67 @@ class PromotionEngine:
                 continue
             
             # Calculer remise
-            result = self.calculate_discount(promo, cart)
+            if traced:
+                start = perf_counter()
+                result = self.calculate_discount(promo, cart)
+                entry = trace_entries[promo.id]
+                entry["evaluation_ms"] += (perf_counter() - start) * 1000
+                entry["discount"] = result.get("discount", 0)
+                if entry["discount"] <= 0:
+                    entry["reason"] = "no_discount"
+            else:
+                result = self.calculate_discount(promo, cart)
             discount = result.get("discount", 0)
             
             if discount > 0:
+                if stacking_mode != "greedy":
+                    options.append((promo, discount))
+                    continue
+                
                 # Vérifier cumul
                 if not promo.stackable and applied_promos:
                     # Ne pas cumuler avec d'autres promos
                     continue
                 
                 total_discount += discount
-                applied_promos.append({
-                    "id": promo.id,
-                    "name": promo.name,
-                    "type": promo.type,
-                    "discount": discount,
-                    "badge": promo.badge_text,
-                    "ticket_text": promo.ticket_text
-                })
+                applied_promos.append(self._applied_entry(promo, discount))
+        
+        if stacking_mode != "greedy" and options:
+            selected = self._solve_stacking(options, stacking_mode)
+            if selected is None:
+                # Budget dépassé : repli sur l'algorithme glouton
+                logger.warning(f"Solveur de cumul hors budget ({len(options)} promos), repli glouton")
+                stacking_mode = "greedy_fallback"
+                # Même règle que le chemin glouton : le multiplicateur fidélité déjà retenu compte
+                selected = []
+                for promo, discount in options:
+                    if promo.stackable or not (applied_promos or selected):
+                        selected.append((promo, discount))
+            
+            for promo, discount in selected:
+                total_discount += discount
+                applied_promos.append(self._applied_entry(promo, discount))
         
-        return {
+        response = {
             "original_total": cart.get("total", 0),
             "total_discount": total_discount,
             "final_total": max(0, cart.get("total", 0) - total_discount),
             "applied_promotions": applied_promos,
-            "loyalty_multiplier": loyalty_multiplier
+            "loyalty_multiplier": loyalty_multiplier,
+            "stacking_mode": stacking_mode
         }
+        
+        if traced:
+            for applied in applied_promos:
+                entry = trace_entries[applied["id"]]
+                entry["status"] = "applied"
+                entry["reason"] = None
+            for entry in trace_entries.values():
+                # Remise calculée mais écartée par les règles de cumul
+                if entry["status"] != "applied" and entry["discount"] > 0:
+                    entry["reason"] = "not_stacked"
+            promotion_metrics.record(trace_entries.values(), (perf_counter() - cart_start) * 1000)
+            if trace:
+                response["trace"] = list(trace_entries.values())
+        
+        return response
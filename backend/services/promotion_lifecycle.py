@@ -0,0 +1,131 @@
+"""
+Cycle de vie des promotions : bascules de statut programmées
+- draft validée (is_active) -> active le jour de start_date
+- active / draft -> expired le lendemain de end_date
+Le job se reprogramme sur la prochaine borne (minuit d'une date de début/fin ou
+bascule d'une plage horaire) et invalide le cache des promotions à cet instant.
+"""
+import logging
+from datetime import datetime, date, time, timedelta
+from typing import Any, Dict, Optional
+
+from apscheduler.triggers.date import DateTrigger
+
+from services.promotion_cache import promotion_cache
+from utils.time_utils import RESTAURANT_TIMEZONE, to_local, utc_now
+
+logger = logging.getLogger(__name__)
+
+TRANSITIONS_JOB_ID = "promotion_status_transitions"
+
+# Scheduler enregistré par scheduler_service.start_scheduler
+_scheduler = None
+_db = None
+
+
+async def apply_status_transitions(db, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Applique les bascules de statut dues à la date du jour (fuseau du restaurant)"""
+    now = now or to_local(utc_now())
+    today = now.date().isoformat()
+    updated_at = utc_now()
+
+    activated = await db.promotions.update_many(
+        {
+            "status": "draft",
+            "is_active": True,
+            "start_date": {"$lte": today},
+            "end_date": {"$gte": today}
+        },
+        {"$set": {"status": "active", "updated_at": updated_at}}
+    )
+    expired = await db.promotions.update_many(
+        {"status": {"$in": ["draft", "active"]}, "end_date": {"$lt": today}},
+        {"$set": {"status": "expired", "updated_at": updated_at}}
+    )
+
+    counts = {"activated": activated.modified_count, "expired": expired.modified_count}
+    if counts["activated"] or counts["expired"]:
+        logger.info(f"Promotions: {counts['activated']} activée(s), {counts['expired']} expirée(s)")
+    return counts
+
+
+def _midnight(day: Any) -> datetime:
+    return datetime.combine(date.fromisoformat(str(day)[:10]), time.min, tzinfo=RESTAURANT_TIMEZONE)
+
+
+async def next_transition_at(db, now: Optional[datetime] = None) -> datetime:
+    """Prochaine borne de statut ou d'activation horaire (au plus tard minuit prochain)"""
+    now = now or to_local(utc_now())
+    today = now.date().isoformat()
+    candidates = [_midnight(now.date() + timedelta(days=1))]
+
+    upcoming = await db.promotions.find(
+        {"status": "draft", "is_active": True, "start_date": {"$gt": today}},
+        {"_id": 0, "start_date": 1}
+    ).sort("start_date", 1).limit(1).to_list(length=1)
+    if upcoming:
+        candidates.append(_midnight(upcoming[0]["start_date"]))
+
+    ending = await db.promotions.find(
+        {"status": "active", "end_date": {"$gte": today}},
+        {"_id": 0, "end_date": 1}
+    ).sort("end_date", 1).limit(1).to_list(length=1)
+    if ending:
+        candidates.append(_midnight(ending[0]["end_date"]) + timedelta(days=1))
+
+    # Happy hours & co : début/fin de plage parmi les promotions en cache
+    snapshot = await promotion_cache.get_snapshot(db)
+    if snapshot.next_transition:
+        candidates.append(snapshot.next_transition)
+
+    return max(min(candidates), now + timedelta(seconds=1))
+
+
+async def promotion_transitions_job():
+    """Bascules de statut + invalidation du cache, puis reprogrammation"""
+    try:
+        await apply_status_transitions(_db)
+        promotion_cache.invalidate()
+    except Exception as e:
+        logger.error(f"❌ Erreur bascules de statut promotions: {str(e)}")
+    finally:
+        await _schedule_next()
+
+
+async def _schedule_next():
+    if _scheduler is None:
+        return
+    try:
+        run_at = await next_transition_at(_db)
+    except Exception as e:
+        logger.error(f"❌ Calcul de la prochaine bascule promotions impossible: {str(e)}")
+        run_at = utc_now() + timedelta(minutes=1)
+
+    _scheduler.add_job(
+        promotion_transitions_job,
+        trigger=DateTrigger(run_date=run_at),
+        id=TRANSITIONS_JOB_ID,
+        name="Bascules de statut promotions",
+        replace_existing=True
+    )
+
+
+def init_promotion_transitions(scheduler, db):
+    """Enregistre le job de bascules (exécution immédiate, puis auto-reprogrammation)"""
+    global _scheduler, _db
+    _scheduler = scheduler
+    _db = db
+    reschedule_promotion_transitions()
+
+
+def reschedule_promotion_transitions():
+    """À appeler après une modification admin : recalcule la prochaine bascule"""
+    if _scheduler is None:
+        return
+    _scheduler.add_job(
+        promotion_transitions_job,
+        trigger=DateTrigger(run_date=utc_now()),
+        id=TRANSITIONS_JOB_ID,
+        name="Bascules de statut promotions",
+        replace_existing=True
+    )
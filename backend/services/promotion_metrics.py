@@ -0,0 +1,108 @@
+"""
+Compteurs du moteur de promotions (évaluations, remises, rejets par raison, temps p50/p99)
+Alimentés par les évaluations tracées : trace explicite (simulate) ou échantillon
+d'une évaluation sur PROMO_METRICS_SAMPLE_RATE. Les autres évaluations ne paient
+qu'un incrément d'entier.
+"""
+import os
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+PROMO_METRICS_SAMPLE_RATE = int(os.environ.get("PROMO_METRICS_SAMPLE_RATE", "100"))
+
+# Fenêtre glissante des temps conservés par promotion pour les percentiles
+TIMING_WINDOW = 1000
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 4)
+
+
+class _PromotionStats:
+    __slots__ = ("name", "evaluations", "hits", "applied", "rejections", "timings")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.evaluations = 0
+        self.hits = 0
+        self.applied = 0
+        self.rejections: Dict[str, int] = {}
+        self.timings: Deque[float] = deque(maxlen=TIMING_WINDOW)
+
+    def to_dict(self) -> Dict[str, Any]:
+        timings = sorted(self.timings)
+        return {
+            "name": self.name,
+            "evaluations": self.evaluations,
+            "hits": self.hits,
+            "applied": self.applied,
+            "rejections": dict(self.rejections),
+            "p50_ms": _percentile(timings, 0.50),
+            "p99_ms": _percentile(timings, 0.99),
+            "total_sampled_ms": round(sum(timings), 3)
+        }
+
+
+class PromotionMetrics:
+    """Agrégats process-local (remis à zéro au redémarrage ou via reset)"""
+
+    def __init__(self, sample_rate: int = PROMO_METRICS_SAMPLE_RATE):
+        self.sample_rate = max(1, sample_rate)
+        self.reset()
+
+    def reset(self):
+        self.started_at = datetime.now(timezone.utc)
+        self.carts_evaluated = 0
+        self.carts_traced = 0
+        self._cart_timings: Deque[float] = deque(maxlen=TIMING_WINDOW)
+        self._stats: Dict[str, _PromotionStats] = {}
+
+    def tick(self) -> bool:
+        """Compte une évaluation de panier ; True si elle doit être tracée (échantillon)"""
+        self.carts_evaluated += 1
+        return self.carts_evaluated % self.sample_rate == 0
+
+    def record(self, entries: Iterable[Dict[str, Any]], cart_ms: float):
+        """Intègre la trace d'une évaluation de panier"""
+        self.carts_traced += 1
+        self._cart_timings.append(cart_ms)
+        for entry in entries:
+            stats = self._stats.get(entry["promotion_id"])
+            if stats is None:
+                stats = self._stats[entry["promotion_id"]] = _PromotionStats(entry["name"])
+
+            reason = entry.get("reason")
+            if entry.get("evaluation_ms") is not None:
+                stats.evaluations += 1
+                stats.timings.append(entry["evaluation_ms"])
+            if entry.get("discount", 0) > 0:
+                stats.hits += 1
+            if entry["status"] == "applied":
+                stats.applied += 1
+            elif reason:
+                stats.rejections[reason] = stats.rejections.get(reason, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        cart_timings = sorted(self._cart_timings)
+        promotions = {pid: stats.to_dict() for pid, stats in self._stats.items()}
+        return {
+            "since": self.started_at.isoformat(),
+            "sample_rate": self.sample_rate,
+            "carts_evaluated": self.carts_evaluated,
+            "carts_traced": self.carts_traced,
+            "cart_p50_ms": _percentile(cart_timings, 0.50),
+            "cart_p99_ms": _percentile(cart_timings, 0.99),
+            # Promotions les plus coûteuses en premier
+            "promotions": dict(sorted(
+                promotions.items(),
+                key=lambda item: item[1]["total_sampled_ms"],
+                reverse=True
+            ))
+        }
+
+
+promotion_metrics = PromotionMetrics()
@@ -0,0 +1,263 @@
+"""
+Réservation atomique des utilisations de promotions (limit_total / limit_per_customer)
+
+- limit_total : compteur réparti sur USAGE_STRIPES documents (stripes). Chaque stripe porte
+  une part du quota restant ; une réservation est un find-and-modify conditionnel
+  (remaining > 0) sur une stripe tirée au hasard, sans sérialiser toutes les commandes
+  sur un seul document chaud.
+- limit_per_customer : index d'utilisation par client, incrémenté sous condition count < limite.
+- Chaque réservation est tracée (promotion_reservations) et libérée à l'annulation de la commande.
+"""
+import logging
+import random
+import uuid
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from services.index_registry import ensure_collection_indexes
+from services.promotion_cache import promotion_cache
+from utils.time_utils import utc_now
+
+logger = logging.getLogger(__name__)
+
+USAGE_STRIPES = 8
+
+
+class PromotionLimitReached(Exception):
+    """Limite d'utilisation atteinte (reason: limit_total ou limit_per_customer)"""
+
+    def __init__(self, promotion_id: str, reason: str):
+        self.promotion_id = promotion_id
+        self.reason = reason
+        super().__init__(f"Promotion {promotion_id}: limite atteinte ({reason})")
+
+
+async def _ensure_indexes(db):
+    await ensure_collection_indexes(
+        db, "promotion_usage_counters", "promotion_customer_usage", "promotion_reservations"
+    )
+
+
+def _split(total: int, parts: int) -> List[int]:
+    """Répartit un quota sur les stripes (la somme vaut exactement total)"""
+    base, extra = divmod(max(0, total), parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+async def get_usage_count(db, promotion_id: str) -> int:
+    """Nombre d'utilisations réservées (somme des stripes)"""
+    result = await db.promotion_usage_counters.aggregate([
+        {"$match": {"promotion_id": promotion_id}},
+        {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+    ]).to_list(length=1)
+    return result[0]["count"] if result else 0
+
+
+async def configure_usage_limit(db, promotion_id: str, limit_total: Optional[int], legacy_usage_count: int = 0):
+    """
+    (Re)distribue le quota restant de limit_total sur les stripes.
+    À appeler à la création / modification de la limite d'une promotion.
+    """
+    await _ensure_indexes(db)
+
+    stripes = await db.promotion_usage_counters.find(
+        {"promotion_id": promotion_id}, {"_id": 0, "stripe": 1, "count": 1}
+    ).to_list(length=None)
+    used = sum(s.get("count", 0) for s in stripes) if stripes else legacy_usage_count
+
+    if limit_total is None:
+        shares = [None] * USAGE_STRIPES
+    else:
+        shares = _split(limit_total - used, USAGE_STRIPES)
+
+    for stripe, remaining in enumerate(shares):
+        update: Dict[str, Any] = {"$setOnInsert": {"count": used if stripe == 0 and not stripes else 0}}
+        if remaining is None:
+            update["$unset"] = {"remaining": ""}
+        else:
+            update["$set"] = {"remaining": remaining}
+        await db.promotion_usage_counters.update_one(
+            {"promotion_id": promotion_id, "stripe": stripe},
+            update,
+            upsert=True
+        )
+
+
+async def _reserve_customer(db, promotion_id: str, customer_id: str, limit: int):
+    try:
+        await db.promotion_customer_usage.find_one_and_update(
+            {"promotion_id": promotion_id, "customer_id": customer_id, "count": {"$lt": limit}},
+            {"$inc": {"count": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Le document existe déjà avec count >= limite : l'upsert a tenté un doublon
+        raise PromotionLimitReached(promotion_id, "limit_per_customer")
+
+
+async def _reserve_stripe(db, promotion: Any, limited: bool, configured: bool = False) -> int:
+    stripes = list(range(USAGE_STRIPES))
+    random.shuffle(stripes)
+
+    if not limited:
+        stripe = stripes[0]
+        await db.promotion_usage_counters.update_one(
+            {"promotion_id": promotion.id, "stripe": stripe},
+            {"$inc": {"count": 1}},
+            upsert=True
+        )
+        return stripe
+
+    # Stripe au hasard ; les suivantes ne sont essayées que si elle est épuisée
+    for stripe in stripes:
+        reserved = await db.promotion_usage_counters.find_one_and_update(
+            {"promotion_id": promotion.id, "stripe": stripe, "remaining": {"$gt": 0}},
+            {"$inc": {"count": 1, "remaining": -1}},
+            projection={"_id": 1}
+        )
+        if reserved:
+            return stripe
+
+    # Promotion dont le quota n'a jamais été réparti (créée hors admin, antérieure aux stripes)
+    if not configured:
+        initialized = await db.promotion_usage_counters.find_one(
+            {"promotion_id": promotion.id, "remaining": {"$exists": True}}, {"_id": 1}
+        )
+        if not initialized:
+            await configure_usage_limit(db, promotion.id, promotion.limit_total, promotion.usage_count)
+            return await _reserve_stripe(db, promotion, limited, configured=True)
+
+    raise PromotionLimitReached(promotion.id, "limit_total")
+
+
+async def reserve_promotion_usage(
+    db,
+    promotion: Any,
+    order_id: str,
+    customer_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Réserve une utilisation de la promotion pour une commande.
+    Idempotent par (promotion, commande). Lève PromotionLimitReached si une limite est atteinte.
+    """
+    await _ensure_indexes(db)
+
+    limited = bool(promotion.limit_total)
+    reservation = {
+        "id": str(uuid.uuid4()),
+        "promotion_id": promotion.id,
+        "order_id": order_id,
+        "customer_id": customer_id,
+        "stripe": None,
+        "limited": limited,
+        "per_customer": bool(promotion.limit_per_customer and customer_id),
+        "status": "reserved",
+        "created_at": utc_now(),
+        "released_at": None
+    }
+
+    # Le document de réservation sert de verrou d'idempotence
+    try:
+        await db.promotion_reservations.insert_one(dict(reservation))
+    except DuplicateKeyError:
+        existing = await db.promotion_reservations.find_one(
+            {"promotion_id": promotion.id, "order_id": order_id}, {"_id": 0}
+        )
+        if existing and existing.get("status") == "reserved":
+            return existing
+        # Réservation libérée précédemment : on repart d'un document neuf
+        await db.promotion_reservations.delete_one({"promotion_id": promotion.id, "order_id": order_id})
+        return await reserve_promotion_usage(db, promotion, order_id, customer_id)
+
+    customer_reserved = False
+    try:
+        if reservation["per_customer"]:
+            await _reserve_customer(db, promotion.id, customer_id, promotion.limit_per_customer)
+            customer_reserved = True
+
+        reservation["stripe"] = await _reserve_stripe(db, promotion, limited)
+    except Exception:
+        # Compensation : rien ne doit rester consommé si la réservation échoue
+        if customer_reserved:
+            await db.promotion_customer_usage.update_one(
+                {"promotion_id": promotion.id, "customer_id": customer_id},
+                {"$inc": {"count": -1}}
+            )
+        await db.promotion_reservations.delete_one({"id": reservation["id"]})
+        raise
+
+    await db.promotion_reservations.update_one(
+        {"id": reservation["id"]},
+        {"$set": {"stripe": reservation["stripe"]}}
+    )
+    promotion_cache.note_usage(promotion.id)
+    return reservation
+
+
+async def reserve_applied_promotions(
+    db,
+    applied_promotions: List[Dict[str, Any]],
+    order_id: str,
+    customer_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Réserve les promotions appliquées par le moteur à une commande (cf. apply_promotions)"""
+    snapshot = await promotion_cache.get_snapshot(db)
+    reservations = []
+    for applied in applied_promotions:
+        promotion = snapshot.by_id.get(applied["id"])
+        if promotion is not None:
+            reservations.append(await reserve_promotion_usage(db, promotion, order_id, customer_id))
+    return reservations
+
+
+async def release_order_reservations(db, order_id: str) -> int:
+    """Libère les réservations d'une commande annulée (idempotent). Retourne le nombre libéré."""
+    released = 0
+    reservations = await db.promotion_reservations.find(
+        {"order_id": order_id, "status": "reserved"}, {"_id": 0}
+    ).to_list(length=None)
+
+    for reservation in reservations:
+        # Transition reserved -> released conditionnelle : une seule libération possible
+        claimed = await db.promotion_reservations.find_one_and_update(
+            {"id": reservation["id"], "status": "reserved"},
+            {"$set": {"status": "released", "released_at": utc_now()}}
+        )
+        if not claimed:
+            continue
+
+        if reservation.get("stripe") is not None:
+            inc = {"count": -1, "remaining": 1} if reservation.get("limited") else {"count": -1}
+            await db.promotion_usage_counters.update_one(
+                {"promotion_id": reservation["promotion_id"], "stripe": reservation["stripe"]},
+                {"$inc": inc}
+            )
+        if reservation.get("per_customer"):
+            await db.promotion_customer_usage.update_one(
+                {"promotion_id": reservation["promotion_id"], "customer_id": reservation["customer_id"]},
+                {"$inc": {"count": -1}}
+            )
+        promotion_cache.note_usage(reservation["promotion_id"], -1)
+        released += 1
+
+    return released
+
+
+async def sync_promotion_usage_counts(db) -> int:
+    """
+    Reporte la somme des stripes dans promotions.usage_count (affichage admin, cache moteur).
+    Exécuté périodiquement par le scheduler plutôt qu'à chaque commande.
+    """
+    totals = await db.promotion_usage_counters.aggregate([
+        {"$group": {"_id": "$promotion_id", "count": {"$sum": "$count"}}}
+    ]).to_list(length=None)
+
+    for total in totals:
+        await db.promotions.update_one(
+            {"id": total["_id"], "usage_count": {"$ne": total["count"]}},
+            {"$set": {"usage_count": total["count"]}}
+        )
+    return len(totals)
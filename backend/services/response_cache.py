@@ -0,0 +1,56 @@
+"""
+Cache de réponses à durée de vie courte, avec calcul unique (single-flight)
+Pendant le calcul d'une clé, les appels concurrents attendent le même calcul au lieu
+d'en lancer un autre : N onglets qui interrogent en même temps = une seule requête.
+Process-local, comme promotion_cache.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class ResponseCache:
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        # clé -> (expiration, valeur)
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # Incrémentée à chaque invalidation : un calcul démarré avant n'est pas conservé
+        self._generations: Dict[Hashable, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "joined": 0}
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Invalide une clé (toutes sans argument)"""
+        keys = [key] if key is not None else list(set(self._entries) | set(self._inflight))
+        for k in keys:
+            self._entries.pop(k, None)
+            # Les appels suivants relancent un calcul ; celui en cours sert ses appelants
+            self._inflight.pop(k, None)
+            self._generations[k] = self._generations.get(k, 0) + 1
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        entry = self._entries.get(key)
+        if entry is not None and loop.time() < entry[0]:
+            self.stats["hits"] += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["joined"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._compute(key, compute, self._generations.get(key, 0)))
+            self._inflight[key] = task
+        # shield : l'abandon d'un appelant (client déconnecté) n'annule pas le calcul partagé
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        try:
+            value = await compute()
+            if generation == self._generations.get(key, 0):
+                self._entries[key] = (asyncio.get_running_loop().time() + self.ttl_seconds, value)
+            return value
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
@@ -5,9 +5,15 @@ Job nocturne à 2h du matin pour générer de nouvelles campagnes
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, timezone
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timezone, timedelta
 from services.ai_marketing_service import analyze_and_generate_campaigns
 from models.ai_campaign import AICampaignSuggestion
+from services.promotion_usage import sync_promotion_usage_counts
+from services.promotion_lifecycle import init_promotion_transitions
+from services.order_archive import archive_closed_days
+from services.daily_sales import reconcile_daily_sales
+from utils.time_utils import local_today
 from database import db
 import logging
 
@@ -75,6 +81,38 @@ async def generate_nightly_campaigns_job():
         })
 
 
+async def sync_promotion_usage_job():
+    """
+    Consolide les compteurs d'utilisation des promotions (stripes) dans promotions.usage_count
+    """
+    try:
+        await sync_promotion_usage_counts(db)
+    except Exception as e:
+        logger.error(f"❌ Erreur consolidation usage promotions: {str(e)}")
+
+
+async def archive_orders_job():
+    """
+    Déplace les commandes des journées clôturées anciennes vers orders_archive
+    """
+    try:
+        await archive_closed_days(db)
+    except Exception as e:
+        logger.error(f"❌ Erreur archivage commandes: {str(e)}")
+
+
+async def reconcile_daily_sales_job():
+    """
+    Compare les accumulateurs daily_sales (aujourd'hui et la veille) aux commandes
+    """
+    try:
+        today = local_today()
+        for day in (today - timedelta(days=1), today):
+            await reconcile_daily_sales(db, day.isoformat())
+    except Exception as e:
+        logger.error(f"❌ Erreur réconciliation ventes du jour: {str(e)}")
+
+
 def start_scheduler():
     """
     Démarre le scheduler avec le job nocturne à 2h
@@ -89,6 +127,36 @@ def start_scheduler():
             replace_existing=True
         )
         
+        # Consolidation des compteurs d'utilisation des promotions
+        scheduler.add_job(
+            sync_promotion_usage_job,
+            trigger=IntervalTrigger(minutes=5),
+            id="promotion_usage_sync",
+            name="Consolidation usage_count promotions",
+            replace_existing=True
+        )
+        
+        # Archivage nocturne des commandes (hors service)
+        scheduler.add_job(
+            archive_orders_job,
+            trigger=CronTrigger(hour=4, minute=30),
+            id="orders_archive",
+            name="Archivage des commandes des journées clôturées",
+            replace_existing=True
+        )
+        
+        # Réconciliation des accumulateurs de ventes avec les commandes
+        scheduler.add_job(
+            reconcile_daily_sales_job,
+            trigger=IntervalTrigger(minutes=15),
+            id="daily_sales_reconcile",
+            name="Réconciliation des ventes du jour",
+            replace_existing=True
+        )
+        
+        # Bascules de statut / plages horaires des promotions (job auto-reprogrammé)
+        init_promotion_transitions(scheduler, db)
+        
         scheduler.start()
         logger.info("⏰ Scheduler IA Marketing démarré - Job nocturne programmé à 2h")
 
@@ -0,0 +1,102 @@
+"""
+Allocation de numéros séquentiels (numéros de commande FD-XXXX)
+Compteur MongoDB incrémenté atomiquement ($inc) par blocs : chaque worker réserve
+ORDER_NUMBER_BLOCK_SIZE numéros d'un coup et les distribue sans aller-retour.
+Unicité garantie entre workers ; l'ordre chronologique et la continuité ne le sont
+pas (les numéros restants d'un bloc sont perdus au redémarrage d'un worker).
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from utils.time_utils import local_today
+
+ORDER_NUMBER_PREFIX = os.environ.get("ORDER_NUMBER_PREFIX", "FD")
+# global : FD-2042 ; daily : FD-251017-0042 (compteur remis à zéro chaque jour)
+ORDER_NUMBER_SCOPE = os.environ.get("ORDER_NUMBER_SCOPE", "global")
+ORDER_NUMBER_BLOCK_SIZE = int(os.environ.get("ORDER_NUMBER_BLOCK_SIZE", "20"))
+# Les numéros historiques partent de FD-2000
+ORDER_NUMBER_OFFSET = 2000
+
+
+class SequenceAllocator:
+    """Séquences par clé, distribuées par blocs réservés dans la collection counters"""
+
+    def __init__(self, name: str, block_size: int):
+        self.name = name
+        self.block_size = max(1, block_size)
+        # clé -> [prochaine valeur, fin du bloc (exclue)]
+        self._blocks: Dict[str, List[int]] = {}
+        self._seeded = set()
+        self._lock = asyncio.Lock()
+
+    async def _seed(self, db, counter_id: str, initial_value: int):
+        """Initialise le compteur une seule fois (reprise d'un historique existant)"""
+        try:
+            await db.counters.update_one(
+                {"_id": counter_id},
+                {"$setOnInsert": {"value": initial_value}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Upsert concurrent d'un autre worker : le compteur existe déjà
+            pass
+
+    async def next_value(
+        self,
+        db,
+        key: str,
+        initial_value: Optional[Callable[[], Awaitable[int]]] = None
+    ) -> int:
+        """
+        Valeur suivante de la séquence (à partir de 1).
+        initial_value : valeur de départ d'un compteur inexistant, évaluée une fois par process.
+        """
+        counter_id = f"{self.name}:{key}"
+        async with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                if initial_value is not None and counter_id not in self._seeded:
+                    await self._seed(db, counter_id, await initial_value())
+                    self._seeded.add(counter_id)
+
+                counter = await db.counters.find_one_and_update(
+                    {"_id": counter_id},
+                    {"$inc": {"value": self.block_size}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                end = counter["value"] + 1
+                block = self._blocks[key] = [end - self.block_size, end]
+
+            value = block[0]
+            block[0] += 1
+            return value
+
+
+order_number_allocator = SequenceAllocator("order_number", ORDER_NUMBER_BLOCK_SIZE)
+
+
+async def allocate_order_number(db, restaurant_id: Optional[str] = None) -> str:
+    """
+    Numéro de commande unique.
+    Avec restaurant_id, chaque restaurant a sa propre séquence.
+    """
+    key_parts = [restaurant_id] if restaurant_id else []
+
+    if ORDER_NUMBER_SCOPE == "daily":
+        # Journée du restaurant : la numérotation repart à minuit local
+        day = local_today().strftime("%y%m%d")
+        number = await order_number_allocator.next_value(db, ":".join(key_parts + [day]))
+        return f"{ORDER_NUMBER_PREFIX}-{day}-{number:04d}"
+
+    # Reprise : la séquence démarre après les commandes déjà numérotées par comptage
+    async def existing_orders() -> int:
+        return await db.orders.count_documents({})
+
+    key = ":".join(key_parts) or "global"
+    number = await order_number_allocator.next_value(db, key, existing_orders)
+    return f"{ORDER_NUMBER_PREFIX}-{number - 1 + ORDER_NUMBER_OFFSET:04d}"
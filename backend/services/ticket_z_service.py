@@ -0,0 +1,119 @@
+"""
+Synthèse d'une journée pour le Ticket Z
+Une seule agrégation $facet côté MongoDB : comptes et totaux par statut, encaissements
+par mode de paiement (paiements fractionnés dépliés) et TVA par taux depuis le vat_rate
+des articles. La réponse ne contient que quelques lignes, quel que soit le nombre de commandes.
+"""
+from typing import Any, Dict, List
+
+from utils.time_utils import day_range_query
+
+COMPLETED_STATUS = "completed"
+# Les deux orthographes coexistent en base (OrderStatus.CANCELED et anciens écrans)
+CANCELLED_STATUSES = ["canceled", "cancelled"]
+CLOSED_STATUSES = [COMPLETED_STATUS] + CANCELLED_STATUSES
+
+# Taux appliqué aux articles enregistrés avant la TVA par produit (CatalogProduct)
+DEFAULT_VAT_RATE = 10.0
+
+# Modes de paiement des commandes -> rubriques du Ticket Z (PaymentBreakdown)
+PAYMENT_METHOD_ALIASES = {
+    "cash": "espece",
+    "card": "cb",
+    "check": "cheque",
+    "ticket_resto": "ticket_restaurant",
+}
+
+
+def _number(expression: Any) -> Dict[str, Any]:
+    return {"$ifNull": [expression, 0]}
+
+
+def day_summary_pipeline(date: str) -> List[Dict[str, Any]]:
+    completed = {"$match": {"status": COMPLETED_STATUS}}
+    return [
+        {"$match": day_range_query(date)},
+        {"$facet": {
+            "by_status": [
+                {"$group": {"_id": "$status", "count": {"$sum": 1}, "total": {"$sum": _number("$total")}}},
+            ],
+            "payments": [
+                completed,
+                # Paiement fractionné : une ligne par paiement ; sinon (payment_method, total)
+                {"$unwind": {"path": "$payments", "preserveNullAndEmptyArrays": True}},
+                {"$group": {
+                    "_id": {"$ifNull": ["$payments.method", "$payment_method"]},
+                    "amount": {"$sum": _number({"$ifNull": ["$payments.amount", "$total"]})}
+                }},
+            ],
+            "vat": [
+                completed,
+                # TTC après remises promotions, réparties au prorata des lignes (comme pricing_service)
+                {"$project": {"_id": 0, "items": 1, "ratio": {"$cond": [
+                    {"$gt": [_number("$subtotal"), 0]},
+                    {"$divide": [
+                        {"$subtract": [_number("$subtotal"), _number("$promo_discount")]},
+                        _number("$subtotal")
+                    ]},
+                    1
+                ]}}},
+                {"$unwind": "$items"},
+                {"$group": {
+                    "_id": {"$ifNull": ["$items.vat_rate", DEFAULT_VAT_RATE]},
+                    "total_ttc": {"$sum": {"$multiply": [_number("$items.total_price"), "$ratio"]}}
+                }},
+            ],
+        }},
+    ]
+
+
+def _count(by_status: Dict[str, Dict[str, Any]], statuses: List[str]) -> int:
+    return sum(by_status[status]["count"] for status in statuses if status in by_status)
+
+
+def _vat_breakdown(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    breakdown = []
+    for row in sorted(rows, key=lambda r: float(r["_id"])):
+        rate = float(row["_id"])
+        amount_ttc = row["total_ttc"]
+        vat = amount_ttc * rate / (100 + rate)
+        breakdown.append({
+            "rate": rate,
+            "base_ht": round(amount_ttc - vat, 2),
+            "vat_amount": round(vat, 2),
+            "total_ttc": round(amount_ttc, 2)
+        })
+    return breakdown
+
+
+async def summarize_day(db, date: str) -> Dict[str, Any]:
+    """
+    Chiffres de la journée (YYYY-MM-DD, fuseau du restaurant) en un aller-retour.
+    Retourne total_orders, completed_orders, cancelled_orders, pending_orders,
+    total_sales, payment_breakdown {rubrique: montant}, vat_breakdown et tva_collected.
+    """
+    facets = (await db.orders.aggregate(day_summary_pipeline(date)).to_list(length=1))[0]
+
+    by_status = {row["_id"]: row for row in facets["by_status"]}
+    total_orders = sum(row["count"] for row in by_status.values())
+
+    payment_breakdown: Dict[str, float] = {}
+    for row in facets["payments"]:
+        method = row["_id"]
+        if not method:
+            continue
+        method = PAYMENT_METHOD_ALIASES.get(method, method)
+        payment_breakdown[method] = round(payment_breakdown.get(method, 0.0) + row["amount"], 2)
+
+    vat_breakdown = _vat_breakdown(facets["vat"])
+    completed = by_status.get(COMPLETED_STATUS, {})
+    return {
+        "total_orders": total_orders,
+        "completed_orders": completed.get("count", 0),
+        "cancelled_orders": _count(by_status, CANCELLED_STATUSES),
+        "pending_orders": total_orders - _count(by_status, CLOSED_STATUSES),
+        "total_sales": round(completed.get("total", 0.0), 2),
+        "payment_breakdown": payment_breakdown,
+        "vat_breakdown": vat_breakdown,
+        "tva_collected": round(sum(b["vat_amount"] for b in vat_breakdown), 2)
+    }
@@ -0,0 +1,102 @@
+"""
+Migration des horodatages chaîne ISO -> datetime BSON
+Les anciens documents stockent created_at, updated_at... en chaîne : invisibles des
+filtres datetime (utils/time_utils.py). Rejouable : seuls les champs encore en chaîne
+sont sélectionnés et réécrits, par lots bulk_write.
+"""
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from utils.time_utils import to_datetime
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 1000
+
+# Champs horodatés par collection ; "status_history.at" : entrées du tableau
+TIMESTAMP_FIELDS: Dict[str, List[str]] = {
+    "orders": ["created_at", "updated_at", "refunded_at", "status_history.at"],
+    "orders_archive": ["created_at", "updated_at", "refunded_at", "status_history.at"],
+    "promotions": ["created_at", "updated_at", "analytics.backtest.computed_at"],
+    "promotion_backtests": ["created_at", "finished_at", "result.computed_at"],
+    "promotion_usage_log": ["created_at"],
+    "promotion_reservations": ["created_at", "released_at"],
+    "notifications": ["created_at", "updated_at", "sent_at", "scheduled_at"],
+    "tickets_z": ["closed_at", "created_at", "archived_at"],
+}
+
+HISTORY_FIELD = "status_history.at"
+
+
+def _get_path(doc: Dict[str, Any], field: str) -> Any:
+    """Valeur d'un champ éventuellement imbriqué ("analytics.backtest.computed_at")"""
+    value: Any = doc
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _converted_fields(doc: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """$set des champs chaîne convertibles (les valeurs illisibles restent en place)"""
+    update: Dict[str, Any] = {}
+    for field in fields:
+        if field == HISTORY_FIELD:
+            history = doc.get("status_history") or []
+            converted = [
+                {**entry, "at": to_datetime(entry["at"])}
+                if isinstance(entry, dict) and isinstance(entry.get("at"), str) and to_datetime(entry["at"])
+                else entry
+                for entry in history
+            ]
+            if converted != history:
+                update["status_history"] = converted
+            continue
+        value = _get_path(doc, field)
+        if isinstance(value, str):
+            moment = to_datetime(value)
+            if moment is not None:
+                update[field] = moment
+    return update
+
+
+async def migrate_collection(db, name: str, dry_run: bool = False) -> Dict[str, int]:
+    """Convertit une collection ; retourne {"scanned", "updated", "unparsable"}"""
+    fields = TIMESTAMP_FIELDS[name]
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field.split(".")[0]: 1 for field in fields}
+
+    counts = {"scanned": 0, "updated": 0, "unparsable": 0}
+    operations: List[UpdateOne] = []
+
+    async def flush():
+        if operations and not dry_run:
+            await db[name].bulk_write(operations, ordered=False)
+        counts["updated"] += len(operations)
+        operations.clear()
+
+    async for doc in db[name].find(query, projection).batch_size(MIGRATION_BATCH_SIZE):
+        counts["scanned"] += 1
+        update = _converted_fields(doc, fields)
+        if not update:
+            counts["unparsable"] += 1
+            continue
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if len(operations) >= MIGRATION_BATCH_SIZE:
+            await flush()
+    await flush()
+
+    if counts["unparsable"]:
+        logger.warning(f"{name}: {counts['unparsable']} document(s) avec un horodatage illisible")
+    return counts
+
+
+async def migrate_timestamps(
+    db,
+    collections: Optional[Iterable[str]] = None,
+    dry_run: bool = False
+) -> Dict[str, Dict[str, int]]:
+    return {name: await migrate_collection(db, name, dry_run) for name in (collections or TIMESTAMP_FIELDS)}
@@ -0,0 +1,402 @@
+"""
+Tests automatiques des commandes et des chiffres de vente
+Ils écrivent des commandes : run_order_tests travaille sur une base dédiée
+(<base>_tests), supprimée à la fin.
+
+Usage : python -m tests.test_orders   (MONGO_URL / DB_NAME comme les scripts)
+"""
+import asyncio
+import os
+
+from pymongo.errors import DuplicateKeyError
+
+from services import cashback_service
+from services.daily_sales import get_daily_sales, reconcile_daily_sales, record_order_created, record_status_changes
+from services.index_registry import ensure_indexes
+from services.idempotency_service import IdempotencyConflict, IdempotencyStore, request_fingerprint
+from services.order_status import StatusTransitionError, bulk_transition_order_status, transition_order_status
+from services.product_sales import get_category_sales, rebuild_product_sales, record_completed_orders
+from services.sequence_service import SequenceAllocator
+from services.ticket_z_service import summarize_day
+from utils.time_utils import local_today, utc_now
+
+RESTAURANT_ID = "test-restaurant"
+
+
+def make_order(order_id, total=10.0, status="new", **fields):
+    """Commande minimale en base de test"""
+    now = utc_now()
+    order = {
+        "id": order_id,
+        "restaurant_id": RESTAURANT_ID,
+        "order_number": f"T-{order_id}",
+        "status": status,
+        "payment_status": "paid",
+        "payment_method": "card",
+        "consumption_mode": "takeaway",
+        "order_type": "takeaway",
+        "subtotal": total,
+        "total": total,
+        "items": [],
+        "status_history": [{"status": status, "at": now}],
+        "created_at": now,
+    }
+    order.update(fields)
+    return order
+
+
+class OrderTester:
+    """Tests automatiques des commandes (idempotence, numérotation, statuts, rapports)"""
+
+    def __init__(self, db):
+        self.db = db
+        self.results = []
+
+    async def run_all_tests(self):
+        """Lance tous les tests"""
+        print("\n" + "="*60)
+        print("🧪 TESTS AUTOMATIQUES DES COMMANDES FAMILY'S")
+        print("="*60 + "\n")
+
+        await self.test_unique_indexes()
+        await self.test_sequence_restart()
+        await self.test_idempotency_replay()
+        await self.test_idempotency_conflict()
+        await self.test_cashback_concurrent_debits()
+        await self.test_status_transitions()
+        await self.test_ticket_z_summary()
+        await self.test_daily_sales_accumulator()
+        await self.test_product_sales_rollup()
+
+        self.print_report()
+
+    def log_result(self, test_name, passed, message=""):
+        """Enregistre un résultat de test"""
+        status = "✅ PASS" if passed else "❌ FAIL"
+        self.results.append({
+            "test": test_name,
+            "passed": passed,
+            "message": message
+        })
+        print(f"{status} - {test_name}")
+        if message:
+            print(f"     └─ {message}")
+
+    async def test_unique_indexes(self):
+        """Index uniques déclarés : upserts concurrents sans doublon"""
+        print("\n🗂️ Test: Index déclarés")
+
+        await ensure_indexes(self.db, ["daily_sales", "product_daily_sales"])
+        duplicates = 0
+        for collection, doc in (
+            ("daily_sales", {"restaurant_id": RESTAURANT_ID, "day": "2026-01-01"}),
+            ("product_daily_sales", {"restaurant_id": RESTAURANT_ID, "day": "2026-01-01", "product_id": "p1"}),
+        ):
+            await self.db[collection].insert_one(dict(doc))
+            try:
+                await self.db[collection].insert_one(dict(doc))
+            except DuplicateKeyError:
+                duplicates += 1
+            await self.db[collection].delete_many({})
+
+        if duplicates == 2:
+            self.log_result("Index uniques", True, "Doublons refusés sur daily_sales et product_daily_sales")
+        else:
+            self.log_result("Index uniques", False, f"{2 - duplicates} doublon(s) accepté(s)")
+
+    async def test_sequence_restart(self):
+        """Numéros uniques et croissants entre workers et après redémarrage"""
+        print("\n🔢 Test: Numérotation des commandes")
+
+        async def existing_orders():
+            return 41
+
+        worker_a = SequenceAllocator("test_sequence", block_size=5)
+        worker_b = SequenceAllocator("test_sequence", block_size=5)
+        first = [await worker_a.next_value(self.db, "r1", existing_orders) for _ in range(3)]
+        concurrent = await asyncio.gather(*(
+            worker.next_value(self.db, "r1", existing_orders)
+            for worker in (worker_a, worker_b) for _ in range(6)
+        ))
+        # Redémarrage : blocs en mémoire perdus, le compteur MongoDB continue
+        restarted = SequenceAllocator("test_sequence", block_size=5)
+        after_restart = await restarted.next_value(self.db, "r1", existing_orders)
+
+        issued = first + list(concurrent) + [after_restart]
+        unique = len(set(issued)) == len(issued)
+        continues = after_restart > max(first + list(concurrent)) and after_restart - max(issued[:-1]) <= 5
+        if first == [42, 43, 44] and unique and continues:
+            self.log_result("Numérotation", True, f"{len(issued)} numéros uniques, reprise à {after_restart}")
+        else:
+            self.log_result("Numérotation", False, f"Numéros {issued}")
+
+    async def test_idempotency_replay(self):
+        """Rejeu d'une clé : réponse mémorisée, y compris après redémarrage"""
+        print("\n🔁 Test: Idempotency-Key rejouée")
+
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            return {"id": f"order-{len(calls)}"}
+
+        fingerprint = request_fingerprint('{"items": [1]}')
+        store = IdempotencyStore()
+        first = await store.run(self.db, "key-replay", fingerprint, handler)
+        replay = await store.run(self.db, "key-replay", fingerprint, handler)
+        # Nouveau process : LRU vide, réponse relue dans idempotency_keys
+        after_restart = await IdempotencyStore().run(self.db, "key-replay", fingerprint, handler)
+
+        if len(calls) == 1 and first == replay == after_restart == {"id": "order-1"}:
+            self.log_result("Idempotency rejeu", True, "Une seule création, même réponse (LRU et MongoDB)")
+        else:
+            self.log_result("Idempotency rejeu", False, f"{len(calls)} création(s), réponses {first} {replay} {after_restart}")
+
+    async def test_idempotency_conflict(self):
+        """Même clé, corps différent : 409 pendant et après la requête d'origine"""
+        print("\n⛔ Test: Idempotency-Key réutilisée")
+
+        store = IdempotencyStore()
+        release = asyncio.Event()
+        calls = []
+
+        async def slow_handler():
+            calls.append(1)
+            await release.wait()
+            return {"id": "order-a"}
+
+        first = asyncio.ensure_future(store.run(self.db, "key-conflict", request_fingerprint("a"), slow_handler))
+        await asyncio.sleep(0)
+
+        async def concurrent():
+            return await store.run(self.db, "key-conflict", request_fingerprint("b"), slow_handler)
+
+        conflicts = 0
+        try:
+            await asyncio.wait_for(concurrent(), timeout=1)
+        except IdempotencyConflict:
+            conflicts += 1
+        except asyncio.TimeoutError:
+            # Rattaché à la requête d'origine au lieu d'être refusé
+            pass
+        release.set()
+        response = await first
+
+        try:
+            await store.run(self.db, "key-conflict", request_fingerprint("b"), slow_handler)
+        except IdempotencyConflict:
+            conflicts += 1
+
+        if conflicts == 2 and len(calls) == 1 and response == {"id": "order-a"}:
+            self.log_result("Idempotency conflit", True, "Corps différent refusé en cours et après")
+        else:
+            self.log_result("Idempotency conflit", False, f"{conflicts} conflit(s), {len(calls)} création(s)")
+
+    async def test_cashback_concurrent_debits(self):
+        """Débits simultanés : le solde ne devient jamais négatif"""
+        print("\n💰 Test: Débit cashback concurrent")
+
+        # cashback_service a sa propre connexion : dirigée vers la base de test le temps du test
+        service_db = cashback_service.db
+        cashback_service.db = self.db
+        try:
+            await self.db.customers.insert_one({"id": "cashback-customer", "loyalty_points": 10.0})
+            outcomes = await asyncio.gather(
+                *(cashback_service.deduct_cashback_from_customer("cashback-customer", 3.0) for _ in range(5)),
+                return_exceptions=True
+            )
+            credited = await cashback_service.add_cashback_to_customer("cashback-customer", 2.0)
+        finally:
+            cashback_service.db = service_db
+
+        debited = sum(1 for outcome in outcomes if isinstance(outcome, dict) and outcome["success"])
+        refused = sum(1 for outcome in outcomes if isinstance(outcome, ValueError))
+        if debited == 3 and refused == 2 and credited["new_balance"] == 3.0:
+            self.log_result("Cashback concurrent", True, "3 débits acceptés sur 5, solde jamais négatif")
+        else:
+            self.log_result("Cashback concurrent", False, f"{debited} débit(s), {refused} refus, solde {credited['new_balance']}")
+
+    async def test_status_transitions(self):
+        """Compare-and-set : transitions interdites refusées, une seule validation simultanée"""
+        print("\n🚦 Test: Transitions de statut")
+
+        await self.db.orders.insert_many([
+            make_order("cas-new"),
+            make_order("cas-unpaid", status="ready", payment_status="pending"),
+            make_order("cas-ready", status="ready"),
+        ])
+
+        async def rejection(order_id, new_status):
+            try:
+                await transition_order_status(self.db, order_id, RESTAURANT_ID, new_status)
+            except StatusTransitionError as e:
+                return e.status_code
+            return None
+
+        illegal = await rejection("cas-new", "completed")
+        unpaid = await rejection("cas-unpaid", "completed")
+        missing = await rejection("cas-missing", "in_preparation")
+
+        outcomes = await asyncio.gather(
+            *(transition_order_status(self.db, "cas-ready", RESTAURANT_ID, "completed") for _ in range(3)),
+            return_exceptions=True
+        )
+        succeeded = [o for o in outcomes if isinstance(o, tuple)]
+
+        bulk = await bulk_transition_order_status(self.db, RESTAURANT_ID, [
+            {"order_id": "cas-new", "status": "in_preparation"},
+            {"order_id": "cas-ready", "status": "new"},
+        ])
+        bulk_ok = [r["success"] for r in bulk] == [True, False] and bulk[0]["previous_status"] == "new"
+
+        stored = await self.db.orders.find_one({"id": "cas-ready"}, {"_id": 0, "status_history": 1})
+        completions = sum(1 for h in stored["status_history"] if h["status"] == "completed")
+        await self.db.orders.delete_many({"id": {"$in": ["cas-new", "cas-unpaid", "cas-ready"]}})
+        if (illegal, unpaid, missing) == (400, 400, 404) and len(succeeded) == 1 and completions == 1 \
+                and succeeded[0][1] == "ready" and bulk_ok:
+            self.log_result("Transitions de statut", True, "Refus 400/404, une seule validation sur 3 simultanées")
+        else:
+            self.log_result("Transitions de statut", False,
+                            f"Codes {(illegal, unpaid, missing)}, {len(succeeded)} validation(s), lot {bulk}")
+
+    async def test_ticket_z_summary(self):
+        """Ticket Z : paiements fractionnés, rubriques et TVA par taux après remise"""
+        print("\n🧾 Test: Ticket Z")
+
+        await self.db.orders.insert_many([
+            make_order("z-card", 22.0, status="completed", items=[
+                {"total_price": 11.0, "vat_rate": 10},
+                {"total_price": 11.0},  # taux par défaut
+            ]),
+            # Remise promo de 5€ sur 20€ : TVA calculée sur 75% de chaque ligne
+            make_order("z-split", 15.0, status="completed", subtotal=20.0, promo_discount=5.0,
+                       payments=[{"method": "cash", "amount": 5.0}, {"method": "card", "amount": 10.0}],
+                       items=[{"total_price": 12.0, "vat_rate": 20}, {"total_price": 8.0, "vat_rate": 5.5}]),
+            make_order("z-canceled", 50.0, status="canceled"),
+            make_order("z-pending", 7.0),
+        ])
+
+        summary = await summarize_day(self.db, local_today().isoformat())
+        await self.db.orders.delete_many({"id": {"$regex": "^z-"}})
+
+        vat = {row["rate"]: (row["total_ttc"], row["vat_amount"]) for row in summary["vat_breakdown"]}
+        expected_vat = {5.5: (6.0, 0.31), 10.0: (22.0, 2.0), 20.0: (9.0, 1.5)}
+        counts = (summary["total_orders"], summary["completed_orders"], summary["cancelled_orders"], summary["pending_orders"])
+        if counts == (4, 2, 1, 1) and summary["total_sales"] == 37.0 \
+                and summary["payment_breakdown"] == {"cb": 32.0, "espece": 5.0} \
+                and vat == expected_vat and summary["tva_collected"] == 3.81:
+            self.log_result("Ticket Z", True, "Paiements fractionnés et TVA par taux corrects")
+        else:
+            self.log_result("Ticket Z", False, f"{counts} {summary['payment_breakdown']} {vat} {summary['tva_collected']}")
+
+    async def test_daily_sales_accumulator(self):
+        """Accumulateur $inc identique au recalcul de reconcile_daily_sales"""
+        print("\n📈 Test: Accumulateur daily_sales")
+
+        # Commande ancienne : pas de status_history
+        legacy = make_order("sales-legacy", 30.0, status="in_preparation")
+        del legacy["status_history"]
+        orders = [
+            make_order("sales-1", 12.5),
+            make_order("sales-2", 20.0, payment_method="cash"),
+            make_order("sales-3", 7.0),
+            legacy,
+        ]
+        for order in orders:
+            await self.db.orders.insert_one(dict(order))
+            await record_order_created(self.db, order)
+
+        changes = [await transition_order_status(self.db, "sales-1", RESTAURANT_ID, "in_preparation")]
+        changes.append(await transition_order_status(self.db, "sales-legacy", RESTAURANT_ID, "ready"))
+        results = await bulk_transition_order_status(self.db, RESTAURANT_ID, [
+            {"order_id": "sales-2", "status": "canceled"},
+            {"order_id": "sales-3", "status": "in_preparation"},
+        ])
+        changes += [(r["order"], r["previous_status"]) for r in results if r["success"]]
+        await record_status_changes(self.db, changes)
+
+        sales = await get_daily_sales(self.db, restaurant_id=RESTAURANT_ID)
+        counts = {status: count for status, count in sales["status_counts"].items() if count}
+        reconciled = await reconcile_daily_sales(self.db)
+
+        expected_counts = {"new": 0, "in_preparation": 2, "ready": 1, "canceled": 1}
+        if counts == {k: v for k, v in expected_counts.items() if v} and reconciled["repaired"] == 0:
+            self.log_result("Accumulateur daily_sales", True, "Identique au recalcul, commandes anciennes comprises")
+        else:
+            self.log_result("Accumulateur daily_sales", False, f"Statuts {counts}, {reconciled['repaired']} réparation(s)")
+
+    async def test_product_sales_rollup(self):
+        """Rollup product_daily_sales incrémental identique à rebuild_product_sales"""
+        print("\n🍔 Test: Ventes par produit")
+
+        burger = {"product_id": "p-burger", "name": "Burger", "category_id": "c-plats", "quantity": 2, "total_price": 24.0}
+        soda = {"product_id": "p-soda", "name": "Soda", "category_id": "c-boissons", "quantity": 1, "total_price": 3.5}
+        await self.db.orders.insert_many([
+            make_order("ps-1", status="ready", items=[burger, soda]),
+            make_order("ps-2", status="ready", items=[dict(burger, quantity=1, total_price=12.0)]),
+            make_order("ps-3", status="ready", items=[soda]),  # reste non terminée
+        ])
+        completed, _ = await transition_order_status(self.db, "ps-1", RESTAURANT_ID, "completed")
+        await record_completed_orders(self.db, [completed])
+        results = await bulk_transition_order_status(self.db, RESTAURANT_ID, [{"order_id": "ps-2", "status": "completed"}])
+        await record_completed_orders(self.db, [r["order"] for r in results if r["success"]])
+
+        def rows(docs):
+            return sorted((d["product_id"], d["quantity"], round(d["revenue"], 2), d.get("category_id")) for d in docs)
+
+        projection = {"_id": 0, "product_id": 1, "quantity": 1, "revenue": 1, "category_id": 1}
+        incremental = rows(await self.db.product_daily_sales.find({}, projection).to_list(length=None))
+        categories = await get_category_sales(self.db, RESTAURANT_ID, days=1)
+        await rebuild_product_sales(self.db, local_today().isoformat())
+        rebuilt = rows(await self.db.product_daily_sales.find({}, projection).to_list(length=None))
+        await self.db.orders.delete_many({"id": {"$regex": "^ps-"}})
+
+        expected = [("p-burger", 3, 36.0, "c-plats"), ("p-soda", 1, 3.5, "c-boissons")]
+        if incremental == rebuilt == expected and categories["c-plats"] == {"quantity": 3, "revenue": 36.0}:
+            self.log_result("Ventes par produit", True, "Rollup incrémental identique à la reconstruction")
+        else:
+            self.log_result("Ventes par produit", False, f"Incrémental {incremental}, reconstruit {rebuilt}")
+
+    def print_report(self):
+        """Affiche le rapport final"""
+        print("\n" + "="*60)
+        print("📊 RAPPORT DES TESTS")
+        print("="*60)
+
+        total = len(self.results)
+        passed = sum(1 for r in self.results if r["passed"])
+        failed = total - passed
+
+        print(f"\nTotal tests: {total}")
+        print(f"✅ Réussis: {passed}")
+        print(f"❌ Échoués: {failed}")
+
+        if failed > 0:
+            print("\n❌ Tests échoués:")
+            for r in self.results:
+                if not r["passed"]:
+                    print(f"   • {r['test']}: {r['message']}")
+        else:
+            print("🎉 TOUS LES TESTS SONT PASSÉS!")
+
+        print("\n" + "="*60 + "\n")
+
+
+# Fonction pour lancer les tests
+async def run_order_tests(db):
+    client = db.client
+    test_db_name = f"{db.name}_tests"
+    await client.drop_database(test_db_name)
+    try:
+        tester = OrderTester(client[test_db_name])
+        await tester.run_all_tests()
+    finally:
+        await client.drop_database(test_db_name)
+    return tester.results
+
+
+if __name__ == "__main__":
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    mongo_client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    asyncio.run(run_order_tests(mongo_client[os.environ.get("DB_NAME", "familys_restaurant")]))
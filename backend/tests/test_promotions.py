@@ -2,6 +2,8 @@ import asyncio
 from datetime import datetime, date, time, timedelta
 from services.promotion_engine import PromotionEngine
 from models.promotion import Promotion, PromotionType, DiscountValueType
+from services.promotion_cache import CompiledPromotion, PromotionSnapshot, week_minute
+from services.promotion_batch import simulate_batch
 
 class PromotionTester:
     """Tests automatiques pour tous les types de promotions"""
@@ -30,6 +32,13 @@ class PromotionTester:
         await self.test_loyalty_multiplier()
         await self.test_promo_code()
         await self.test_priority_and_stacking()
+        await self.test_exclusions()
+        await self.test_inverted_index()
+        await self.test_batch_simulation()
+        await self.test_stacking_solver()
+        await self.test_stacking_fallback()
+        await self.test_activation_timeline()
+        await self.test_rejection_reasons()
         
         self.print_report()
     
@@ -494,6 +503,218 @@ class PromotionTester:
         else:
             self.log_result("Non-cumul", False, "Flag stackable incorrect")
     
+    async def test_exclusions(self):
+        """Test exclusions produit/catégorie"""
+        print("\n🚫 Test: Exclusions")
+        
+        promo = Promotion(
+            id="test-exclusions",
+            restaurant_id="test",
+            name="15% Burgers sauf Signature",
+            description="15% sur les burgers, hors burger signature",
+            type=PromotionType.PERCENT_CATEGORY,
+            discount_type=DiscountValueType.PERCENTAGE,
+            discount_value=15,
+            eligible_categories=["cat-burgers"],
+            excluded_products=["prod-signature"],
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=30),
+            status="active",
+            is_active=True
+        )
+        
+        cart = {
+            "items": [
+                {"product_id": "prod-1", "category_id": "cat-burgers", "name": "Burger 1", "price": 10.0, "quantity": 1},
+                {"product_id": "prod-signature", "category_id": "cat-burgers", "name": "Signature", "price": 14.0, "quantity": 1}
+            ],
+            "total": 24.0
+        }
+        
+        result = self.engine.calculate_discount(promo, cart)
+        
+        # Seul le burger 1 est remisé : 15% de 10€ = 1.5€
+        expected = 1.5
+        if abs(result["discount"] - expected) < 0.01:
+            self.log_result("Exclusions - produit exclu non remisé", True, f"Remise correcte: {result['discount']:.2f}€")
+        else:
+            self.log_result("Exclusions - produit exclu non remisé", False, f"Remise attendue: {expected}€, reçue: {result['discount']}€")
+    
+    async def test_inverted_index(self):
+        """Test index inversé produit/catégorie"""
+        print("\n🗂️ Test: Index inversé")
+        
+        base = {
+            "restaurant_id": "test",
+            "discount_type": "percentage",
+            "discount_value": 10,
+            "start_date": date.today().isoformat(),
+            "end_date": (date.today() + timedelta(days=30)).isoformat()
+        }
+        promos = [
+            CompiledPromotion({**base, "id": "idx-burger", "name": "Burger", "type": "percent_item", "eligible_products": ["prod-1"], "priority": 5}),
+            CompiledPromotion({**base, "id": "idx-drinks", "name": "Boissons", "type": "percent_category", "eligible_categories": ["cat-drinks"], "priority": 3}),
+            CompiledPromotion({**base, "id": "idx-cart", "name": "Panier", "type": "flash", "priority": 1})
+        ]
+        snapshot = PromotionSnapshot(promos, datetime.now(), datetime.now() + timedelta(minutes=1))
+        
+        items = [{"product_id": "prod-1", "category_id": "cat-burgers", "price": 10.0, "quantity": 1}]
+        candidate_ids = [p.id for p in snapshot.candidates_for(items)]
+        
+        # Le burger ne touche pas la promo boissons ; la promo panier reste candidate
+        if candidate_ids == ["idx-burger", "idx-cart"]:
+            self.log_result("Index inversé", True, "Seules les promos ciblant le panier sont évaluées")
+        else:
+            self.log_result("Index inversé", False, f"Candidates inattendues: {candidate_ids}")
+    
+    async def test_batch_simulation(self):
+        """Test simulation vectorisée sur un lot de paniers"""
+        print("\n📦 Test: Simulation par lot")
+        
+        base = {
+            "restaurant_id": "test",
+            "start_date": date.today().isoformat(),
+            "end_date": (date.today() + timedelta(days=30)).isoformat()
+        }
+        promos = [
+            CompiledPromotion({**base, "id": "batch-bogo", "name": "BOGO", "type": "bogo", "discount_type": "free_item",
+                               "discount_value": 100, "eligible_products": ["prod-1"], "priority": 10}),
+            CompiledPromotion({**base, "id": "batch-threshold", "name": "Seuil", "type": "threshold", "discount_type": "fixed",
+                               "discount_value": 5, "min_cart_amount": 30, "priority": 5, "stackable": True})
+        ]
+        carts = [
+            {"items": [{"product_id": "prod-1", "price": 10.0, "quantity": 2}], "total": 20.0},
+            {"items": [{"product_id": "prod-2", "price": 16.0, "quantity": 2}], "total": 32.0},
+            {"items": [{"product_id": "prod-1", "price": 10.0, "quantity": 4}], "total": 40.0}
+        ]
+        
+        result = simulate_batch(promos, carts, include_carts=True)
+        discounts = [c["total_discount"] for c in result["cart_results"]]
+        
+        # BOGO 10€ ; seuil 5€ ; BOGO 20€ + seuil cumulable 5€
+        if discounts == [10.0, 5.0, 25.0]:
+            self.log_result("Simulation par lot", True, f"Remises correctes: {discounts}")
+        else:
+            self.log_result("Simulation par lot", False, f"Remises attendues: [10.0, 5.0, 25.0], reçues: {discounts}")
+    
+    async def test_stacking_solver(self):
+        """Test solveur de cumul (stackable / stacking_group)"""
+        print("\n🧩 Test: Solveur de cumul")
+        
+        base = {
+            "restaurant_id": "test",
+            "discount_type": "percentage",
+            "discount_value": 10,
+            "start_date": date.today().isoformat(),
+            "end_date": (date.today() + timedelta(days=30)).isoformat()
+        }
+        exclusive = CompiledPromotion({**base, "id": "solver-exclusive", "name": "Exclusive", "type": "flash", "priority": 10})
+        burger_a = CompiledPromotion({**base, "id": "solver-a", "name": "A", "type": "percent_item", "stackable": True, "stacking_group": "burgers", "priority": 8})
+        burger_b = CompiledPromotion({**base, "id": "solver-b", "name": "B", "type": "percent_item", "stackable": True, "stacking_group": "burgers", "priority": 6})
+        drinks = CompiledPromotion({**base, "id": "solver-c", "name": "C", "type": "percent_item", "stackable": True, "priority": 4})
+        options = [(exclusive, 5.0), (burger_a, 2.0), (burger_b, 3.0), (drinks, 1.5)]
+        
+        customer_best = [p.id for p, _ in self.engine._solve_stacking(options, "customer_best")]
+        restaurant_best = [p.id for p, _ in self.engine._solve_stacking(options, "restaurant_best")]
+        
+        # Client : B + C (4.5€) < exclusive (5€) ; restaurant : A + C (3.5€), une seule promo par groupe
+        if customer_best == ["solver-exclusive"] and restaurant_best == ["solver-a", "solver-c"]:
+            self.log_result("Solveur de cumul", True, "Combinaisons optimales client et restaurant")
+        else:
+            self.log_result("Solveur de cumul", False, f"Client: {customer_best}, restaurant: {restaurant_best}")
+    
+    async def test_stacking_fallback(self):
+        """Test repli glouton du solveur hors budget (multiplicateur fidélité déjà retenu)"""
+        print("\n🪂 Test: Repli glouton du solveur")
+        
+        base = {
+            "restaurant_id": "test",
+            "discount_type": "percentage",
+            "discount_value": 10,
+            "start_date": date.today().isoformat(),
+            "end_date": (date.today() + timedelta(days=30)).isoformat()
+        }
+        loyalty = CompiledPromotion({**base, "id": "fallback-loyalty", "name": "Points x2", "type": "loyalty_multiplier", "multiplier_value": 2.0, "priority": 10})
+        exclusive = CompiledPromotion({**base, "id": "fallback-exclusive", "name": "Exclusive", "type": "flash", "priority": 5})
+        cart = {"items": [{"product_id": "prod-1", "price": 10.0, "quantity": 2}], "total": 20.0}
+        
+        async def applicable(*args):
+            return [loyalty, exclusive]
+        
+        engine = PromotionEngine(self.db)
+        engine.get_applicable_promotions = applicable
+        greedy = await engine.apply_promotions(cart, stacking_mode="greedy")
+        engine._solve_stacking = lambda options, mode: None
+        fallback = await engine.apply_promotions(cart, stacking_mode="customer_best")
+        
+        greedy_ids = [p["id"] for p in greedy["applied_promotions"]]
+        fallback_ids = [p["id"] for p in fallback["applied_promotions"]]
+        if fallback["stacking_mode"] == "greedy_fallback" and fallback_ids == greedy_ids == ["fallback-loyalty"]:
+            self.log_result("Repli glouton du solveur", True, "Même sélection que le mode glouton")
+        else:
+            self.log_result("Repli glouton du solveur", False, f"Glouton: {greedy_ids}, repli: {fallback_ids}")
+    
+    async def test_activation_timeline(self):
+        """Test timeline hebdomadaire d'activation (happy hour)"""
+        print("\n🕔 Test: Timeline d'activation")
+        
+        promo = CompiledPromotion({
+            "restaurant_id": "test",
+            "id": "timeline-hh",
+            "name": "Happy Hour vendredi",
+            "type": "happy_hour",
+            "discount_type": "percentage",
+            "discount_value": 20,
+            "days_active": ["fri"],
+            "start_time": "17:00",
+            "end_time": "19:00",
+            "start_date": date.today().isoformat(),
+            "end_date": (date.today() + timedelta(days=30)).isoformat()
+        })
+        
+        # Vendredi 16/10/2026 : avant, pendant, après la plage ; jeudi à la même heure
+        before = datetime(2026, 10, 16, 16, 59, 30)
+        snapshot = PromotionSnapshot([promo], before, before + timedelta(minutes=1))
+        active = [
+            promo.is_active_at(week_minute(datetime(2026, 10, 16, 18, 0))),
+            promo.is_active_at(week_minute(datetime(2026, 10, 16, 19, 1))),
+            promo.is_active_at(week_minute(datetime(2026, 10, 15, 18, 0)))
+        ]
+        
+        if active == [True, False, False] and not snapshot.active and snapshot.expires_at == datetime(2026, 10, 16, 17, 0):
+            self.log_result("Timeline d'activation", True, "Bascule exacte à 17:00, snapshot expiré à la borne")
+        else:
+            self.log_result("Timeline d'activation", False, f"Actif: {active}, expiration: {snapshot.expires_at}")
+    
+    async def test_rejection_reasons(self):
+        """Test raisons de rejet (mode trace)"""
+        print("\n🔎 Test: Raisons de rejet")
+        
+        base = {
+            "restaurant_id": "test",
+            "discount_type": "percentage",
+            "discount_value": 10,
+            "start_date": date.today().isoformat(),
+            "end_date": (date.today() + timedelta(days=30)).isoformat()
+        }
+        threshold = CompiledPromotion({**base, "id": "reason-min", "name": "Seuil", "type": "threshold", "min_cart_amount": 30})
+        coded = CompiledPromotion({**base, "id": "reason-code", "name": "Code", "type": "flash", "promo_code": "VIP", "code_required": True})
+        welcome = CompiledPromotion({**base, "id": "reason-new", "name": "Bienvenue", "type": "flash", "target_new_customers": True})
+        
+        cart = {"items": [{"product_id": "prod-1", "price": 10.0, "quantity": 2}], "total": 20.0}
+        customer = {"orders_count": 3}
+        reasons = [
+            self.engine._rejection_reason(threshold, cart, customer, None),
+            self.engine._rejection_reason(coded, cart, customer, None),
+            self.engine._rejection_reason(coded, cart, customer, "VIP"),
+            self.engine._rejection_reason(welcome, cart, customer, None)
+        ]
+        
+        if reasons == ["min_cart_amount", "promo_code", None, "new_customers_only"]:
+            self.log_result("Raisons de rejet", True, "Première condition non remplie identifiée")
+        else:
+            self.log_result("Raisons de rejet", False, f"Raisons inattendues: {reasons}")
+    
     def print_report(self):
         """Affiche le rapport final"""
         print("\n" + "="*60)
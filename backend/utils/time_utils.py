@@ -0,0 +1,87 @@
+"""
+Horodatages des commandes, promotions et notifications
+Stockage : datetime BSON (UTC), jamais de chaîne ISO ; un filtre chaîne ne trouve pas
+les dates BSON et inversement. Les bornes de journée sont calculées dans le fuseau du
+restaurant (RESTAURANT_TIMEZONE) puis converties en UTC : toutes les fenêtres de dates
+s'écrivent {"champ": {"$gte": début, "$lt": fin}} et utilisent l'index du champ.
+"""
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple, Union
+from zoneinfo import ZoneInfo
+
+RESTAURANT_TIMEZONE = ZoneInfo(os.environ.get("RESTAURANT_TIMEZONE", "Europe/Paris"))
+
+DateLike = Union[str, date, datetime]
+
+
+def utc_now() -> datetime:
+    """Instant courant tronqué à la milliseconde (précision BSON : relu à l'identique)"""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def to_datetime(value: Any) -> Optional[datetime]:
+    """datetime UTC depuis un datetime ou une chaîne ISO ; sans fuseau = UTC ; None si illisible"""
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, str) and value:
+        try:
+            moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    else:
+        return None
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def to_local(value: Any) -> Optional[datetime]:
+    """Instant exprimé dans le fuseau du restaurant"""
+    moment = to_datetime(value)
+    return moment.astimezone(RESTAURANT_TIMEZONE) if moment else None
+
+
+def local_today(now: Optional[datetime] = None) -> date:
+    return (now or utc_now()).astimezone(RESTAURANT_TIMEZONE).date()
+
+
+def local_date(value: Any) -> Optional[str]:
+    """Journée restaurant (YYYY-MM-DD) d'un horodatage"""
+    moment = to_local(value)
+    return moment.date().isoformat() if moment else None
+
+
+def _as_date(day: DateLike) -> date:
+    if isinstance(day, datetime):
+        return day.astimezone(RESTAURANT_TIMEZONE).date()
+    if isinstance(day, date):
+        return day
+    return date.fromisoformat(str(day)[:10])
+
+
+def local_day_start(day: DateLike) -> datetime:
+    """Minuit local de la journée, en UTC (changements d'heure compris)"""
+    return datetime.combine(_as_date(day), time.min, RESTAURANT_TIMEZONE).astimezone(timezone.utc)
+
+
+def local_day_bounds(date_from: DateLike, date_to: Optional[DateLike] = None) -> Tuple[datetime, datetime]:
+    """[début, fin) UTC des journées locales date_from à date_to incluses"""
+    end_day = _as_date(date_to if date_to is not None else date_from)
+    return local_day_start(date_from), local_day_start(end_day + timedelta(days=1))
+
+
+def day_range_query(
+    date_from: DateLike,
+    date_to: Optional[DateLike] = None,
+    field: str = "created_at"
+) -> Dict[str, Any]:
+    """Filtre sur les journées locales date_from à date_to incluses (YYYY-MM-DD)"""
+    start, end = local_day_bounds(date_from, date_to)
+    return {field: {"$gte": start, "$lt": end}}
+
+
+def since_query(delta: timedelta, field: str = "created_at", now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Filtre sur une fenêtre glissante (7 derniers jours...)"""
+    return {field: {"$gte": (now or utc_now()) - delta}}